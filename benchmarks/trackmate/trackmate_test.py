@@ -48,15 +48,6 @@ def load_true(basedir, fname):
     return np.load(os.path.join(basedir, "test_labels", f"{fname}.npy"))
 
 
-@dask.delayed
-def process(fname, pred, true):
-    """Processes a single prediction / true set returning a DataFrame with all metrics."""
-    df = pink.metrics.compute_metrics(pred, true)
-    df["fname"] = fname
-    return df
-
-
-@dask.delayed
 def save(basedir, fname, df):
     """Save the output of one run as csv file."""
     outname = os.path.join(basedir, "test_processed", f"{fname}.csv")
@@ -82,19 +73,24 @@ def main():
     files = glob.glob(os.path.join(basedir, "test_predictions", "*.csv"))
 
     def f(files):
-        """Processes all files by calling delayed functions for each step."""
+        """Loads all files by calling delayed functions for each step."""
         results = []
 
         for file in files:
             fname, pred = load_prediction(file, threshold)
             true = load_true(basedir, fname)
-            df = process(fname, pred, true)
-            result = save(basedir, fname, df)
-            results.append(result)
+            results.append((fname, pred, true))
 
         return results
 
     result = dask.compute(f(files))[0]  # Returns tuple
+    fnames, preds, trues = zip(*result)
+
+    df, _ = pink.metrics.evaluate_dataset(preds, trues, n_jobs=-1)
+    for idx, df_file in df.groupby("image"):
+        df_file = df_file.drop(columns="image")
+        df_file["fname"] = fnames[idx]
+        save(basedir, fnames[idx], df_file.reset_index(drop=True))
     print("Files processed.")
 
     client.shutdown()
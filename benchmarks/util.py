@@ -23,13 +23,10 @@ def print_results(results: pd.DataFrame):
     for name in results.name.unique():
         df = results[results["name"] == name]
 
-        p = 4
-        f1_m = df[df["cutoff"] == 3]["f1_score"].mean().round(p)
-        f1_s = df[df["cutoff"] == 3]["f1_score"].std().round(p)
-        f1i_m = df["f1_integral"].mean().round(p)
-        f1i_s = df["f1_integral"].std().round(p)
-        rmse_m = df["mean_euclidean"].mean().round(p)
-        rmse_s = df["mean_euclidean"].std().round(p)
+        summary = pink.metrics.summarize_metrics(df, mdist=3).round(4)
+        f1_m, f1_s = summary.loc["f1_score"]
+        f1i_m, f1i_s = summary.loc["f1_integral"]
+        rmse_m, rmse_s = summary.loc["mean_euclidean"]
 
         print(
             f"Evaluation of {name}:\n"
@@ -62,13 +59,6 @@ def delayed_coordinates(mask):
     return coords
 
 
-@dask.delayed
-def delayed_compute(pred, true, idx):
-    df = pink.metrics.compute_metrics(pred, true, mdist=3)
-    df["image"] = idx
-    return df
-
-
 def delayed_results(
     model_dataset: tuple,
     model_loader: callable,
@@ -76,7 +66,7 @@ def delayed_results(
     delayed_coordinates: callable,
 ):
     """Distributedly compute all results across datasets and model pairs."""
-    results = pd.DataFrame()
+    results = pink.util.ColumnBuffer()
     for name, fname_model, dataset in model_dataset:
         print(f"Starting evaluation of {name}.")
 
@@ -84,21 +74,20 @@ def delayed_results(
         x_test, y_test = pink.io.load_npz(dataset, test_only=True)
         model = model_loader(fname_model)
 
-        def f(images, trues):
-            results = []
+        def f(images):
+            preds = []
 
-            for idx, (image, true) in enumerate(zip(images, trues)):
+            for image in images:
                 image = delayed_normalize(image)
                 pred = delayed_predict(model, image)
                 pred = delayed_coordinates(pred)
-                df = delayed_compute(pred, true, idx)
-                results.append(df)
+                preds.append(pred)
 
-            return results
+            return preds
 
-        # Compute results
-        result = dask.compute(f(x_test, y_test))[0]  # Returns tuple
-        df = pd.concat(result)
+        # Compute predictions and evaluate in parallel
+        preds = dask.compute(f(x_test))[0]  # Returns tuple
+        df, _ = pink.metrics.evaluate_dataset(preds, y_test, mdist=3, n_jobs=-1)
         df["name"] = name
-        results = results.append(df)
-    return results
+        results.append(df)
+    return results.to_frame()
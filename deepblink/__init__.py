@@ -18,16 +18,40 @@ Modules are arranged as follows:
 
 __version__ = "0.0.6"
 
-from . import augment
-from . import cli
-from . import data
-from . import datasets
-from . import inference
-from . import io
-from . import losses
-from . import metrics
-from . import models
-from . import networks
-from . import optimizers
-from . import training
-from . import util
+import importlib
+import sys
+
+# Submodules are imported on first access to keep the CLI startup fast.
+# Training, for example, pulls in tensorflow, wandb, and matplotlib.
+_SUBMODULES = (
+    "augment",
+    "cli",
+    "data",
+    "datasets",
+    "inference",
+    "io",
+    "losses",
+    "metrics",
+    "models",
+    "networks",
+    "optimizers",
+    "training",
+    "util",
+)
+
+
+def __getattr__(name: str):
+    """Import submodules lazily (PEP 562)."""
+    if name in _SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    """List submodules although they might not be imported yet."""
+    return sorted(list(globals()) + list(_SUBMODULES))
+
+
+if sys.version_info < (3, 7):  # pragma: no cover
+    for _name in _SUBMODULES:
+        importlib.import_module(f".{_name}", __name__)
@@ -1,6 +1,7 @@
 """Model utility functions for augmentation."""
 
-from typing import Tuple
+from typing import Callable, List, Tuple
+import functools
 import warnings
 
 import numpy as np
@@ -42,31 +43,218 @@ def augment_batch_baseline(
             UserWarning,
         )
 
-    aug_images = []
-    aug_masks = []
+    augmentations: List[Callable[..., Tuple[np.ndarray, np.ndarray]]] = []
+    if flip_:
+        augmentations.append(flip_batch)
+    if illuminate_:
+        augmentations.append(illuminate_batch)
+    if gaussian_noise_:
+        augmentations.append(gaussian_noise_batch)
+    if rotate_:
+        augmentations.append(rotate_batch)
+    if translate_:
+        augmentations.append(functools.partial(translate_batch, cell_size=cell_size))
+
+    # Alternate between two preallocated buffers instead of copying every image
+    buffers = [
+        (np.empty(images.shape, np.float32), np.empty(masks.shape, np.float32))
+        for _ in range(min(len(augmentations), 2))
+    ]
+    aug_images, aug_masks = images, masks
+    for idx, augmentation in enumerate(augmentations):
+        aug_images, aug_masks = augmentation(
+            aug_images, aug_masks, out=buffers[idx % 2]
+        )
 
-    for image, mask in zip(images, masks):
-        aug_image = image.copy()
-        aug_mask = mask.copy()
+    aug_images = np.asarray(aug_images, dtype=np.float32)
+    aug_masks = np.asarray(aug_masks, dtype=np.float32)
+    if aug_images is images:
+        aug_images = aug_images.copy()
+    if aug_masks is masks:
+        aug_masks = aug_masks.copy()
 
-        if flip_:
-            aug_image, aug_mask = flip(aug_image, aug_mask)
-        if illuminate_:
-            aug_image, aug_mask = illuminate(aug_image, aug_mask)
-        if gaussian_noise_:
-            aug_image, aug_mask = gaussian_noise(aug_image, aug_mask)
-        if rotate_:
-            aug_image, aug_mask = rotate(aug_image, aug_mask)
-        if translate_:
-            aug_image, aug_mask = translate(aug_image, aug_mask, cell_size=cell_size)
+    return aug_images, aug_masks
 
-        aug_images.append(aug_image)
-        aug_masks.append(aug_mask)
 
-    aug_images = np.array(aug_images, dtype=np.float32)
-    aug_masks = np.array(aug_masks, dtype=np.float32)
+def _get_output(
+    images: np.ndarray, masks: np.ndarray, out: Tuple[np.ndarray, np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Return output buffers for batch augmentation, allocated if not passed."""
+    if out is None:
+        return (
+            np.empty(images.shape, dtype=np.float32),
+            np.empty(masks.shape, dtype=np.float32),
+        )
+    if out[0].shape != images.shape or out[1].shape != masks.shape:
+        raise ValueError(
+            f"Output buffers with shapes {out[0].shape}, {out[1].shape} "
+            f"don't match inputs with shapes {images.shape}, {masks.shape}."
+        )
+    return out
 
-    return aug_images, aug_masks
+
+def _roll_batch(
+    arr: np.ndarray, shift: np.ndarray, direction: np.ndarray
+) -> np.ndarray:
+    """Roll every sample of arr by its shift along its direction (0 for x, 1 for y).
+
+    Equivalent to np.roll(arr[i], shift[i], direction[i]) for every sample i using a
+    single fancy-indexing operation.
+    """
+    n, size_x, size_y = arr.shape[:3]
+    shift = shift.reshape(-1, 1, 1)
+    direction = direction.reshape(-1, 1, 1)
+    rows = (np.arange(size_x)[None, :, None] - shift * (direction == 0)) % size_x
+    cols = (np.arange(size_y)[None, None, :] - shift * (direction == 1)) % size_y
+    return arr[np.arange(n)[:, None, None], rows, cols]
+
+
+def flip_batch(
+    images: np.ndarray, masks: np.ndarray, out: Tuple[np.ndarray, np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Batch version of "flip" with one random flipping axis per sample.
+
+    Args:
+        images: Batch of images to be augmented with shape (n, x, y).
+        masks: Batch of prediction matrices with shape (n, r, c, 3).
+        out: Preallocated float32 output buffers for images and masks.
+    """
+    out_images, out_masks = _get_output(images, masks, out)
+    rand_flip = np.random.randint(low=0, high=2, size=len(images))
+
+    # Samples are flipped in one group per axis
+    for axis in range(2):
+        index = np.nonzero(rand_flip == axis)[0]
+        if not index.size:
+            continue
+        out_images[index] = np.flip(images[index], axis + 1)
+        flipped = np.flip(masks[index], axis + 1)
+
+        # Mirror the coordinate along the flipped axis (1 for horizontal, 2 for vertical)
+        coords = flipped[..., axis + 1]
+        np.subtract(1, coords, out=coords, where=flipped[..., 0] != 0)
+        out_masks[index] = flipped
+
+    return out_images, out_masks
+
+
+def illuminate_batch(
+    images: np.ndarray, masks: np.ndarray, out: Tuple[np.ndarray, np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Batch version of "illuminate" with one random illumination per sample.
+
+    Args:
+        images: Batch of images to be augmented with shape (n, x, y).
+        masks: Batch of prediction matrices with shape (n, r, c, 3).
+        out: Preallocated float32 output buffers for images and masks.
+    """
+    out_images, out_masks = _get_output(images, masks, out)
+    rand_illumination = (
+        (1 + np.random.uniform(-0.75, 0.75, size=len(images)))
+        .astype(np.float32)
+        .reshape((-1,) + (1,) * (images.ndim - 1))
+    )
+
+    np.multiply(images, rand_illumination, out=out_images, casting="unsafe")
+    if out_masks is not masks:
+        out_masks[...] = masks
+    return out_images, out_masks
+
+
+def gaussian_noise_batch(
+    images: np.ndarray,
+    masks: np.ndarray,
+    mean: int = 0,
+    out: Tuple[np.ndarray, np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Batch version of "gaussian_noise" with one random noise level per sample.
+
+    Args:
+        images: Batch of images to be augmented with shape (n, x, y).
+        masks: Batch of prediction matrices with shape (n, r, c, 3).
+        mean: Average noise pixel values added. Zero means no net difference occurs.
+        out: Preallocated float32 output buffers for images and masks.
+    """
+    out_images, out_masks = _get_output(images, masks, out)
+    sigma = np.random.uniform(0.0001, 0.01, size=len(images))
+
+    # Draw single precision noise from a generator seeded by the global state
+    rng = np.random.default_rng(np.random.randint(2 ** 32, dtype=np.uint64))
+    noisy = rng.standard_normal(images.shape, dtype=np.float32)
+    noisy *= sigma.astype(np.float32).reshape((-1,) + (1,) * (images.ndim - 1))
+    noisy += mean
+    noisy += images
+
+    # Overflowing noise is replaced with one (upper) and zero (lower) as in "gaussian_noise"
+    overflow_upper = noisy >= 1.0
+    overflow_lower = noisy < 0
+    np.add(images, 1.0, out=noisy, where=overflow_upper, casting="unsafe")
+    np.copyto(noisy, images, where=overflow_lower, casting="unsafe")
+    out_images[...] = noisy
+
+    if out_masks is not masks:
+        out_masks[...] = masks
+    return out_images, out_masks
+
+
+def rotate_batch(
+    images: np.ndarray, masks: np.ndarray, out: Tuple[np.ndarray, np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Batch version of "rotate" with one random number of rotations per sample.
+
+    Args:
+        images: Batch of images to be augmented with shape (n, x, y).
+        masks: Batch of prediction matrices with shape (n, r, c, 3).
+        out: Preallocated float32 output buffers for images and masks.
+    """
+    out_images, out_masks = _get_output(images, masks, out)
+    rand_rotate = np.random.randint(low=0, high=4, size=len(images))
+
+    # Samples are rotated in one group per number of rotations
+    for k in range(4):
+        index = np.nonzero(rand_rotate == k)[0]
+        if not index.size:
+            continue
+        out_images[index] = np.rot90(images[index], k, axes=(1, 2))
+        mask = np.rot90(masks[index], k, axes=(1, 2))
+
+        # Rotate coordinates +90 degrees (with translation) once per image rotation
+        r_coord, c_coord = mask[..., 1], mask[..., 2]
+        for _ in range(k):
+            r_coord, c_coord = 1 - c_coord, r_coord
+
+        out_mask = np.stack([mask[..., 0], r_coord, c_coord], axis=-1)
+        if k:
+            out_mask[..., 1:][out_mask[..., 0] == 0] = 0
+        out_masks[index] = out_mask
+
+    return out_images, out_masks
+
+
+def translate_batch(
+    images: np.ndarray,
+    masks: np.ndarray,
+    cell_size: int = 4,
+    out: Tuple[np.ndarray, np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Batch version of "translate" with one random direction and shift per sample.
+
+    Args:
+        images: Batch of images to be augmented with shape (n, x, y).
+        masks: Batch of prediction matrices with shape (n, r, c, 3).
+        cell_size: Size of one cell in the prediction matrix.
+        out: Preallocated float32 output buffers for images and masks.
+    """
+    out_images, out_masks = _get_output(images, masks, out)
+    direction = np.random.randint(low=0, high=2, size=len(images))
+    shift_mask = np.random.randint(
+        low=0, high=images.shape[1] // cell_size, size=len(images)
+    )
+    shift_image = shift_mask * cell_size
+
+    out_images[...] = _roll_batch(images, shift_image, direction)
+    out_masks[...] = _roll_batch(masks, shift_mask, direction)
+    return out_images, out_masks
 
 
 def flip(image: np.ndarray, mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
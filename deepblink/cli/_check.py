@@ -6,7 +6,7 @@ import os
 import textwrap
 
 from ..io import EXTENSIONS
-from ..io import load_image
+from ..io import LazyImage
 from ..util import predict_shape
 from ._parseutil import CustomFormatter
 from ._parseutil import FileType
@@ -82,5 +82,5 @@ class HandleCheck:
 
     @property
     def image(self):
-        """Load a single image."""
-        return load_image(self.abs_input)
+        """Open a single image only reading the header if possible."""
+        return LazyImage(self.abs_input)
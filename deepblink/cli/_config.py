@@ -80,18 +80,25 @@ class HandleConfig:
                 "value": False,
             },
             "dataset": {
-                "description": "Name of dataset class",
+                "description": "Name of dataset class, ChunkedSpotsDataset for datasets larger than memory",
                 "value": "SpotsDataset",
             },
             "dataset_args": {
                 "version": {
-                    "description": "Path to dataset.npz file",
+                    "description": "Path to dataset.npz file or chunked dataset directory",
                     "value": "PATH/TO/DATASET.NPZ",
                 },
                 "cell_size": {
                     "description": "Size of one cell in the grid",
                     "value": 4,
                 },
+                "cache_dir": {
+                    "description": (
+                        "Directory to cache prepared datasets for faster loading, e.g. ~/.cache/deepblink. "
+                        "Caches are never removed automatically, null disables caching"
+                    ),
+                    "value": None,
+                },
                 "flip": {
                     "description": "If flipping should be used as augmentation",
                     "value": False,
@@ -145,6 +152,13 @@ class HandleConfig:
                     "description": "If model should overfit to one batch",
                     "value": False,
                 },
+                "pipeline": {
+                    "description": (
+                        'Input pipeline, either "sequence" or "tfdata" '
+                        "to augment in parallel with prefetching"
+                    ),
+                    "value": "sequence",
+                },
             },
         }
 
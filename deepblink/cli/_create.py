@@ -1,23 +1,29 @@
 """CLI submodule for creating a new dataset."""
 
-from typing import List, Tuple
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
 import argparse
+import collections
+import concurrent.futures
 import logging
 import os
 
 import numpy as np
-import pandas as pd
-import skimage.util
 
 from ..io import EXTENSIONS
+from ..io import ChunkedDatasetWriter
 from ..io import basename
 from ..io import grab_files
 from ..io import load_image
-from ..util import train_valid_split
+from ..io import load_shape
+from ..io import save_shard
+from ..util import SerialExecutor
 from ._parseutil import CustomFormatter
 from ._parseutil import FolderType
 from ._parseutil import _add_utils
 
+if TYPE_CHECKING:  # pragma: no cover
+    import pandas as pd
+
 
 def _parse_args_create(
     subparsers: argparse._SubParsersAction, parent_parser: argparse.ArgumentParser,
@@ -66,7 +72,8 @@ def _parse_args_create(
         type=str,
         help=(
             "Custom dataset name. "
-            'The file extension "npz" will be added automatically. '
+            'The file extension "npz" will be added automatically, '
+            "chunked datasets are saved as directory without extension. "
             '[default: "dataset"]'
         ),
     )
@@ -83,6 +90,16 @@ def _parse_args_create(
             "[default: None]"
         ),
     )
+    group2.add_argument(
+        "--stride",
+        default=None,
+        type=int,
+        help=(
+            "Crop stride. "
+            "Step between crops if --size is given. Smaller than size results in overlapping crops. "
+            "[default: --SIZE]"
+        ),
+    )
     group2.add_argument(
         "-vs",
         "--validsplit",
@@ -106,24 +123,72 @@ def _parse_args_create(
             "[default: 0.2]"
         ),
     )
+    group2.add_argument(
+        "-f",
+        "--format",
+        default="npz",
+        choices=["npz", "chunked"],
+        help=(
+            "Output format. "
+            '"npz" saves a single file loaded fully into memory with SpotsDataset. '
+            '"chunked" streams crops into sharded files without holding the dataset in memory '
+            "and is loaded lazily with ChunkedSpotsDataset. "
+            '[default: "npz"]'
+        ),
+    )
+    group2.add_argument(
+        "-c",
+        "--compression",
+        default=None,
+        type=int,
+        choices=range(10),
+        metavar="[0-9]",
+        help=(
+            "Compression level. "
+            "Zero saves uncompressed which is fastest and allows chunked datasets to be memory-mapped. "
+            "Compressed chunked datasets are decompressed shard by shard on access. "
+            '[default: 6 for "npz", 0 for "chunked"]'
+        ),
+    )
+    group2.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help=(
+            "Number of worker processes used to load and crop image / label pairs. "
+            "Memory usage is bounded by the number of workers, not the dataset size. "
+            "[default: 1]"
+        ),
+    )
     _add_utils(parser)
 
 
 class HandleCreate:
     """Handle creation submodule for CLI.
 
+    Files are processed in two passes. First, the number of crops per image is
+    counted to assign every crop to the train, valid, or test split. Second,
+    image / label pairs are loaded and cropped in a worker pool and streamed
+    into the output.
+
     Args:
         arg_input: Path to folder with images.
         arg_labels: Path to folder with labels.
         arg_name: Name of dataset file to be saved.
         arg_size: Size of image to be cropped.
+        arg_stride: Step between crops, defaults to arg_size.
         arg_testsplit: Test vs. Trainval split percentage.
         arg_testsplit: Valid vs. Train split percentage.
+        arg_format: Output format, "npz" or "chunked".
+        arg_compression: Compression level between 0 (uncompressed) and 9.
+            Defaults to 6 for npz and 0 for chunked datasets to be memory-mapped.
+        arg_workers: Number of processes used for loading and cropping.
         logger: Logger to log verbose output.
     """
 
-    # pylint: disable=too-many-instance-attributes
-    # We require many attributes for the splits
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+    # We require many attributes for the splits and one argument per CLI option
 
     def __init__(
         self,
@@ -134,24 +199,73 @@ class HandleCreate:
         arg_testsplit: int,
         arg_validsplit: int,
         logger: logging.Logger,
+        arg_format: str = "npz",
+        arg_compression: Optional[int] = None,
+        arg_workers: int = 1,
+        arg_stride: int = None,
     ):
         self.raw_input = arg_input
         self.raw_labels = arg_labels
         self.raw_name = arg_name
         self.img_size = arg_size
+        self.stride = arg_stride
         self.test_split = arg_testsplit
         self.valid_split = arg_validsplit
+        self.format = arg_format
+        if arg_compression is None:
+            arg_compression = 0 if arg_format == "chunked" else 6
+        self.compression = arg_compression
+        self.workers = arg_workers
         self.logger = logger
         self.logger.info("\U0001F5BC starting creation submodule")
 
         self.abs_input = os.path.abspath(self.raw_input)
         self.extensions = EXTENSIONS
+        if self.format == "chunked" and self.compression:
+            self.logger.warning(
+                "\U000026A0 compressed chunked datasets can't be memory-mapped"
+            )
 
     def __call__(self):
         """Run dataset creation."""
-        self.get_file_lists()
-        self.train_val_test_split()
-        self.save_npz()
+        if self.workers > 1:
+            executor = concurrent.futures.ProcessPoolExecutor(self.workers)
+            self.logger.info(f"\U0001F477 using {self.workers} worker processes")
+        else:
+            executor = SerialExecutor()
+
+        with executor:
+            file_pairs = self.file_pairs
+            if not file_pairs:
+                raise ValueError(
+                    "\U0000274C No image / label pairs found. "
+                    f"Please make sure {self.abs_input} contains images with matching labels."
+                )
+            counts = executor.map(
+                _count_crops,
+                *zip(*file_pairs),
+                [self.img_size] * len(file_pairs),
+                [self.stride] * len(file_pairs),
+            )
+            # Labels are parsed once and passed on to not read them again
+            image_labels = []
+            n_crops = 0
+            for (image, _), (n, df) in zip(file_pairs, counts):
+                if not n:
+                    self.logger.warning(
+                        f"\U000026A0 labels for {image} empty or image too small. will not be used"
+                    )
+                    continue
+                image_labels.append((image, df))
+                n_crops += n
+            self.logger.debug(f"using {len(image_labels)} non-empty files")
+            splits = self.get_splits(n_crops)
+
+            crops = self.iter_crops(image_labels, executor, splits)
+            if self.format == "chunked":
+                self.save_chunked(crops)
+            else:
+                self.save_npz(crops)
         self.logger.info(f"\U0001F3C1 dataset created at {self.fname_out}")
 
     @property
@@ -197,49 +311,28 @@ class HandleCreate:
         else:
             path = os.path.join(self.raw_name, "dataset.npz")
             self.logger.debug(f"using default output at {path}")
+        if self.format == "chunked" and path.endswith(".npz"):
+            path = path[: -len(".npz")]
         return path
 
     @property
-    def image_label_lists(self):
-        """Return lists with all images and labels."""
+    def file_pairs(self) -> List[Tuple[str, str]]:
+        """Return a list with pairs of image and label filenames."""
         fname_images = grab_files(self.abs_input, self.extensions)
         fname_labels = grab_files(self.abs_labels, extensions=("csv",))
 
         self.logger.debug(f"images - found {len(fname_images)} files: {fname_images}")
         self.logger.debug(f"labels - found {len(fname_labels)} files: {fname_labels}")
 
-        size = self.img_size
-
-        images = []
-        labels = []
         for image, label in zip(fname_images, fname_labels):
             if basename(image) != basename(label):
                 self.logger.warning(
                     f"\U0000274C file basenames do not match! {image} != {label}"
                 )
-            df = pd.read_csv(label, index_col=0)
-            if len(df) <= 1:
-                self.logger.warning(
-                    f"\U000026A0 labels for {label} empty. will not be used"
-                )
-                continue
-
-            img = load_image(image, is_rgb=False)
-
-            if all(shape > size for shape in img.shape):
-                images.append(load_image(image, is_rgb=False))
-                labels.append(df)
-
-        if len(images) != len(labels):
-            raise ValueError(
-                f"Number of images and labels must match. {len(images)} != {len(labels)}."
-            )
-        self.logger.debug(f"using {len(images)} non-empty files")
-
-        return images, labels
+        return list(zip(fname_images, fname_labels))
 
     @staticmethod
-    def convert_labels(image: np.ndarray, df: pd.DataFrame) -> pd.DataFrame:
+    def convert_labels(image: np.ndarray, df: "pd.DataFrame") -> "pd.DataFrame":
         """Pre-processes labels to be used in deepBlink.
 
         Renames X/Y to c/r respectively for easier handling with rearrangement to r/c.
@@ -263,89 +356,217 @@ class HandleCreate:
 
         return df
 
+    @staticmethod
     def crop_image(
-        self, image: np.ndarray, df: pd.DataFrame
-    ) -> Tuple[List[np.ndarray], List[pd.DataFrame]]:
-        """Crop a image / label pair to a uniform size and scale labels accordingly."""
-        size = self.img_size
+        image: np.ndarray,
+        df: "pd.DataFrame",
+        size: Optional[int],
+        stride: Optional[int] = None,
+    ) -> Tuple[List[np.ndarray], List["pd.DataFrame"]]:
+        """Crop a image / label pair to a uniform size and scale labels accordingly.
+
+        Labels are assigned to all crops they fall into including the crop edges.
+        Assignment is done in one pass by binning coordinates to crop indices.
+
+        Args:
+            image: Image to be cropped.
+            df: Labels with "r" and "c" columns.
+            size: Crop size. If None, returns the unchanged image and labels.
+            stride: Step between crops. Defaults to size i.e. non-overlapping crops.
+        """
+        import pandas as pd  # pylint: disable=import-outside-toplevel
+        import skimage.util  # pylint: disable=import-outside-toplevel
+
         if size is None:
-            self.logger.debug(f"using unchanged size in {image.shape}")
             return [image], [df]
 
         if any([size > s for s in image.shape]):
-            self.logger.debug(f"skipping image due to small size {image.shape}")
             return [], []
 
+        stride = size if stride is None else stride
+        if stride < 1:
+            raise ValueError(f"stride must be positive. {stride} is not.")
         windows = skimage.util.view_as_windows(
-            image, window_shape=(size, size), step=size
+            image, window_shape=(size, size), step=stride
         )
-
-        img_list = []
-        df_list = []
-        for r, cimages in enumerate(windows):
-            for c, img in enumerate(cimages):
-                img_list.append(img)
-
-                r_min = r * size
-                c_min = c * size
-                df_slice = df.loc[
-                    (
-                        (df["r"] >= r_min)
-                        & (df["r"] <= r_min + size)
-                        & (df["c"] >= c_min)
-                        & (df["c"] <= c_min + size)
-                    )
-                ]
-                df_norm = df_slice.copy()
-                df_norm.loc[:, "r"] = df_slice["r"] - r_min
-                df_norm.loc[:, "c"] = df_slice["c"] - c_min
-                df_list.append(df_norm)
-
-        self.logger.debug(
-            f"converted original size of {image.shape} into {len(df_list)} crops"
+        n_rows, n_cols = windows.shape[:2]
+        img_list = [img for cimages in windows for img in cimages]
+
+        # Pairs of spots and crops (row-major index) the spots fall into
+        coords = df[["r", "c"]].to_numpy()
+        row_spots, rows = _window_indices(coords[:, 0], n_rows, size, stride)
+        col_spots, cols = _window_indices(coords[:, 1], n_cols, size, stride)
+        spots, crops = _combine_window_indices(
+            row_spots, rows, col_spots, cols, n_cols, len(coords)
         )
+
+        # Group all pairs by crop keeping the original order of spots
+        order = np.argsort(crops, kind="stable")
+        spots, crops = spots[order], crops[order]
+        offsets = np.stack([crops // n_cols, crops % n_cols], axis=1) * stride
+        values = coords[spots] - offsets
+        splits = np.cumsum(np.bincount(crops, minlength=n_rows * n_cols))[:-1]
+
+        df_list = [
+            pd.DataFrame(crop_values, index=crop_index, columns=["r", "c"])
+            for crop_values, crop_index in zip(
+                np.split(values, splits), np.split(df.index[spots], splits)
+            )
+        ]
         return img_list, df_list
 
-    def get_file_lists(self):
-        """Create a file list after cropping over-sized images."""
-        self.image_list = []
-        self.label_list = []
+    def get_splits(self, n_crops: int) -> np.ndarray:
+        """Two-step random split of all crops into train/valid/test.
 
-        for image, label in zip(*self.image_label_lists):
-            label_normalized = self.convert_labels(image=image, df=label)
-            image_crops, label_crops = self.crop_image(image=image, df=label_normalized)
-            self.image_list.extend(image_crops)
-            self.label_list.extend(label_crops)
+        Equivalent to splitting test from trainval and then valid from train
+        with "util.train_valid_split" but only assigns split names to crop indices.
+        """
+        for split in [self.test_split, self.valid_split]:
+            if not 0 <= split <= 1:
+                raise ValueError(f"Splits must be between 0-1 but are {split}.")
+        if n_crops <= 2:
+            raise ValueError(
+                f"At least 3 images/labels are required for a train/val split. Given: {n_crops}."
+            )
 
-        self.logger.debug(
-            f"images converted: {len(self.image_list)} == {len(self.label_list)}"
-        )
+        n_test = round(n_crops * self.test_split)
+        n_valid = round((n_crops - n_test) * self.valid_split)
+        splits = np.array(["train"] * n_crops, dtype=object)
+        order = np.random.permutation(n_crops)
+        splits[order[:n_test]] = "test"
+        splits[order[n_test : n_test + n_valid]] = "valid"
 
-    def train_val_test_split(self):
-        """Two-step split of the input data into train/valid/test."""
-        x_trainval, self.x_test, y_trainval, y_test = train_valid_split(
-            x_list=self.image_list, y_list=self.label_list, valid_split=self.test_split
-        )
-        self.x_train, self.x_valid, y_train, y_valid = train_valid_split(
-            x_list=x_trainval, y_list=y_trainval, valid_split=self.valid_split
-        )
         self.logger.info(
-            f"\U0001F4A6 images split: {len(self.x_train)} train, {len(self.x_valid)} valid, {len(self.x_test)} test"
+            f"\U0001F4A6 images split: {n_crops - n_test - n_valid} train, {n_valid} valid, {n_test} test"
         )
+        return splits
 
-        # Convert DataFrame to Numpy array
-        self.y_train = [y.values for y in y_train]
-        self.y_valid = [y.values for y in y_valid]
-        self.y_test = [y.values for y in y_test]
-
-    def save_npz(self):
+    def iter_crops(
+        self,
+        image_labels: List[Tuple[str, "pd.DataFrame"]],
+        executor: concurrent.futures.Executor,
+        splits: np.ndarray,
+    ) -> Iterator[Tuple[str, np.ndarray, np.ndarray]]:
+        """Yield the split, image crop, and coordinates of all crops one at a time.
+
+        Images are loaded and cropped ahead in the executor while keeping at most
+        two files per worker in flight.
+        """
+        pending: collections.deque = collections.deque()
+        n_crops = 0
+        for idx, (image, df) in enumerate(image_labels):
+            future = executor.submit(_load_crops, image, df, self.img_size, self.stride)
+            pending.append((image, future))
+            is_last = idx == len(image_labels) - 1
+            while pending and (len(pending) > max(self.workers, 1) * 2 or is_last):
+                fname, future = pending.popleft()
+                images, coords = future.result()
+                self.logger.debug(f"converted {fname} into {len(images)} crops")
+                for crop, coord in zip(images, coords):
+                    if n_crops >= len(splits):
+                        raise ValueError("More crops found than counted.")
+                    yield splits[n_crops], crop, coord
+                    n_crops += 1
+
+        if n_crops != len(splits):
+            raise ValueError(f"Found {n_crops} crops but counted {len(splits)}.")
+
+    def save_chunked(self, crops: Iterator[Tuple[str, np.ndarray, np.ndarray]]):
+        """Stream crops into a sharded chunked dataset."""
+        with ChunkedDatasetWriter(self.fname_out, compression=self.compression) as w:
+            for split, image, coords in crops:
+                w.add(split, image, coords)
+
+    def save_npz(self, crops: Iterator[Tuple[str, np.ndarray, np.ndarray]]):
         """Save dataset splits as single npz file."""
-        np.savez_compressed(
-            self.fname_out,
-            x_train=self.x_train,
-            y_train=self.y_train,
-            x_valid=self.x_valid,
-            y_valid=self.y_valid,
-            x_test=self.x_test,
-            y_test=self.y_test,
-        )
+        images: Dict[str, list] = {"train": [], "valid": [], "test": []}
+        coords: Dict[str, list] = {"train": [], "valid": [], "test": []}
+        for split, image, coord in crops:
+            images[split].append(image)
+            coords[split].append(coord)
+
+        arrays = {}
+        for split in images:
+            arrays[f"x_{split}"] = np.array(images[split])
+            arrays[f"y_{split}"] = np.empty(len(coords[split]), dtype=object)
+            arrays[f"y_{split}"][:] = coords[split]
+        save_shard(self.fname_out, arrays, compression=self.compression)
+
+
+def _read_labels(fname: str) -> Optional["pd.DataFrame"]:
+    """Read a label file returning None if it contains no more than one spot."""
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    df = pd.read_csv(fname, index_col=0)
+    return df if len(df) > 1 else None
+
+
+def _is_valid_shape(shape: Tuple[int, ...], size: Optional[int]) -> bool:
+    """Check if an image is larger than the crop size along all axes."""
+    return size is None or all(s > size for s in shape)
+
+
+def _window_indices(
+    values: np.ndarray, n_windows: int, size: int, stride: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Return all pairs of value and window indices with start <= value <= start + size."""
+    lower = np.maximum(np.floor((values - size) / stride), 0).astype(int)
+    upper = np.minimum(np.floor(values / stride), n_windows - 1).astype(int)
+    counts = np.maximum(upper - lower + 1, 0)
+
+    indices = np.repeat(np.arange(len(values)), counts)
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    windows = lower[indices] + np.arange(len(indices)) - starts
+
+    # Exact comparison to not depend on floating point division
+    start = windows * stride
+    inside = (values[indices] >= start) & (values[indices] <= start + size)
+    return indices[inside], windows[inside]
+
+
+def _combine_window_indices(
+    row_indices: np.ndarray,
+    rows: np.ndarray,
+    col_indices: np.ndarray,
+    cols: np.ndarray,
+    n_cols: int,
+    n_values: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Combine row and column windows of every value into all 2D windows (row-major)."""
+    col_counts = np.bincount(col_indices, minlength=n_values)
+    col_starts = np.cumsum(col_counts) - col_counts
+
+    repeats = col_counts[row_indices]
+    indices = np.repeat(row_indices, repeats)
+    offsets = np.arange(len(indices)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+    windows = np.repeat(rows, repeats) * n_cols + cols[col_starts[indices] + offsets]
+    return indices, windows
+
+
+def _count_crops(
+    fname_image: str, fname_label: str, size: Optional[int], stride: Optional[int]
+) -> Tuple[int, Optional["pd.DataFrame"]]:
+    """Return the number of crops and labels of one image / label pair.
+
+    Only the image header is read to get its shape.
+    """
+    df = _read_labels(fname_label)
+    if df is None:
+        return 0, None
+    shape = load_shape(fname_image)
+    if not _is_valid_shape(shape, size):
+        return 0, None
+    if size is None:
+        return 1, df
+    stride = size if stride is None else stride
+    return int(np.prod([(s - size) // stride + 1 for s in shape])), df
+
+
+def _load_crops(
+    fname_image: str, df: "pd.DataFrame", size: Optional[int], stride: Optional[int]
+) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+    """Load and crop one image with its labels returning crops and their coordinates."""
+    image = load_image(fname_image, is_rgb=False)
+    df = HandleCreate.convert_labels(image=image, df=df)
+    images, dfs = HandleCreate.crop_image(image=image, df=df, size=size, stride=stride)
+    return [np.ascontiguousarray(i) for i in images], [d.values for d in dfs]
@@ -13,7 +13,11 @@ from ._logger import _configure_logger
 from ._parseutil import CustomFormatter
 from ._parseutil import _add_utils
 from ._predict import HandlePredict
+from ._predict import PredictOptions
 from ._predict import _parse_args_predict
+from ._serve import HandleServe
+from ._serve import ServeOptions
+from ._serve import _parse_args_serve
 from ._train import HandleTrain
 from ._train import _parse_args_train
 
@@ -43,6 +47,7 @@ def arg_parser() -> argparse.ArgumentParser:
     _parse_args_config(subparsers, parent_parser)
     _parse_args_create(subparsers, parent_parser)
     _parse_args_predict(subparsers, parent_parser)
+    _parse_args_serve(subparsers, parent_parser)
     _parse_args_train(subparsers, parent_parser)
     _add_utils(parser)
 
@@ -66,8 +71,12 @@ def main():
             arg_labels=args.labels,
             arg_name=args.name,
             arg_size=args.size,
+            arg_stride=args.stride,
             arg_testsplit=args.testsplit,
             arg_validsplit=args.validsplit,
+            arg_format=args.format,
+            arg_compression=args.compression,
+            arg_workers=args.workers,
             logger=logger,
         )
 
@@ -76,8 +85,37 @@ def main():
             arg_model=args.model,
             arg_input=args.input,
             arg_output=args.output,
-            arg_radius=args.radius,
-            arg_shape=args.shape,
+            arg_options=PredictOptions(
+                radius=args.radius,
+                background=args.background,
+                shape=args.shape,
+                tilesize=args.tilesize,
+                batchsize=args.batchsize,
+                workers=args.workers,
+                watch=args.watch,
+                resume=args.resume,
+                format=args.format,
+                consolidate=args.consolidate,
+                padding=args.padding,
+                xla=args.xla,
+            ),
+            logger=logger,
+        )
+
+    if args.command == "serve":
+        handler = HandleServe(
+            arg_model=args.model,
+            arg_host=args.host,
+            arg_port=args.port,
+            arg_socket=args.socket,
+            arg_options=ServeOptions(
+                radius=args.radius,
+                background=args.background,
+                batchsize=args.batchsize,
+                batchwait=args.batchwait,
+                warmup=tuple(args.warmup),
+                xla=args.xla,
+            ),
             logger=logger,
         )
 
@@ -0,0 +1,304 @@
+"""Output files of the prediction submodule shared by single files and stores."""
+
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+import csv
+import glob
+import json
+import os
+import time
+
+import numpy as np
+
+from ..util import ColumnBuffer
+
+if TYPE_CHECKING:  # pragma: no cover
+    import pandas as pd
+
+# File in the output directory recording all finished predictions
+MANIFEST_FILE = ".deepblink_predict.jsonl"
+
+# Output formats with their file extension and optionally required package
+OUTPUT_FORMATS = {
+    "csv": ("csv", None),
+    "parquet": ("parquet", "pyarrow"),
+    "feather": ("feather", "pyarrow"),
+    "hdf5": ("h5", "tables"),
+}
+
+# Directory in the output folder containing the consolidated results of all files
+CONSOLIDATED_DIR = "deepblink_results"
+
+# Number of rows or seconds after which a partition of the consolidated results is saved
+CONSOLIDATED_ROWS = 1_000_000
+CONSOLIDATED_AGE = 60
+
+
+class Manifest:
+    """Append-only record of saved outputs stored as JSON lines.
+
+    Each line records the input file, its size and modification time when it was
+    read, the output file and the settings used. Lines are only appended once an
+    output is completely saved, incomplete lines after a crash are ignored.
+
+    Args:
+        fname: Manifest file.
+        settings: Model hash and all options changing the outputs. Outputs saved with
+            different settings are not up-to-date.
+    """
+
+    def __init__(self, fname: str, settings: Dict[str, Any]):
+        self.fname = fname
+        self.settings = settings
+        self.entries: Dict[str, Dict] = {}
+        if os.path.isfile(self.fname):
+            self.load()
+
+    def load(self) -> None:
+        """Load all entries and compact the manifest to one line per input if needed.
+
+        Incomplete lines are dropped such that new entries always start on a new line.
+        """
+        n_lines = 0
+        line = "\n"
+        with open(self.fname, "r") as f:
+            for n_lines, line in enumerate(f, 1):
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.entries[entry["input"]] = entry
+
+        # Only rewrite if duplicate or incomplete lines can be dropped
+        if n_lines == len(self.entries) and line.endswith("\n"):
+            return
+        fname_temp = f"{self.fname}.tmp"
+        with open(fname_temp, "w") as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry) + "\n")
+        os.replace(fname_temp, self.fname)
+
+    def add(self, fname_in: str, fname_out: str, stat: Tuple[int, int]) -> None:
+        """Record that the output of an input file with the given stat was saved."""
+        entry: Dict[str, Any] = {
+            "input": os.path.abspath(fname_in),
+            "output": os.path.abspath(fname_out),
+            "size": stat[0],
+            "mtime": stat[1],
+            **self.settings,
+        }
+        self.entries[entry["input"]] = entry
+        with open(self.fname, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def is_finished(self, fname_in: str, stat: Tuple[int, int]) -> bool:
+        """Check if an up-to-date output exists for an input file with the given stat."""
+        entry = self.entries.get(os.path.abspath(fname_in))
+        return (
+            entry is not None
+            and (entry["size"], entry["mtime"]) == tuple(stat)
+            and all(entry.get(key) == value for key, value in self.settings.items())
+            and os.path.isfile(entry["output"])
+        )
+
+
+def file_stat(fname: str) -> Tuple[int, int]:
+    """Return size and modification time in nanoseconds of a file."""
+    stat = os.stat(fname)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class ConsolidatedWriter:
+    """Append the outputs of many files into one partitioned store.
+
+    Outputs are collected in memory and saved as partitions "part-XXXXX.<ext>" once
+    max_rows rows are collected or the oldest output is max_age seconds old. Every
+    row is labeled with a "file_id" column. The ids of each partition are mapped to
+    the input files in "files-XXXXX.csv" which is saved before its partition. Only
+    mappings with an existing partition are valid such that a crash in between never
+    leaves rows of unknown files. If a file is saved again, e.g. after it changed,
+    the mapping lists the superseded id in the "replaces" column. Use
+    "load_consolidated" to read only the current rows.
+
+    Args:
+        path: Directory of the store.
+        fmt: Output format of the partitions, one of OUTPUT_FORMATS.
+        max_rows: Number of rows after which a partition is saved.
+        max_age: Seconds after which outputs are saved on "flush_due".
+    """
+
+    def __init__(
+        self,
+        path: str,
+        fmt: str,
+        max_rows: int = CONSOLIDATED_ROWS,
+        max_age: float = CONSOLIDATED_AGE,
+    ):
+        self.path = path
+        self.format = fmt
+        self.max_rows = max_rows
+        self.max_age = max_age
+        os.makedirs(self.path, exist_ok=True)
+
+        # Ids are derived from the saved partitions and their mappings
+        self.current: Dict[str, int] = {}
+        self.n_files = 0
+        mappings = _get_consolidated_mappings(self.path)
+        for _, fname_files in mappings:
+            with open(fname_files, "r", newline="") as f:
+                for row in csv.DictReader(f):
+                    self.current[row["input"]] = int(row["file_id"])
+                    self.n_files = max(self.n_files, int(row["file_id"]) + 1)
+        self.n_parts = len(mappings)
+
+        self.buffer = ColumnBuffer()
+        self.pending: List[Tuple[int, str, Optional[Callable[[str, str], None]]]] = []
+        self.start: Optional[float] = None
+
+    def __contains__(self, fname_in: str) -> bool:
+        """Check if an input file is collected but not yet saved."""
+        return any(fname == os.path.abspath(fname_in) for _, fname, _ in self.pending)
+
+    def add(
+        self,
+        fname_in: str,
+        df: "pd.DataFrame",
+        callback: Optional[Callable[[str, str], None]] = None,
+    ) -> None:
+        """Add the output of one file calling callback once its partition is saved."""
+        file_id = self.n_files + len(self.pending)
+        self.buffer.append({"file_id": file_id, **{c: df[c].to_numpy() for c in df}})
+        self.pending.append((file_id, os.path.abspath(fname_in), callback))
+        if self.start is None:
+            self.start = time.monotonic()
+        if len(self.buffer) >= self.max_rows:
+            self.flush()
+
+    def flush_due(self) -> None:
+        """Save all collected outputs if the oldest one exceeds max_age."""
+        if self.start is not None and time.monotonic() - self.start >= self.max_age:
+            self.flush()
+
+    def flush(self) -> None:
+        """Save all collected outputs as new partition."""
+        if not self.pending:
+            return
+
+        ext = OUTPUT_FORMATS[self.format][0]
+        fname_part = os.path.join(self.path, f"part-{self.n_parts:05d}.{ext}")
+        fname_files = os.path.join(self.path, f"files-{self.n_parts:05d}.csv")
+
+        current = dict(self.current)
+        fname_temp = f"{fname_files}.{os.getpid()}.tmp"
+        with open(fname_temp, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["file_id", "input", "part", "replaces"])
+            for file_id, fname_in, _ in self.pending:
+                writer.writerow(
+                    [
+                        file_id,
+                        fname_in,
+                        os.path.basename(fname_part),
+                        current.get(fname_in, ""),
+                    ]
+                )
+                current[fname_in] = file_id
+        os.replace(fname_temp, fname_files)
+
+        df = self.buffer.to_frame()
+        df["file_id"] = df["file_id"].astype(np.int32)
+        save_frame(df, fname_part, self.format)
+
+        for _, fname_in, callback in self.pending:
+            if callback is not None:
+                callback(fname_in, fname_part)
+        self.current = current
+        self.n_files += len(self.pending)
+        self.n_parts += 1
+        self.buffer = ColumnBuffer()
+        self.pending = []
+        self.start = None
+
+
+def _get_consolidated_mappings(path: str) -> List[Tuple[str, str]]:
+    """Return partitions and their id mappings of a consolidated store in order.
+
+    Mappings without partition (after a crash) are ignored and overwritten later.
+    """
+    mappings = []
+    for fname_files in sorted(glob.glob(os.path.join(path, "files-*.csv"))):
+        index = os.path.basename(fname_files)[len("files-") : -len(".csv")]
+        parts = glob.glob(os.path.join(path, f"part-{index}.*"))
+        parts = [fname for fname in parts if not fname.endswith(".tmp")]
+        if not parts:
+            break
+        mappings.append((parts[0], fname_files))
+    return mappings
+
+
+def load_consolidated(path: str) -> "pd.DataFrame":
+    """Load the current rows of a consolidated store with the input file of every row.
+
+    Rows of partitions without valid mapping and of superseded file ids are dropped.
+
+    Args:
+        path: Directory of the store.
+    """
+    # Only imported on demand to speed up the CLI
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    readers = {
+        "csv": pd.read_csv,
+        "parquet": pd.read_parquet,
+        "feather": pd.read_feather,
+        "h5": lambda fname: pd.read_hdf(fname, key="spots"),
+    }
+    frames, file_frames = [], []
+    for fname_part, fname_files in _get_consolidated_mappings(path):
+        frames.append(readers[os.path.splitext(fname_part)[1][1:]](fname_part))
+        file_frames.append(pd.read_csv(fname_files))
+    if not frames:
+        return pd.DataFrame()
+
+    files = pd.concat(file_frames, ignore_index=True)
+    replaced = set(files["replaces"].dropna().astype(int))
+    files = files[~files["file_id"].isin(replaced)]
+    df = pd.concat(frames, ignore_index=True)
+    df = df[df["file_id"].isin(files["file_id"])]
+    return df.merge(files[["file_id", "input"]], on="file_id", how="left")
+
+
+def save_frame(df: "pd.DataFrame", fname: str, fmt: str = "csv") -> None:
+    """Save a DataFrame atomically using a temporary file.
+
+    Binary formats store coordinates and intensities as float32 and axis indices
+    as int16 (or int32 if not representable) to reduce file sizes.
+
+    Args:
+        df: DataFrame to be saved.
+        fname: Output filename.
+        fmt: Output format, one of OUTPUT_FORMATS.
+    """
+    if fmt != "csv":
+        dtypes: Dict[str, Any] = {}
+        for col in df.columns:
+            if col in ("c", "t", "z"):
+                fits = df[col].empty or df[col].max() <= np.iinfo(np.int16).max
+                dtypes[col] = np.int16 if fits else np.int32
+            elif col != "file_id":
+                dtypes[col] = np.float32
+        df = df.astype(dtypes)
+
+    fname_temp = f"{fname}.{os.getpid()}.tmp"
+    if fmt == "csv":
+        df.to_csv(fname_temp, index=False)
+    elif fmt == "parquet":
+        df.to_parquet(fname_temp, index=False)
+    elif fmt == "feather":
+        df.reset_index(drop=True).to_feather(fname_temp)
+    elif fmt == "hdf5":
+        df.to_hdf(fname_temp, key="spots", mode="w", index=False)
+    else:
+        raise ValueError(
+            f"Format must be one of {list(OUTPUT_FORMATS)}. '{fmt}' is not."
+        )
+    os.replace(fname_temp, fname)
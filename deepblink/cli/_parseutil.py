@@ -102,6 +102,20 @@ class CustomFormatter(argparse.RawDescriptionHelpFormatter):
         return super(CustomFormatter, self).add_usage(usage, actions, groups, prefix)
 
 
+def _add_xla(group: argparse._ArgumentGroup):
+    """Add the XLA compilation flag shared by all submodules calling a model."""
+    group.add_argument(
+        "--xla",
+        action="store_true",
+        help=(
+            "XLA compilation. "
+            "The model is called through one compiled function per input shape. "
+            "If given, these functions are additionally compiled with XLA which can be faster on GPUs. "
+            "[default: False]"
+        ),
+    )
+
+
 # TODO find a simpler and safer solution
 def _add_utils(parser: argparse.ArgumentParser):
     """A very hacky way of trying to move this group to the bottom of help text."""
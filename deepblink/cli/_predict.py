@@ -1,28 +1,62 @@
 """CLI submodule for predicting on images."""
 
-from typing import List
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
 import argparse
+import collections
+import concurrent.futures
+import importlib.util
+import itertools
 import logging
 import os
+import time
 
 import numpy as np
-import pandas as pd
 
+from ..data import normalize_image
+from ..inference import CompiledPredictor
 from ..inference import get_intensities
-from ..inference import predict
+from ..inference import predict_batch
+from ..inference import predict_tiled
 from ..io import EXTENSIONS
+from ..io import LazyImage
 from ..io import basename
+from ..io import file_hash
 from ..io import grab_files
-from ..io import load_image
 from ..io import load_model
+from ..io import load_shape
+from ..util import ColumnBuffer
+from ..util import SerialExecutor
 from ..util import delete_non_unique_columns
 from ..util import predict_shape
+from ._output import CONSOLIDATED_AGE
+from ._output import CONSOLIDATED_DIR
+from ._output import CONSOLIDATED_ROWS
+from ._output import MANIFEST_FILE
+from ._output import OUTPUT_FORMATS
+from ._output import ConsolidatedWriter
+from ._output import Manifest
+from ._output import file_stat
+from ._output import save_frame
 from ._parseutil import CustomFormatter
 from ._parseutil import FileFolderType
 from ._parseutil import FileType
 from ._parseutil import FolderType
 from ._parseutil import ShapeType
 from ._parseutil import _add_utils
+from ._parseutil import _add_xla
+
+if TYPE_CHECKING:  # pragma: no cover
+    import pandas as pd
 
 
 def _parse_args_predict(
@@ -96,6 +130,19 @@ def _parse_args_predict(
             "[default: None]"
         ),
     )
+    group2.add_argument(
+        "-b",
+        "--background",
+        type=int,
+        default=None,
+        help=(
+            "Background ring width. "
+            'Only used together with "--radius". If given, the local background is measured as mean '
+            "intensity in a ring of the specified width around the intensity radius. "
+            'The background and the signal-to-noise ratio are added as columns "b" and "snr". '
+            "[default: None]"
+        ),
+    )
     group2.add_argument(
         "-s",
         "--shape",
@@ -111,9 +158,146 @@ def _parse_args_predict(
             "[default: None]"
         ),
     )
+    group2.add_argument(
+        "-t",
+        "--tilesize",
+        type=int,
+        default=None,
+        help=(
+            "Tile size. "
+            "If given, images larger than the tile size are predicted in overlapping square tiles "
+            "to limit memory usage on very large images. Must be a multiple of the model's "
+            'stride or, with padding "power", a power of two. '
+            "[default: None]"
+        ),
+    )
+    group2.add_argument(
+        "--padding",
+        type=str,
+        default="stride",
+        choices=["stride", "power"],
+        help=(
+            "Image padding. "
+            'Images are padded to the next multiple of the model\'s total downsampling ("stride") '
+            'or to the next power of two ("power") as in previous versions. As the padded region '
+            "influences the model's global pooling layers, predictions can differ slightly. "
+            "[default: stride]"
+        ),
+    )
+    _add_xla(group2)
+    group2.add_argument(
+        "--batchsize",
+        type=int,
+        default=16,
+        help=(
+            "Batch size. "
+            "Number of same-shaped image planes (e.g. frames of a movie) passed to the model at once. "
+            "Larger values increase throughput at the cost of memory. "
+            "[default: 16]"
+        ),
+    )
+    group2.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help=(
+            "Number of worker processes. "
+            "If larger than one, loading and normalizing planes, measuring intensities, and "
+            "saving outputs run in parallel processes, only the model prediction runs in the "
+            "main process. Outputs are identical to a single worker. "
+            "[default: 1]"
+        ),
+    )
+    group2.add_argument(
+        "--watch",
+        type=float,
+        nargs="?",
+        const=1.0,
+        default=None,
+        metavar="SECONDS",
+        help=(
+            "Watch the input folder. "
+            "If given, the input folder is polled in the specified interval and new files are "
+            "predicted as soon as their size stopped changing between two polls. "
+            'Finished files are skipped after a restart as with "--resume". Stop watching with Ctrl+C. '
+            "[default: None, interval if given without value: 1.0]"
+        ),
+    )
+    group2.add_argument(
+        "-f",
+        "--format",
+        type=str,
+        default="csv",
+        choices=list(OUTPUT_FORMATS),
+        help=(
+            "Output file format. "
+            "Binary formats are smaller and faster to read and write as coordinates and intensities "
+            'are stored as float32 and axis indices as int16. "parquet" and "feather" require '
+            '"pyarrow", "hdf5" requires "tables" to be installed. '
+            "[default: csv]"
+        ),
+    )
+    group2.add_argument(
+        "--consolidate",
+        action="store_true",
+        help=(
+            "Consolidate all outputs. "
+            f'If given, the detections of all files are appended into one store "{CONSOLIDATED_DIR}" '
+            "in the output folder instead of one file per image. The store is partitioned into files "
+            f'"part-XXXXX" of up to {CONSOLIDATED_ROWS} rows with a "file_id" column. '
+            'File ids are mapped to the input files in "files-XXXXX.csv", inputs which are '
+            'predicted again list their previous id as "replaces". '
+            "When watching, partitions are saved at least every "
+            f"{CONSOLIDATED_AGE}s and when stopped."
+        ),
+    )
+    group2.add_argument(
+        "--resume",
+        action="store_true",
+        help=(
+            "Resume previous predictions. "
+            "If given, every saved output is recorded with the size and modification time "
+            f'of its input in "{MANIFEST_FILE}" in the output folder and inputs which are unchanged '
+            "since their recorded output was saved using the same model and options are skipped. "
+            "This allows to restart interrupted runs."
+        ),
+    )
     _add_utils(parser)
 
 
+class PredictOptions(NamedTuple):
+    """Options of the predictions and their outputs.
+
+    Args:
+        radius: Size of integrated image intensity calculation.
+        background: Width of the ring used to measure the local background.
+        shape: Custom shape format to label axes.
+        tilesize: Size of tiles used to predict on large images.
+        batchsize: Number of image planes predicted at once.
+        workers: Number of processes used for loading and saving.
+        watch: Interval in seconds to poll the input folder for new files.
+        resume: If inputs with up-to-date outputs should be skipped.
+        format: Output file format, one of OUTPUT_FORMATS.
+        consolidate: If all outputs should be appended into one store.
+        padding: Padding of images, "stride" or "power".
+        xla: If the model should be compiled with XLA.
+    """
+
+    radius: Optional[int] = None
+    background: Optional[int] = None
+    shape: Optional[str] = None
+    tilesize: Optional[int] = None
+    batchsize: int = 16
+    workers: int = 1
+    watch: Optional[float] = None
+    resume: bool = False
+    format: str = "csv"
+    consolidate: bool = False
+    padding: str = "stride"
+    xla: bool = False
+
+
 class HandlePredict:
     """Handle prediction submodule for CLI.
 
@@ -121,9 +305,12 @@ class HandlePredict:
         arg_model: Path to model.h5 file.
         arg_input: Path to image file / folder with images.
         arg_output: Path to output directory.
-        arg_radius: Size of integrated image intensity calculation.
-        arg_shape: Custom shape format to label axes.
+        arg_radius: Size of integrated image intensity calculation. Kept for backwards
+            compatibility, overrides the radius of arg_options if given.
+        arg_shape: Custom shape format to label axes. Kept for backwards compatibility,
+            overrides the shape of arg_options if given.
         logger: Logger to log verbose output.
+        arg_options: Options of the predictions and their outputs.
     """
 
     def __init__(
@@ -131,36 +318,288 @@ class HandlePredict:
         arg_model: str,
         arg_input: str,
         arg_output: str,
-        arg_radius: int,
-        arg_shape: str,
-        logger: logging.Logger,
+        arg_radius: Optional[int] = None,
+        arg_shape: Optional[str] = None,
+        logger: logging.Logger = None,
+        arg_options: PredictOptions = PredictOptions(),
     ):
+        if logger is None:
+            raise TypeError("HandlePredict requires a logger.")
+        if arg_radius is not None:
+            arg_options = arg_options._replace(radius=arg_radius)
+        if arg_shape is not None:
+            arg_options = arg_options._replace(shape=arg_shape)
+
         self.fname_model = arg_model
         self.raw_input = arg_input
         self.raw_output = arg_output
-        self.radius = arg_radius
-        self.raw_shape = arg_shape
+        self.options = arg_options
         self.logger = logger
         self.logger.info("\U0001F914 starting prediction submodule")
 
-        self.type = "csv"
+        if self.options.format not in OUTPUT_FORMATS:
+            raise ValueError(
+                f"\U0000274C Format must be one of {list(OUTPUT_FORMATS)}. "
+                f"'{self.options.format}' is not."
+            )
+        self.type, package = OUTPUT_FORMATS[self.options.format]
+        if package is not None and importlib.util.find_spec(package) is None:
+            raise ImportError(
+                f"\U0000274C Format '{self.options.format}' requires '{package}'. "
+                f"Please install it using 'pip install {package}'."
+            )
         self.extensions = EXTENSIONS
+        self.shape: List[str] = []
+        self.first_image_shape: Optional[Tuple[int, ...]] = None
         self.abs_input = os.path.abspath(self.raw_input)
-        self.model = load_model(
-            os.path.abspath(self.fname_model)
-        )  # noqa: assignment-from-no-return
+        self.model = CompiledPredictor(
+            load_model(os.path.abspath(self.fname_model)), jit_compile=self.options.xla
+        )
         self.logger.info("\U0001F9E0 model imported")
+        # Finished outputs are only recorded if they are skipped later on
+        self.manifest: Optional[Manifest] = None
+        if self.options.resume or self.options.watch is not None:
+            self.manifest = Manifest(
+                os.path.join(self.path_output, MANIFEST_FILE),
+                {
+                    "model": file_hash(os.path.abspath(self.fname_model)),
+                    "radius": self.options.radius,
+                    "background": self.options.background,
+                    "shape": self.options.shape,
+                    "tilesize": self.options.tilesize,
+                    "padding": self.options.padding,
+                    "format": self.options.format,
+                    "consolidate": self.options.consolidate,
+                },
+            )
+        self.writer = (
+            ConsolidatedWriter(
+                os.path.join(self.path_output, CONSOLIDATED_DIR), self.options.format
+            )
+            if self.options.consolidate
+            else None
+        )
 
     def __call__(self):
         """Run prediction for all given images."""
-        self.logger.info(f"\U0001F4C2 {len(self.file_list)} file(s) found")
+        if self.options.watch is not None:
+            self.watch_folder()
+            return
+
+        file_list = self.file_list
+        self.logger.info(f"\U0001F4C2 {len(file_list)} file(s) found")
         self.logger.info(f"\U0001F5C4 output will be saved to {self.path_output}")
 
-        for fname_in, image in zip(self.file_list, self.image_list):
-            self.predict_adaptive(fname_in, image)
+        stats = {fname: file_stat(fname) for fname in file_list}
+        if self.options.resume:
+            file_list = [
+                fname
+                for fname in file_list
+                if not self.is_finished(fname, stats[fname])
+            ]
+            self.logger.info(
+                f"\U0001F501 skipping {len(stats) - len(file_list)} up-to-date file(s)"
+            )
+
+        start = time.perf_counter()
+        with self.get_executor() as executor:
+            n_planes, n_spots = self.predict_files(
+                file_list, executor, self.get_finish_callback(stats)
+            )
 
+        duration = time.perf_counter() - start
+        self.logger.info(
+            f"\U0001F4CA predicted {n_spots} spots in {len(file_list)} file(s) "
+            f"({n_planes} planes) in {duration:.2f}s - "
+            f"{len(file_list) / duration:.2f} files/s, {n_planes / duration:.2f} planes/s"
+        )
         self.logger.info("\U0001F3C1 all predictions are complete")
 
+    def get_executor(self) -> concurrent.futures.Executor:
+        """Return the executor used for loading and saving."""
+        if self.options.workers > 1:
+            self.logger.info(
+                f"\U0001F477 using {self.options.workers} worker processes"
+            )
+            return concurrent.futures.ProcessPoolExecutor(self.options.workers)
+        return SerialExecutor()
+
+    def predict_files(
+        self,
+        file_list: List[str],
+        executor: concurrent.futures.Executor,
+        callback: Optional[Callable[[str, str], None]] = None,
+        flush: bool = True,
+    ) -> Tuple[int, int]:
+        """Predict and save all files of file_list.
+
+        Args:
+            file_list: Image files to be predicted.
+            executor: Executor used for loading and saving.
+            callback: Called with the input and output filename once an output is saved.
+            flush: If consolidated outputs should be saved at the end. Otherwise they
+                are kept until a full partition is collected.
+
+        Returns:
+            Number of planes and spots predicted.
+        """
+        n_planes = n_spots = 0
+        pending: Deque[Tuple[str, concurrent.futures.Future]] = collections.deque()
+        indices: List[Tuple[int, int, int]] = []
+        coords_list: List[np.ndarray] = []
+        intensities_list: List[concurrent.futures.Future] = []
+        batches = self.iter_batches(file_list, executor)
+        for fname_in, batch_indices, future, is_last in batches:
+            # Only the model is called here, planes are loaded and measured by the executor
+            planes, raw_planes = future.result()
+            coords = self.predict_planes(planes)
+            indices.extend(batch_indices)
+            coords_list.extend(coords)
+            intensities_list.append(
+                executor.submit(
+                    _get_intensities,
+                    raw_planes,
+                    coords,
+                    self.options.radius,
+                    self.options.background,
+                )
+            )
+            if not is_last:
+                continue
+
+            n_planes += len(indices)
+            self.logger.debug(f"predicted {len(indices)} planes of {fname_in}")
+            intensities = [i for f in intensities_list for i in f.result()]
+            if self.writer is not None:
+                output = executor.submit(
+                    _get_output,
+                    coords_list,
+                    intensities,
+                    indices,
+                    self.options.background,
+                    unique=False,
+                )
+            else:
+                output = executor.submit(
+                    _save_output,
+                    self.get_fname_output(fname_in),
+                    coords_list,
+                    intensities,
+                    indices,
+                    self.options.background,
+                    self.options.format,
+                )
+            pending.append((fname_in, output))
+            indices, coords_list, intensities_list = [], [], []
+
+            # Bound the number of outputs waiting to be saved
+            while len(pending) > max(self.options.workers, 1) * 2:
+                fname_done, output = pending.popleft()
+                n_spots += self._finish_output(fname_done, output, callback)
+        while pending:
+            fname_done, output = pending.popleft()
+            n_spots += self._finish_output(fname_done, output, callback)
+        if self.writer is not None and flush:
+            self.writer.flush()
+        return n_planes, n_spots
+
+    def watch_folder(self, max_polls: int = None) -> None:
+        """Continuously predict new files written into the input folder.
+
+        Files are considered completely written once their size and modification time
+        did not change between two polls. Files with up-to-date outputs in the manifest
+        are skipped such that restarts only predict new or changed files.
+
+        Args:
+            max_polls: Number of polls after which watching stops. Runs until interrupted if None.
+        """
+        if not os.path.isdir(self.abs_input):
+            raise ValueError(
+                f"\U0000274C Watching requires an input folder. '{self.raw_input}' is not."
+            )
+
+        failed: Dict[str, Tuple[int, int]] = {}
+        stats: Dict[str, Tuple[int, int]] = {}
+        self.logger.info(
+            f"\U0001F440 watching {self.abs_input} every {self.options.watch}s"
+        )
+        self.logger.info(f"\U0001F5C4 output will be saved to {self.path_output}")
+
+        finish = self.get_finish_callback(stats)
+        n_polls = 0
+        with self.get_executor() as executor:
+            try:
+                while max_polls is None or n_polls < max_polls:
+                    n_polls += 1
+                    if self.writer is not None:
+                        self.writer.flush_due()
+                    ready = [
+                        fname
+                        for fname in self.poll_files(stats)
+                        if failed.get(fname) != stats[fname]
+                        and (self.writer is None or fname not in self.writer)
+                    ]
+                    if not ready:
+                        if max_polls is None or n_polls < max_polls:
+                            time.sleep(self.options.watch)  # type: ignore[arg-type]
+                        continue
+
+                    self.logger.info(f"\U0001F4C2 {len(ready)} new file(s) found")
+                    try:
+                        self.predict_files(ready, executor, finish, flush=False)
+                    except Exception as error:  # pylint: disable=broad-except
+                        self.logger.error(f"\U0000274C prediction failed: {error}")
+                        for fname in ready:
+                            if not self.is_finished(fname, stats[fname]):
+                                failed[fname] = stats[fname]
+            except KeyboardInterrupt:
+                pass
+            finally:
+                if self.writer is not None:
+                    self.writer.flush()
+        self.logger.info("\U0001F3C1 stopped watching")
+
+    def poll_files(self, stats: Dict[str, Tuple[int, int]]) -> List[str]:
+        """Return files without up-to-date output which did not change since the last poll.
+
+        Args:
+            stats: Size and modification time of all files during the last poll. Updated inplace.
+        """
+        ready = []
+        for fname in grab_files(self.abs_input, self.extensions):
+            try:
+                current = file_stat(fname)
+            except FileNotFoundError:
+                continue
+            previous = stats.get(fname)
+            stats[fname] = current
+            if current != previous or not current[0]:
+                continue
+            if not self.is_finished(fname, current):
+                ready.append(fname)
+        return ready
+
+    def is_finished(self, fname: str, stat: Tuple[int, int]) -> bool:
+        """Check if the manifest records an up-to-date output of an input file."""
+        return self.manifest is not None and self.manifest.is_finished(fname, stat)
+
+    def get_finish_callback(
+        self, stats: Dict[str, Tuple[int, int]]
+    ) -> Optional[Callable[[str, str], None]]:
+        """Return the callback recording saved outputs in the manifest if one is used.
+
+        Args:
+            stats: Size and modification time of the input files when they were read.
+        """
+        if self.manifest is None:
+            return None
+        add = self.manifest.add
+
+        def finish(fname_in: str, fname_out: str) -> None:
+            add(fname_in, fname_out, stats[fname_in])
+
+        return finish
+
     @property
     def path_input(self) -> str:
         """Return absolute input path (dependent on file/folder input)."""
@@ -183,15 +622,62 @@ class HandlePredict:
             )
         return file_list
 
+    def iter_batches(
+        self, file_list: List[str], executor: concurrent.futures.Executor
+    ) -> Iterator[
+        Tuple[str, List[Tuple[int, int, int]], concurrent.futures.Future, bool]
+    ]:
+        """Yield batches of planes as filename, plane indices, future, and if it is a file's last batch.
+
+        Only the image shapes are read in the calling process. They are all checked
+        before the first batch is yielded such that no output is saved if the
+        dimensions do not match. Batches of planes are loaded and normalized ahead in
+        the executor while keeping at most two batches per worker in flight.
+        """
+        self.logger.debug(f"loading image as RGB {self.is_rgb}")
+        image_shapes = [self.load_image_shape(fname) for fname in file_list]
+
+        pending: Deque[
+            Tuple[str, List[Tuple[int, int, int]], concurrent.futures.Future, bool]
+        ] = collections.deque()
+        for fname, image_shape in zip(file_list, image_shapes):
+            indices = _get_plane_indices(image_shape, self.shape)
+            for start in range(0, len(indices), self.options.batchsize):
+                batch_indices = indices[start : start + self.options.batchsize]
+                future = executor.submit(
+                    _load_planes,
+                    fname,
+                    batch_indices,
+                    self.shape,
+                    self.is_rgb,
+                    raw=self.options.radius is not None,
+                )
+                is_last = start + self.options.batchsize >= len(indices)
+                pending.append((fname, batch_indices, future, is_last))
+                if len(pending) > max(self.options.workers, 1) * 2:
+                    yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+    def load_image_shape(self, fname: str) -> Tuple[int, ...]:
+        """Return the shape of an image checking its dimensions match the first image."""
+        # RGB images are converted to grayscale removing the last axis
+        image_shape = load_shape(fname)[:-1] if self.is_rgb else load_shape(fname)
+        if self.first_image_shape is None:
+            self.first_image_shape = image_shape
+            self.shape = self.get_shape(image_shape)
+        elif len(image_shape) != len(self.first_image_shape):
+            raise ValueError("Images must all have the same number of dimensions.")
+        elif image_shape != self.first_image_shape:
+            self.logger.warning(
+                "\U000026A0 images do not have equal shapes (dimensions match)"
+            )
+        return image_shape
+
     @property
-    def image_list(self) -> List[np.ndarray]:
-        """Return a list with all images."""
-        try:
-            is_rgb = "3" in self.raw_shape
-        except TypeError:
-            is_rgb = False
-        self.logger.debug(f"loading image as RGB {is_rgb}")
-        return [load_image(fname, is_rgb=is_rgb) for fname in self.file_list]
+    def is_rgb(self) -> bool:
+        """Return if images are RGB according to the provided shape."""
+        return self.options.shape is not None and "3" in self.options.shape
 
     @property
     def path_output(self) -> str:
@@ -204,78 +690,191 @@ class HandlePredict:
 
     # TODO solve double definition of replace_chars here and in ShapeType
     # TODO solve mypy return type bug
-    @property
-    def shape(self) -> List[str]:
-        """Resolve input shape."""
-        first_image = self.image_list[0]
-        if not all([i.ndim == first_image.ndim for i in self.image_list]):
-            raise ValueError("Images must all have the same number of dimensions.")
-        if not all([i.shape == first_image.shape for i in self.image_list]):
-            self.logger.warning(
-                "\U000026A0 images do not have equal shapes (dimensions match)"
-            )
-
-        if self.raw_shape is None:
-            shape = predict_shape(self.image_list[0].shape)
+    def get_shape(self, image_shape: Tuple[int, ...]) -> List[str]:
+        """Resolve input shape based on the shape of the first image."""
+        if self.options.shape is None:
+            shape = predict_shape(image_shape)
             self.logger.info(f"\U0001F535 using predicted shape of {shape}")
         else:
-            shape = self.raw_shape
+            shape = self.options.shape
             self.logger.info(f"\U0001F535 using provided input shape of {shape}")
         for c in ["(", ")", " "]:
             shape = shape.replace(c, "")
         shape_list = shape.split(",")
         return shape_list
 
-    def save_output(self, fname_in: str, df: pd.DataFrame) -> None:
-        """Save coordinate list to file with appropriate header."""
-        fname_out = os.path.join(self.path_output, f"{basename(fname_in)}.{self.type}")
-        df = delete_non_unique_columns(df)
-        self.logger.debug(f"non-unique columns to be saved are {df.columns}")
+    def get_fname_output(self, fname_in: str) -> str:
+        """Return the absolute output filename corresponding to an input file."""
+        return os.path.join(self.path_output, f"{basename(fname_in)}.{self.type}")
 
-        df.to_csv(fname_out, index=False)
+    def _finish_output(
+        self,
+        fname_in: str,
+        future: concurrent.futures.Future,
+        callback: Optional[Callable[[str, str], None]] = None,
+    ) -> int:
+        """Wait for an output to be saved or consolidated and return the number of spots."""
+        if self.writer is not None:
+            df = future.result()
+            self.writer.add(fname_in, df, callback)
+            return len(df)
+
+        n_spots = future.result()
+        fname_out = self.get_fname_output(fname_in)
         self.logger.info(
             f"\U0001F3C3 prediction of file {fname_in} saved as {fname_out}"
         )
+        if callback is not None:
+            callback(fname_in, fname_out)
+        return n_spots
+
+    def predict_planes(self, images: List[np.ndarray]) -> List[np.ndarray]:
+        """Predict multiple normalized (x,y) images returning one coordinate list each."""
+        if self.options.tilesize is not None and any(
+            s > self.options.tilesize for s in images[0].shape
+        ):
+            return [
+                predict_tiled(
+                    image,
+                    self.model,
+                    tile_size=self.options.tilesize,
+                    normalize=False,
+                    padding=self.options.padding,
+                )
+                for image in images
+            ]
+        return predict_batch(
+            images,
+            self.model,
+            batch_size=self.options.batchsize,
+            padding=self.options.padding,
+            normalize=False,
+        )
+
+
+def _get_plane_indices(
+    image_shape: Tuple[int, ...], shape: List[str]
+) -> List[Tuple[int, int, int]]:
+    """Return the c, t, z indices of all (x,y) planes of an image with axes labeled according to shape."""
+    # RGB images are already converted to grayscale when loaded
+    shape = [name for name in shape if name != "3"]
+    size_c, size_t, size_z = [
+        image_shape[shape.index(i)] if i in shape else 1 for i in ["c", "t", "z"]
+    ]
+    return list(itertools.product(range(size_c), range(size_t), range(size_z)))
+
+
+def _read_planes(
+    fname: str,
+    indices: List[Tuple[int, int, int]],
+    shape: List[str],
+    is_rgb: bool = False,
+) -> List[np.ndarray]:
+    """Read the raw (y,x) planes at the given c, t, z indices of an image.
+
+    Only the requested planes are read from disk (see "LazyImage").
+    """
+    shape = [name for name in shape if name != "3"]
+    transpose = shape.index("x") < shape.index("y")
+    image = LazyImage(fname, is_rgb=is_rgb)
+    try:
+        planes = []
+        for index in indices:
+            position = dict(zip(["c", "t", "z"], index))
+            plane = image[tuple(position.get(name, slice(None)) for name in shape)]
+            planes.append(plane.T if transpose else plane)
+    finally:
+        image.close()
+    return planes
+
+
+def _load_planes(
+    fname: str,
+    indices: List[Tuple[int, int, int]],
+    shape: List[str],
+    is_rgb: bool = False,
+    raw: bool = False,
+) -> Tuple[List[np.ndarray], Optional[List[np.ndarray]]]:
+    """Load the normalized (y,x) planes at the given c, t, z indices of an image.
 
-    def predict_single(
-        self, image: np.ndarray, c_idx: int, t_idx: int, z_idx: int
-    ) -> pd.DataFrame:
-        """Predict a single (x,y) image at given c, t, z positions."""
-        coords = predict(image, self.model)
-        df = pd.DataFrame(coords, columns=["y", "x"])  # originally r, c
-        df["c"] = c_idx
-        df["t"] = t_idx
-        df["z"] = z_idx
-        if self.radius is not None:
-            df["i"] = get_intensities(image, coords, self.radius)
-        return df
-
-    def predict_adaptive(self, fname_in: str, image: np.ndarray) -> None:
-        """Predict and save a single image."""
-        order = ["c", "t", "z", "y", "x"]
-        shape = self.shape
-
-        # Create an image and shape with all possible dimensions
-        for i in order:
-            if i not in shape:
-                image = np.expand_dims(image, axis=-1)
-                shape.append(i)
-
-        # Rearange all axes to match to the desired order
-        for destination, name in enumerate(order):
-            source = shape.index(name)
-            image = np.moveaxis(image, source, destination)
-            shape.insert(destination, shape.pop(source))
-        if not order == shape:
-            self.logger.debug("axes rearangement did not work properly")
-
-        # Iterate through c, t, and z
-        df = pd.DataFrame()
-        for c_idx, t_ser in enumerate(image):
-            for t_idx, z_ser in enumerate(t_ser):
-                for z_idx, single_image in enumerate(z_ser):
-                    curr_df = self.predict_single(single_image, c_idx, t_idx, z_idx)
-                    df = df.append(curr_df)
-
-        self.logger.debug(f"completed prediction loop with\n{df.head()}")
-        self.save_output(fname_in, df)
+    Module-level to be picklable for worker processes. If raw, the raw planes are
+    returned as well such that intensities are measured without reading them again.
+    """
+    planes = _read_planes(fname, indices, shape, is_rgb)
+    return [normalize_image(plane) for plane in planes], planes if raw else None
+
+
+def _get_intensities(
+    planes: Optional[List[np.ndarray]],
+    coords_list: List[np.ndarray],
+    radius: Optional[int],
+    background: Optional[int],
+) -> List[Optional[np.ndarray]]:
+    """Measure spot intensities of multiple raw planes if a radius was given.
+
+    Module-level to be picklable for worker processes.
+    """
+    if radius is None or planes is None:
+        return [None for _ in coords_list]
+    return [
+        get_intensities(plane, coords, radius, background or 0)
+        for plane, coords in zip(planes, coords_list)
+    ]
+
+
+def _get_output(
+    coords_list: List[np.ndarray],
+    intensities_list: List[Optional[np.ndarray]],
+    indices: List[Tuple[int, int, int]],
+    background: Optional[int],
+    unique: bool = True,
+) -> "pd.DataFrame":
+    """Return the coordinates of all planes of one image as DataFrame.
+
+    Args:
+        coords_list: Coordinates of every plane.
+        intensities_list: Intensities of every plane if measured.
+        indices: c, t, z indices of every plane.
+        background: Background ring width determining if "b" and "snr" are added.
+        unique: If columns with only one unique value should be deleted.
+    """
+    buffer = ColumnBuffer()
+    for coords, intensities, (c_idx, t_idx, z_idx) in zip(
+        coords_list, intensities_list, indices
+    ):
+        chunk = {
+            "y": coords[:, 0],  # originally r, c
+            "x": coords[:, 1],
+            "c": c_idx,
+            "t": t_idx,
+            "z": z_idx,
+        }
+        if intensities is not None:
+            chunk["i"] = intensities[:, 0]
+            if background:
+                chunk["b"] = intensities[:, 1]
+                chunk["snr"] = intensities[:, 2]
+        buffer.append(chunk)
+    df = buffer.to_frame()
+    return delete_non_unique_columns(df) if unique else df
+
+
+def _save_output(
+    fname_out: str,
+    coords_list: List[np.ndarray],
+    intensities_list: List[Optional[np.ndarray]],
+    indices: List[Tuple[int, int, int]],
+    background: Optional[int],
+    fmt: str = "csv",
+) -> int:
+    """Save the coordinates of all planes of one image to file with appropriate header.
+
+    Module-level to be picklable for worker processes. The output is written to a
+    temporary file first such that it is never left incomplete.
+
+    Returns:
+        Number of spots saved.
+    """
+    df = _get_output(coords_list, intensities_list, indices, background)
+    save_frame(df, fname_out, fmt)
+    return len(df)
@@ -0,0 +1,535 @@
+"""CLI submodule for serving warm models to low-latency prediction requests."""
+
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
+import argparse
+import collections
+import concurrent.futures
+import http.server
+import io
+import json
+import logging
+import os
+import queue
+import socketserver
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+from ..inference import MAX_COMPILED_FUNCTIONS
+from ..inference import CompiledPredictor
+from ..inference import get_intensities
+from ..inference import predict_batch
+from ..io import basename
+from ..io import load_model
+from ._parseutil import CustomFormatter
+from ._parseutil import FileType
+from ._parseutil import _add_utils
+from ._parseutil import _add_xla
+
+# Number of most recent request latencies used for percentiles
+LATENCY_WINDOW = 10000
+
+
+def _parse_args_serve(
+    subparsers: argparse._SubParsersAction, parent_parser: argparse.ArgumentParser
+):
+    """Subparser for serving."""
+    parser = subparsers.add_parser(
+        "serve",
+        parents=[parent_parser],
+        formatter_class=CustomFormatter,
+        add_help=False,
+        description=(
+            "\U0001F6CE Serving submodule \U0001F6CE\n\n"
+            "Keep models loaded and warmed up to answer prediction requests with low latency. "
+            "Images are sent via HTTP POST requests to '/predict?model=NAME' "
+            "as raw TIFF, PNG, JPEG, or npy file content and coordinates are returned as csv. "
+            "Concurrent requests are batched dynamically. "
+            "Latency percentiles are available at '/stats'."
+        ),
+        help="\U0001F6CE Serve warm models for low-latency prediction requests.",
+    )
+    group1 = parser.add_argument_group("Required")
+    group1.add_argument(
+        "-m",
+        "--model",
+        required=True,
+        nargs="+",
+        type=FileType(["h5"]),
+        help=(
+            "Model(s) to serve. "
+            "Models are referenced in requests by their basename without extension. "
+            "The first model is used if no model is specified in a request. "
+            "[required]"
+        ),
+    )
+    group2 = parser.add_argument_group("Optional")
+    group2.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="Host address of the HTTP server. [default: 127.0.0.1]",
+    )
+    group2.add_argument(
+        "-p",
+        "--port",
+        type=int,
+        default=8000,
+        help="Port of the HTTP server. [default: 8000]",
+    )
+    group2.add_argument(
+        "-s",
+        "--socket",
+        type=str,
+        default=None,
+        help=(
+            "Path to a Unix socket. "
+            "If given, requests are served over the socket instead of host and port. "
+            "[default: None]"
+        ),
+    )
+    group2.add_argument(
+        "-r",
+        "--radius",
+        type=int,
+        default=None,
+        help=(
+            "Intensity radius. "
+            "If given, will calculate the integrated intensity in the specified radius around each coordinate. "
+            "[default: None]"
+        ),
+    )
+    group2.add_argument(
+        "-b",
+        "--background",
+        type=int,
+        default=None,
+        help=(
+            "Background ring width. "
+            "If given with --radius, also measures the local background and signal-to-noise ratio. "
+            "[default: None]"
+        ),
+    )
+    group2.add_argument(
+        "--batchsize",
+        type=int,
+        default=16,
+        help="Maximum number of concurrent requests predicted at once. [default: 16]",
+    )
+    group2.add_argument(
+        "--batchwait",
+        type=float,
+        default=5,
+        help=(
+            "Batching delay. "
+            "Milliseconds to wait for further requests before predicting a batch. "
+            "[default: 5]"
+        ),
+    )
+    group2.add_argument(
+        "--warmup",
+        type=int,
+        nargs="*",
+        default=[512],
+        help=(
+            "Warmup sizes. "
+            "Square image sizes predicted once on startup to trace the models. "
+            "[default: 512]"
+        ),
+    )
+    _add_xla(group2)
+    _add_utils(parser)
+
+
+class LatencyTracker:
+    """Thread-safe record of the most recent request latencies."""
+
+    def __init__(self, maxlen: int = LATENCY_WINDOW):
+        self._latencies: collections.deque = collections.deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def add(self, seconds: float) -> None:
+        """Add the latency of one request."""
+        with self._lock:
+            self._latencies.append(seconds)
+            self.count += 1
+
+    def summary(self) -> Dict[str, float]:
+        """Return the total number of requests and p50/p99 latencies in milliseconds."""
+        with self._lock:
+            latencies = list(self._latencies)
+            count = self.count
+        if not latencies:
+            return {"requests": count, "p50_ms": float("nan"), "p99_ms": float("nan")}
+        p50, p99 = np.percentile(np.array(latencies) * 1000, [50, 99])
+        return {"requests": count, "p50_ms": float(p50), "p99_ms": float(p99)}
+
+
+def _get_bucket(n: int, batch_size: int) -> int:
+    """Return the padded batch size used to predict n images."""
+    return min(2 ** int(np.ceil(np.log2(n))), batch_size)
+
+
+def get_buckets(batch_size: int) -> List[int]:
+    """Return all padded batch sizes used for predictions of up to batch_size images."""
+    return sorted({_get_bucket(n, batch_size) for n in range(1, batch_size + 1)})
+
+
+class DynamicBatcher:
+    """Collects concurrent prediction requests into batches for one model.
+
+    A single thread owns the model. It waits for the first request and then up to
+    max_wait seconds for further requests until batch_size images are collected.
+    Images of equal shape are predicted together and padded to the next power of two
+    such that only a few batch sizes are ever traced by the model (see "warmup").
+
+    Args:
+        model: Model used for predictions.
+        batch_size: Maximum number of images predicted at once.
+        max_wait: Seconds to wait for further requests after the first one.
+    """
+
+    def __init__(self, model: Any, batch_size: int = 16, max_wait: float = 0.005):
+        self.model = model
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def buckets(self) -> List[int]:
+        """Return all batch sizes used for predictions."""
+        return get_buckets(self.batch_size)
+
+    def bucket(self, n: int) -> int:
+        """Return the padded batch size used to predict n images."""
+        return _get_bucket(n, self.batch_size)
+
+    def warmup(self, size: int) -> None:
+        """Trace the model for all batch sizes of square images with the given size."""
+        image = np.random.random((size, size)).astype(np.float32)
+        for bucket in self.buckets:
+            predict_batch([image] * bucket, self.model, bucket)
+
+    def predict(self, images: List[np.ndarray]) -> List[np.ndarray]:
+        """Predict images grouped by shape and padded to the next bucket size."""
+        groups: Dict[Tuple[int, ...], List[int]] = collections.defaultdict(list)
+        for idx, image in enumerate(images):
+            groups[image.shape].append(idx)
+
+        coords_list: List[np.ndarray] = [None] * len(images)  # type: ignore[list-item]
+        for indices in groups.values():
+            bucket = self.bucket(len(indices))
+            batch = [images[idx] for idx in indices]
+            batch += [batch[-1]] * (bucket - len(batch))
+            for idx, coords in zip(indices, predict_batch(batch, self.model, bucket)):
+                coords_list[idx] = coords
+        return coords_list
+
+    def submit(self, image: np.ndarray) -> concurrent.futures.Future:
+        """Queue an image for prediction returning a future of its coordinates."""
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        self._queue.put((image, future))
+        return future
+
+    def close(self) -> None:
+        """Stop the batching thread after all queued requests are finished."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _next_batch(self) -> Optional[List[Tuple[Any, concurrent.futures.Future]]]:
+        """Block until one request is available and collect further ones."""
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                if timeout > 0:
+                    item = self._queue.get(timeout=timeout)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            images, futures = zip(*batch)
+            try:
+                coords_list = self.predict(list(images))
+            except Exception as error:  # pylint: disable=broad-except
+                for future in futures:
+                    future.set_exception(error)
+                continue
+            for future, coords in zip(futures, coords_list):
+                future.set_result(coords)
+
+
+class UnknownModelError(LookupError):
+    """Raised if a request names a model which is not served."""
+
+
+def decode_image(data: bytes) -> np.ndarray:
+    """Decode the content of a npy, TIFF, PNG, or JPEG file into a 2D float32 image."""
+    if data.startswith(b"\x93NUMPY"):
+        image = np.load(io.BytesIO(data), allow_pickle=False)
+    elif data[:4] in (b"II*\x00", b"MM\x00*", b"II+\x00", b"MM\x00+"):
+        import tifffile  # pylint: disable=import-outside-toplevel
+
+        image = tifffile.imread(io.BytesIO(data))
+    else:
+        import skimage.io  # pylint: disable=import-outside-toplevel
+
+        image = skimage.io.imread(io.BytesIO(data))
+    image = np.asarray(image, dtype=np.float32).squeeze()
+    if image.ndim != 2:
+        raise ValueError(f"Images must be 2D (x, y). Shape {image.shape} is not.")
+    return image
+
+
+class _RequestHandler(http.server.BaseHTTPRequestHandler):
+    """HTTP request handler forwarding requests to the HandleServe instance."""
+
+    server: Any
+
+    def address_string(self) -> str:
+        # Unix sockets have no client address
+        if isinstance(self.client_address, tuple) and self.client_address:
+            return str(self.client_address[0])
+        return "unix"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        self.server.handler.logger.debug(f"{self.address_string()} - {format % args}")
+
+    def _respond(self, status: int, body: str, content_type: str = "text/plain"):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _respond_error(self, status: int, message: str):
+        self._respond(status, json.dumps({"error": message}), "application/json")
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Return health or latency statistics."""
+        path = urllib.parse.urlparse(self.path).path
+        if path == "/health":
+            self._respond(200, "ok")
+        elif path == "/stats":
+            stats = self.server.handler.stats
+            self._respond(200, json.dumps(stats), "application/json")
+        else:
+            self._respond_error(404, f"Unknown path {path}.")
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Predict on the image in the request body and return a csv."""
+        start = time.perf_counter()
+        url = urllib.parse.urlparse(self.path)
+        if url.path != "/predict":
+            self._respond_error(404, f"Unknown path {url.path}.")
+            return
+
+        query = urllib.parse.parse_qs(url.query)
+        name = query.get("model", [None])[0]
+        try:
+            data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            csv = self.server.handler.predict(data, name)
+        except UnknownModelError as error:
+            self._respond_error(404, str(error))
+            return
+        except (ValueError, OSError) as error:
+            self._respond_error(400, f"Image could not be processed. {error}")
+            return
+        except Exception as error:  # pylint: disable=broad-except
+            self.server.handler.logger.error(
+                f"\U0000274C prediction failed: {error}", exc_info=True
+            )
+            self._respond_error(500, f"Prediction failed. {error}")
+            return
+
+        self._respond(200, csv, "text/csv")
+        self.server.handler.latency.add(time.perf_counter() - start)
+
+
+class _HTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    handler: "HandleServe"
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    handler: "HandleServe"
+
+
+class ServeOptions(NamedTuple):
+    """Options of the served models and their predictions.
+
+    Args:
+        radius: Size of integrated image intensity calculation.
+        background: Width of the ring used to measure the local background.
+        batchsize: Maximum number of requests predicted at once.
+        batchwait: Milliseconds to wait for further requests to be batched.
+        warmup: Square image sizes predicted once on startup.
+        xla: If models should be compiled with XLA.
+    """
+
+    radius: Optional[int] = None
+    background: Optional[int] = None
+    batchsize: int = 16
+    batchwait: float = 5
+    warmup: Tuple[int, ...] = (512,)
+    xla: bool = False
+
+
+class HandleServe:
+    """Handle serving submodule for CLI.
+
+    Args:
+        arg_model: Paths to model.h5 files.
+        arg_host: Host address of the HTTP server.
+        arg_port: Port of the HTTP server. Zero selects a free port.
+        arg_socket: Path to a Unix socket used instead of host and port.
+        arg_options: Options of the served models and their predictions.
+        logger: Logger to log verbose output.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(
+        self,
+        arg_model: List[str],
+        arg_host: str,
+        arg_port: int,
+        arg_socket: Optional[str],
+        logger: logging.Logger,
+        arg_options: ServeOptions = ServeOptions(),
+    ):
+        self.fname_models = arg_model
+        self.host = arg_host
+        self.port = arg_port
+        self.socket = arg_socket
+        self.radius = arg_options.radius
+        self.background = arg_options.background
+        self.batch_size = arg_options.batchsize
+        self.batch_wait = arg_options.batchwait / 1000
+        self.warmup_sizes = list(arg_options.warmup or [])
+        self.xla = arg_options.xla
+        self.logger = logger
+        self.logger.info("\U0001F6CE starting serving submodule")
+
+        self.latency = LatencyTracker()
+        self.batchers: Dict[str, DynamicBatcher] = {}
+        self.server: Optional[Union[_UnixHTTPServer, _HTTPServer]] = None
+
+    def __call__(self):
+        """Serve requests until interrupted."""
+        server = self.start()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    @property
+    def address(self) -> str:
+        """Return the address requests are served at."""
+        if self.socket is not None:
+            return f"unix://{os.path.abspath(self.socket)}"
+        if self.server is None:
+            return f"http://{self.host}:{self.port}"
+        host, port = self.server.socket.getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        """Return request statistics and served models."""
+        return {**self.latency.summary(), "models": list(self.batchers)}
+
+    def load_models(self) -> None:
+        """Load and warm up all models."""
+        for fname in self.fname_models:
+            name = basename(fname)
+            # Keep compiled functions of all warmed up shapes
+            n_shapes = len(get_buckets(self.batch_size)) * len(self.warmup_sizes)
+            model = CompiledPredictor(
+                load_model(os.path.abspath(fname)),
+                self.xla,
+                max(MAX_COMPILED_FUNCTIONS, 2 * n_shapes),
+            )
+            batcher = DynamicBatcher(model, self.batch_size, self.batch_wait)
+            for size in self.warmup_sizes:
+                batcher.warmup(size)
+            self.batchers[name] = batcher
+            self.logger.info(f"\U0001F9E0 model {name} imported and warmed up")
+
+    def start(self) -> socketserver.BaseServer:
+        """Load models and bind the server without serving requests yet."""
+        self.load_models()
+        server: Union[_UnixHTTPServer, _HTTPServer]
+        if self.socket is not None:
+            if os.path.exists(self.socket):
+                os.remove(self.socket)
+            server = _UnixHTTPServer(self.socket, _RequestHandler)
+        else:
+            server = _HTTPServer((self.host, self.port), _RequestHandler)
+        server.handler = self
+        self.server = server
+        self.logger.info(f"\U0001F310 serving requests at {self.address}")
+        return server
+
+    def stop(self) -> None:
+        """Close the server and batchers and log the final latency statistics."""
+        if self.server is not None:
+            self.server.server_close()
+            if self.socket is not None and os.path.exists(self.socket):
+                os.remove(self.socket)
+        for batcher in self.batchers.values():
+            batcher.close()
+        stats = self.latency.summary()
+        self.logger.info(
+            f"\U0001F4CA served {stats['requests']} requests - "
+            f"p50 {stats['p50_ms']:.2f}ms, p99 {stats['p99_ms']:.2f}ms"
+        )
+        self.logger.info("\U0001F3C1 server stopped")
+
+    def predict(self, data: bytes, name: Optional[str] = None) -> str:
+        """Predict on an encoded image returning the coordinates in csv format."""
+        if name is None:
+            name = next(iter(self.batchers))
+        if name not in self.batchers:
+            raise UnknownModelError(
+                f"Unknown model {name}. Available are {list(self.batchers)}."
+            )
+
+        image = decode_image(data)
+        coords = self.batchers[name].submit(image).result()
+
+        import pandas as pd  # pylint: disable=import-outside-toplevel
+
+        df = pd.DataFrame({"y": coords[:, 0], "x": coords[:, 1]})  # originally r, c
+        if self.radius is not None:
+            intensities = get_intensities(
+                image, coords, self.radius, self.background or 0
+            )
+            df["i"] = intensities[:, 0]
+            if self.background:
+                df["b"] = intensities[:, 1]
+                df["snr"] = intensities[:, 2]
+        return df.to_csv(index=False)
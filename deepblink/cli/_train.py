@@ -5,7 +5,6 @@ import logging
 import os
 import yaml
 
-from ..training import run_experiment
 from ._parseutil import CustomFormatter
 from ._parseutil import FileType
 from ._parseutil import _add_utils
@@ -75,6 +74,9 @@ class HandleTrain:
         """Set configuration and start training loop."""
         self.set_gpu()
         self.logger.info("\U0001F3C3 beginning with training")
+        # Avoid slow imports for other commands
+        from ..training import run_experiment  # pylint: disable=import-outside-toplevel
+
         run_experiment(self.config)
         self.logger.info("\U0001F3C1 training complete")
 
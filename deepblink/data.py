@@ -1,7 +1,7 @@
 """List of functions to handle data including converting matrices <-> coordinates."""
 
 
-from typing import Tuple
+from typing import Iterable, Tuple
 import math
 import operator
 
@@ -52,31 +52,53 @@ def get_coordinate_list(matrix: np.ndarray, image_size: int = 512) -> np.ndarray
 
     matrix_size = max(matrix.shape)  # Handles non-square images
     cell_size = image_size // matrix_size
-    coords_r = []
-    coords_c = []
-
-    # Top left coordinates of every cell
-    grid = np.array([c * cell_size for c in range(matrix_size)])
 
     # Coordinates of cells > 0.5
     matrix_r, matrix_c = np.round(matrix[..., 0]).nonzero()
-    for r, c in zip(matrix_r, matrix_c):
 
-        grid_r = grid[r]
-        grid_c = grid[c]
-        spot_r = matrix[r, c, 1]
-        spot_c = matrix[r, c, 2]
+    # Top left coordinates of every cell plus relative spot coordinates
+    coords_r = matrix_r * cell_size + matrix[matrix_r, matrix_c, 1] * cell_size
+    coords_c = matrix_c * cell_size + matrix[matrix_r, matrix_c, 2] * cell_size
 
-        coord_abs = absolute_coordinate(
-            coord_spot=(spot_r, spot_c),
-            coord_cell=(grid_r, grid_c),
-            cell_size=cell_size,
-        )
+    return np.array([coords_r, coords_c]).T
 
-        coords_r.append(coord_abs[0])
-        coords_c.append(coord_abs[1])
 
-    return np.array([coords_r, coords_c]).T
+def get_coordinate_list_batch(
+    matrices: np.ndarray, image_size: int = 512
+) -> np.ndarray:
+    """Convert a stack of prediction matrices into one list of coordinates.
+
+    Equivalent to calling get_coordinate_list on every matrix but without
+    looping over matrices or cells.
+
+    Args:
+        matrices: Matrix representations of spot coordinates with shape (n, r, c, 3).
+        image_size: Default image size the grid was layed on.
+
+    Returns:
+        Array of r, c coordinates and the index of the matrix they belong to
+        with the shape (n, 3).
+    """
+    if not matrices.ndim == 4:
+        raise ValueError("Matrices must have a shape of (n, r, c, 3).")
+    if not matrices.shape[3] == 3:
+        raise ValueError("Matrices must have a depth of 3.")
+
+    matrix_size = max(matrices.shape[1:])  # Handles non-square images
+    cell_size = image_size // matrix_size
+
+    # Coordinates of cells > 0.5
+    frames, matrix_r, matrix_c = np.round(matrices[..., 0]).nonzero()
+
+    # Top left coordinates of every cell plus relative spot coordinates
+    coords_r = (
+        matrix_r * cell_size + matrices[frames, matrix_r, matrix_c, 1] * cell_size
+    )
+    coords_c = (
+        matrix_c * cell_size + matrices[frames, matrix_r, matrix_c, 2] * cell_size
+    )
+
+    return np.array([coords_r, coords_c, frames]).T
 
 
 def absolute_coordinate(
@@ -124,16 +146,92 @@ def get_prediction_matrix(
         ncol = math.ceil(size_c / cell_size)
 
     prediction_matrix = np.zeros((nrow, ncol, 3))
-    for r, c in coords:
-        # Position of cell coordinate in prediction matrix
-        cell_r = min(nrow - 1, int(np.floor(r)) // cell_size)
-        cell_c = min(ncol - 1, int(np.floor(c)) // cell_size)
+    cell_r, cell_c, relative_r, relative_c = _get_cell_positions(
+        coords, nrow, ncol, cell_size
+    )
 
-        # Relative position within cell
-        relative_r = (r - cell_r * cell_size) / cell_size
-        relative_c = (c - cell_c * cell_size) / cell_size
+    # Only keep the last spot per cell as if assigned one after another
+    keep = _last_unique(cell_r * ncol + cell_c)
 
-        # Assign values along prediction matrix dimension 3
-        prediction_matrix[cell_r, cell_c] = 1, relative_r, relative_c
+    # Assign values along prediction matrix dimension 3
+    prediction_matrix[cell_r[keep], cell_c[keep]] = np.stack(
+        [np.ones(len(keep)), relative_r[keep], relative_c[keep]], axis=-1
+    )
 
     return prediction_matrix
+
+
+def get_prediction_matrices(
+    coords_list: Iterable[np.ndarray],
+    image_size: int,
+    cell_size: int = 4,
+    size_c: int = None,
+) -> np.ndarray:
+    """Return np.ndarray of shape (n, r, c, 3): p, r, c format for each cell of every image.
+
+    Equivalent to calling get_prediction_matrix on every element of coords_list
+    but filled with one scatter operation into a preallocated float32 array.
+
+    Args:
+        coords_list: Coordinate lists in r, c format with shape (m, 2). One per image.
+        image_size: Size of the images from which the coordinates are extracted.
+        cell_size: Size of one grid cell inside the matrix.
+        size_c: If empty, assumes squared images. Else the length of the r axis.
+
+    Returns:
+        The prediction matrices as numpy array of shape (n, r, c, 3).
+    """
+    nrow = ncol = math.ceil(image_size / cell_size)
+    if size_c is not None:
+        ncol = math.ceil(size_c / cell_size)
+
+    coords_list = list(coords_list)
+    prediction_matrices = np.zeros((len(coords_list), nrow, ncol, 3), dtype=np.float32)
+    if not coords_list:
+        return prediction_matrices
+
+    positions = [
+        _get_cell_positions(coords, nrow, ncol, cell_size) for coords in coords_list
+    ]
+    frames = np.repeat(
+        np.arange(len(coords_list)), [len(cell_r) for cell_r, *_ in positions]
+    )
+    cell_r, cell_c, relative_r, relative_c = [
+        np.concatenate(values) for values in zip(*positions)
+    ]
+
+    # Only keep the last spot per cell as if assigned one after another
+    keep = _last_unique((frames * nrow + cell_r) * ncol + cell_c)
+
+    # Assign values along prediction matrix dimension 3
+    prediction_matrices[frames[keep], cell_r[keep], cell_c[keep]] = np.stack(
+        [np.ones(len(keep)), relative_r[keep], relative_c[keep]], axis=-1
+    )
+
+    return prediction_matrices
+
+
+def _get_cell_positions(
+    coords: np.ndarray, nrow: int, ncol: int, cell_size: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Return the cells and relative positions within cells of all coordinates."""
+    coords = np.asarray(coords)
+    if not np.issubdtype(coords.dtype, np.floating):
+        coords = coords.astype(np.float64)
+    coords = coords.reshape(-1, 2)
+
+    # Position of cell coordinate in prediction matrix
+    cell_r = np.minimum(nrow - 1, np.floor(coords[:, 0]).astype(int) // cell_size)
+    cell_c = np.minimum(ncol - 1, np.floor(coords[:, 1]).astype(int) // cell_size)
+
+    # Relative position within cell
+    relative_r = (coords[:, 0] - (cell_r * cell_size).astype(coords.dtype)) / cell_size
+    relative_c = (coords[:, 1] - (cell_c * cell_size).astype(coords.dtype)) / cell_size
+
+    return cell_r, cell_c, relative_r, relative_c
+
+
+def _last_unique(index: np.ndarray) -> np.ndarray:
+    """Return the positions of the last occurrence of every unique value in index."""
+    _, reverse_position = np.unique(index[::-1], return_index=True)
+    return len(index) - 1 - reverse_position
@@ -1,7 +1,15 @@
 """Datasets module with classes to handle data import and data presentation for training."""
 
 from ._datasets import Dataset
+from .chunked import ChunkedSpotsDataset
+from .pipeline import get_tf_dataset
 from .sequence import SequenceDataset
 from .spots import SpotsDataset
 
-__all__ = ["Dataset", "SequenceDataset", "SpotsDataset"]
+__all__ = [
+    "ChunkedSpotsDataset",
+    "Dataset",
+    "SequenceDataset",
+    "SpotsDataset",
+    "get_tf_dataset",
+]
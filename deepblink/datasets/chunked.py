@@ -0,0 +1,218 @@
+"""ChunkedSpotsDataset class."""
+
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+import collections
+import os
+import warnings
+
+import numpy as np
+
+from ..data import get_prediction_matrices
+from ..data import next_power
+from ..data import normalize_image
+from ..io import load_chunked_index
+from ..io import load_shard
+from .spots import SpotsDataset
+
+# Number of decompressed shards kept in memory for compressed datasets
+MAX_CACHED_SHARDS = 4
+
+
+class ChunkedSplit:
+    """Random-access view of one split in a chunked dataset.
+
+    Shards are loaded lazily on first access. Uncompressed shards are memory-mapped,
+    compressed shards are decompressed and kept in a small LRU cache.
+
+    Args:
+        path: Directory of the chunked dataset.
+        info: Split entry of the dataset index.
+    """
+
+    def __init__(self, path: str, info: Dict):
+        self.path = path
+        self.files = [shard["file"] for shard in info["shards"]]
+        self.image_shape = tuple(info["shape"] or ())
+        self.offsets = np.cumsum([0] + [shard["length"] for shard in info["shards"]])
+        self._shards: collections.OrderedDict = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        """Return the number of images in the split."""
+        return int(self.offsets[-1])
+
+    def __getstate__(self):
+        """Return the state to pickle without loaded shards."""
+        state = self.__dict__.copy()
+        state["_shards"] = collections.OrderedDict()
+        return state
+
+    def shard(self, idx: int) -> Dict[str, np.ndarray]:
+        """Return the arrays of one shard."""
+        if idx in self._shards:
+            self._shards.move_to_end(idx)
+            return self._shards[idx]
+
+        arrays = load_shard(os.path.join(self.path, self.files[idx]))
+        self._shards[idx] = arrays
+        if not isinstance(arrays["images"], np.memmap):
+            while len(self._shards) > MAX_CACHED_SHARDS:
+                self._shards.popitem(last=False)
+        return arrays
+
+    def locate(self, idx: int) -> Tuple[int, int]:
+        """Return shard and position within shard of the global index idx."""
+        if not -len(self) <= idx < len(self):
+            raise IndexError(f"Index {idx} out of range for length {len(self)}.")
+        idx %= len(self)
+        shard = int(np.searchsorted(self.offsets, idx, side="right")) - 1
+        return shard, idx - int(self.offsets[shard])
+
+    def image(self, idx: int) -> np.ndarray:
+        """Return the raw image at index idx."""
+        shard, pos = self.locate(idx)
+        return self.shard(shard)["images"][pos]
+
+    def coords(self, idx: int) -> np.ndarray:
+        """Return the coordinates of the image at index idx."""
+        shard, pos = self.locate(idx)
+        arrays = self.shard(shard)
+        start, end = arrays["offsets"][pos], arrays["offsets"][pos + 1]
+        return np.asarray(arrays["coords"][start:end])
+
+
+class _LazyArray:
+    """Read-only array-like view converting items of a ChunkedSplit on access."""
+
+    def __init__(self, split: ChunkedSplit):
+        self.split = split
+
+    def __len__(self) -> int:
+        return len(self.split)
+
+    @property
+    def ndim(self) -> int:
+        """Number of dimensions."""
+        return len(self.shape)
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        """Shape of the full array."""
+        raise NotImplementedError
+
+    def _convert(self, indices: List[int]) -> np.ndarray:
+        """Return the converted items at the given indices."""
+        raise NotImplementedError
+
+    def __getitem__(self, key: Union[int, slice, np.ndarray, list]) -> np.ndarray:
+        if isinstance(key, (int, np.integer)):
+            return self._convert([int(key)])[0]
+        if isinstance(key, slice):
+            return self._convert(list(range(*key.indices(len(self)))))
+        return self._convert([int(idx) for idx in np.asarray(key).ravel()])
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def __array__(self, dtype=None) -> np.ndarray:
+        return np.asarray(self[:], dtype=dtype)
+
+
+class ChunkedImages(_LazyArray):
+    """Normalized float32 images of a ChunkedSplit."""
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        """Shape of the full array."""
+        return (len(self), *self.split.image_shape)
+
+    def _convert(self, indices: List[int]) -> np.ndarray:
+        images = np.empty((len(indices), *self.split.image_shape), dtype=np.float32)
+        for i, idx in enumerate(indices):
+            images[i] = normalize_image(self.split.image(idx))
+        return images
+
+
+class ChunkedLabels(_LazyArray):
+    """Prediction matrices of a ChunkedSplit created from the stored coordinates.
+
+    Args:
+        split: Split to be converted.
+        cell_size: Number of pixels constituting one cell in the prediction matrix.
+    """
+
+    def __init__(self, split: ChunkedSplit, cell_size: int):
+        super().__init__(split)
+        self.cell_size = cell_size
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        """Shape of the full array."""
+        return (len(self), *self._convert([]).shape[1:])
+
+    def _convert(self, indices: List[int]) -> np.ndarray:
+        image_size = self.split.image_shape[0] if self.split.image_shape else 0
+        return get_prediction_matrices(
+            [self.split.coords(idx) for idx in indices], image_size, self.cell_size
+        )
+
+
+class ChunkedSpotsDataset(SpotsDataset):
+    """Class used to lazily load spots data larger than memory.
+
+    Images and labels are read from a chunked dataset (see "io.ChunkedDatasetWriter")
+    and only converted into normalized images and prediction matrices when accessed.
+    Uncompressed datasets are memory-mapped and only the requested items are read.
+
+    Args:
+        name: Path to the chunked dataset directory.
+        cell_size: Number of pixels (from original image) constituting
+            one cell in the prediction matrix.
+        cache_dir: Not used. Chunked datasets are read lazily and memory-mapped
+            (if uncompressed) and therefore not cached. A warning is raised if passed.
+    """
+
+    def __init__(self, name: str, cell_size: int, cache_dir: Optional[str] = None):
+        if cache_dir:
+            warnings.warn(
+                f"Chunked datasets are not cached. cache_dir '{cache_dir}' is ignored.",
+                UserWarning,
+            )
+        super().__init__(name, cell_size)
+
+    def load_data(self) -> None:
+        """Create lazy views of all splits."""
+        index = load_chunked_index(self.data_filename)
+        splits = {
+            name: ChunkedSplit(self.data_filename, info)
+            for name, info in index["splits"].items()
+        }
+        for name, split in splits.items():
+            setattr(self, f"x_{name}", ChunkedImages(split))
+            setattr(self, f"y_{name}", ChunkedLabels(split, self.cell_size))
+
+    @property
+    def image_size(self):
+        """Check if all images have the same square shape."""
+        shapes = {
+            dataset.split.image_shape
+            for dataset in [self.x_train, self.x_valid]
+            if len(dataset)  # type: ignore[arg-type]
+        }
+        if len(shapes) != 1:
+            raise ValueError("All images must have the same shape.")
+        base_shape = shapes.pop()
+        if not base_shape[0] == base_shape[1]:
+            raise ValueError("Images must be square. ")
+        if not base_shape[0] == next_power(base_shape[0]):
+            raise ValueError(
+                f"Images sidelength must be a power of two. {base_shape[0]} is not."
+            )
+
+        return base_shape[0]
+
+    def prepare_data(self) -> None:
+        """Labels are converted into prediction matrices lazily when accessed."""
+
+    def normalize_dataset(self) -> None:
+        """Images are normalized lazily when accessed."""
@@ -0,0 +1,253 @@
+"""tf.data input pipeline as alternative to SequenceDataset."""
+
+from typing import Any, Callable, Optional, Tuple
+import warnings
+
+import numpy as np
+import tensorflow as tf
+
+AUTOTUNE = tf.data.experimental.AUTOTUNE
+
+
+def get_tf_dataset(
+    x: np.ndarray,
+    y: np.ndarray,
+    batch_size: int = 16,
+    augment_fn: Optional[Callable] = None,
+    shuffle: bool = True,
+    overfit: bool = False,
+    format_fn: Optional[Callable] = None,
+) -> tf.data.Dataset:
+    """Create a tf.data input pipeline used to feed data into model.fit.
+
+    Augmentation runs in parallel on multiple threads outside of the python
+    interpreter and batches are prefetched while the model is trained.
+    Batches and the number of batches per epoch are equivalent to the ones created
+    by SequenceDataset.
+
+    In-memory arrays are sliced directly. Lazily loaded or memory-mapped inputs
+    such as the splits of a ChunkedSpotsDataset are never read as a whole,
+    indices are shuffled instead and only one batch is read at a time.
+
+    Args:
+        x: Images with shape (n, x, y).
+        y: Targets / prediction matrices with shape (n, r, c, 3).
+        batch_size: Size of one mini-batch.
+        augment_fn: Function to augment one image and target tensor, e.g. "augment_tensors".
+        shuffle: If data should be shuffled every epoch.
+        overfit: If only one batch should be used thereby causing overfitting.
+        format_fn: Function to format one mini-batch of x and y (numpy arrays) before
+            augmentation as in SequenceDataset.
+    """
+    if len(x) <= batch_size:
+        warnings.warn(
+            "Batch size larger than dataset, setting batch size to match length of dataset",
+            RuntimeWarning,
+        )
+        batch_size = len(x)
+
+    # Overfitting repeats the first batch as often as there are batches in an epoch
+    n_repeats = len(x) // batch_size
+
+    # Formatted shapes are inferred from the first item
+    x_shape, y_shape = np.shape(x[:1])[1:], np.shape(y[:1])[1:]
+    if format_fn is not None:
+        x_first, y_first = format_fn(np.asarray(x[:1]), np.asarray(y[:1]))
+        x_shape, y_shape = x_first.shape[1:], y_first.shape[1:]
+
+    if _is_in_memory(x) and _is_in_memory(y):
+        dataset = tf.data.Dataset.from_tensor_slices(
+            (np.asarray(x, dtype=np.float32), np.asarray(y, dtype=np.float32))
+        )
+        if overfit:
+            dataset = dataset.take(batch_size).repeat(n_repeats)
+        elif shuffle:
+            dataset = dataset.shuffle(len(x), reshuffle_each_iteration=True)
+        if format_fn is not None:
+            dataset = dataset.batch(batch_size).map(
+                _map_numpy(format_fn, x_shape, y_shape)
+            )
+            dataset = dataset.unbatch()
+    else:
+        indices = tf.data.Dataset.range(len(x))
+        if overfit:
+            indices = indices.take(batch_size).repeat(n_repeats)
+        elif shuffle:
+            indices = indices.shuffle(len(x), reshuffle_each_iteration=True)
+
+        def load(batch_indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+            batch_x = np.asarray(x[batch_indices])
+            batch_y = np.asarray(y[batch_indices])
+            if format_fn is not None:
+                batch_x, batch_y = format_fn(batch_x, batch_y)
+            return batch_x, batch_y
+
+        dataset = indices.batch(batch_size).map(_map_numpy(load, x_shape, y_shape))
+        dataset = dataset.unbatch()
+
+    if augment_fn is not None:
+        dataset = dataset.map(augment_fn, num_parallel_calls=AUTOTUNE)
+    dataset = dataset.map(_format_tensors, num_parallel_calls=AUTOTUNE)
+
+    return dataset.batch(batch_size, drop_remainder=True).prefetch(AUTOTUNE)
+
+
+def _is_in_memory(array: Any) -> bool:
+    """Check if an array is completely loaded in memory, i.e. not memory-mapped or lazy."""
+    return isinstance(array, (list, tuple)) or (
+        isinstance(array, np.ndarray) and not isinstance(array, np.memmap)
+    )
+
+
+def _map_numpy(
+    fn: Callable, x_shape: Tuple[int, ...], y_shape: Tuple[int, ...]
+) -> Callable[..., Tuple[tf.Tensor, tf.Tensor]]:
+    """Wrap a function returning batches of x and y as numpy arrays to be used in "map".
+
+    Args:
+        fn: Function called with the numpy values of all input tensors.
+        x_shape: Shape of one item of x returned by fn.
+        y_shape: Shape of one item of y returned by fn.
+    """
+
+    def float_fn(*args: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        batch_x, batch_y = fn(*args)
+        return batch_x.astype(np.float32), batch_y.astype(np.float32)
+
+    def map_fn(*args: tf.Tensor) -> Tuple[tf.Tensor, tf.Tensor]:
+        batch_x, batch_y = tf.numpy_function(
+            float_fn, list(args), (tf.float32, tf.float32)
+        )
+        batch_x.set_shape((None, *x_shape))
+        batch_y.set_shape((None, *y_shape))
+        return batch_x, batch_y
+
+    return map_fn
+
+
+def _format_tensors(image: tf.Tensor, mask: tf.Tensor) -> Tuple[tf.Tensor, tf.Tensor]:
+    """Add a channel dimension to images (and masks) if missing."""
+    if image.shape.ndims < 3:
+        image = image[..., None]
+    if mask.shape.ndims < 3:
+        mask = mask[..., None]
+    return image, mask
+
+
+def augment_tensors(
+    image: tf.Tensor,
+    mask: tf.Tensor,
+    flip_: bool = False,
+    illuminate_: bool = False,
+    gaussian_noise_: bool = False,
+    rotate_: bool = False,
+    translate_: bool = False,
+    cell_size: int = 4,
+) -> Tuple[tf.Tensor, tf.Tensor]:
+    """Tensor equivalent of "augment.augment_batch_baseline" for a single image.
+
+    Args:
+        image: Image to be augmented with shape (x, y).
+        mask: Corresponding prediction matrix with ground truth values with shape (r, c, 3).
+        flip_: If True, images might be flipped.
+        illuminate_: If True, images might be altered in illumination.
+        gaussian_noise_: If True, gaussian noise might be added.
+        rotate_: If True, images might be rotated.
+        translate_: If True, images might be translated.
+        cell_size: Size of one cell in the prediction matrix.
+    """
+    if flip_:
+        image, mask = flip(image, mask)
+    if illuminate_:
+        image, mask = illuminate(image, mask)
+    if gaussian_noise_:
+        image, mask = gaussian_noise(image, mask)
+    if rotate_:
+        image, mask = rotate(image, mask)
+    if translate_:
+        image, mask = translate(image, mask, cell_size=cell_size)
+    return image, mask
+
+
+def flip(image: tf.Tensor, mask: tf.Tensor) -> Tuple[tf.Tensor, tf.Tensor]:
+    """Augment through horizontal/vertical flipping."""
+    rand_flip = tf.random.uniform([], minval=0, maxval=2, dtype=tf.int32)
+    is_horizontal = tf.equal(rand_flip, 0)
+
+    image, mask = tf.cond(
+        is_horizontal,
+        lambda: (tf.reverse(image, [0]), tf.reverse(mask, [0])),
+        lambda: (tf.reverse(image, [1]), tf.reverse(mask, [1])),
+    )
+
+    # Mirror the coordinate along the flipped axis (1 for horizontal, 2 for vertical)
+    is_spot = mask[..., 0] != 0
+    axis = tf.one_hot(rand_flip + 1, 3, on_value=True, off_value=False)
+    mirror = tf.logical_and(is_spot[..., None], axis)
+    mask = tf.where(mirror, 1 - mask, mask)
+    return image, mask
+
+
+def illuminate(image: tf.Tensor, mask: tf.Tensor) -> Tuple[tf.Tensor, tf.Tensor]:
+    """Augment through changing illumination."""
+    rand_illumination = 1 + tf.random.uniform([], -0.75, 0.75)
+    return image * rand_illumination, mask
+
+
+def gaussian_noise(
+    image: tf.Tensor, mask: tf.Tensor, mean: int = 0
+) -> Tuple[tf.Tensor, tf.Tensor]:
+    """Augment through the addition of gaussian noise.
+
+    Args:
+        image: Image to be augmented.
+        mask: Corresponding prediction matrix with ground truth values.
+        mean: Average noise pixel values added. Zero means no net difference occurs.
+    """
+    sigma = tf.random.uniform([], 0.0001, 0.01)
+    noise = tf.random.normal(tf.shape(image), mean, sigma, dtype=image.dtype)
+    noisy = image + noise
+    noise = tf.where(noisy >= 1.0, tf.ones_like(noise), noise)
+    noise = tf.where(noisy < 0, tf.zeros_like(noise), noise)
+    return image + noise, mask
+
+
+def rotate(image: tf.Tensor, mask: tf.Tensor) -> Tuple[tf.Tensor, tf.Tensor]:
+    """Augment through rotation."""
+    rand_rotate = tf.random.uniform([], minval=0, maxval=4, dtype=tf.int32)
+    image = tf.image.rot90(image[..., None], rand_rotate)[..., 0]
+    mask = tf.image.rot90(mask, rand_rotate)
+
+    # Rotate coordinates within the cell by applying (r, c) -> (1 - c, r) k times
+    prob, r_coord, c_coord = tf.unstack(mask, axis=-1)
+    for idx in range(3):
+        is_rotated = tf.less(idx, rand_rotate)
+        r_coord, c_coord = (
+            tf.where(is_rotated, 1 - c_coord, r_coord),
+            tf.where(is_rotated, r_coord, c_coord),
+        )
+    is_spot = tf.logical_or(prob != 0, tf.equal(rand_rotate, 0))
+    r_coord = tf.where(is_spot, r_coord, tf.zeros_like(r_coord))
+    c_coord = tf.where(is_spot, c_coord, tf.zeros_like(c_coord))
+    return image, tf.stack([prob, r_coord, c_coord], axis=-1)
+
+
+def translate(
+    image: tf.Tensor, mask: tf.Tensor, cell_size: int = 4
+) -> Tuple[tf.Tensor, tf.Tensor]:
+    """Augment through translation along all axes.
+
+    Args:
+        image: Image to be augmented.
+        mask: Corresponding prediction matrix with ground truth values.
+        cell_size: Size of one cell in the prediction matrix.
+    """
+    direction = tf.random.uniform([], minval=0, maxval=2, dtype=tf.int32)
+    shift_mask = tf.random.uniform(
+        [], minval=0, maxval=tf.shape(image)[0] // cell_size, dtype=tf.int32
+    )
+    shift_image = shift_mask * cell_size
+
+    image = tf.roll(image, shift_image, direction)
+    mask = tf.roll(mask, shift_mask, direction)
+    return image, mask
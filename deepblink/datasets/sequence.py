@@ -6,12 +6,13 @@ import warnings
 import numpy as np
 import tensorflow as tf
 
-from ..util import relative_shuffle
-
 
 class SequenceDataset(tf.keras.utils.Sequence):
     """Custom Sequence class used to feed data into model.fit.
 
+    Data is shuffled through a permutation of indices instead of copying x and y
+    such that lazily loaded or memory-mapped inputs are never read as a whole.
+
     Args:
         x_list: List of inputs.
         y_list: List of targets.
@@ -36,6 +37,7 @@ class SequenceDataset(tf.keras.utils.Sequence):
         self.augment_fn = augment_fn
         self.format_fn = format_fn
         self.overfit = overfit
+        self.indices = np.arange(len(x))
 
     def __len__(self) -> int:
         """Return length of the dataset in unit of batch size."""
@@ -55,8 +57,9 @@ class SequenceDataset(tf.keras.utils.Sequence):
         begin = idx * self.batch_size
         end = (idx + 1) * self.batch_size
 
-        batch_x = self.x[begin:end]
-        batch_y = self.y[begin:end]
+        batch_indices = self.indices[begin:end]
+        batch_x = self.x[batch_indices]
+        batch_y = self.y[batch_indices]
 
         if self.format_fn:
             batch_x, batch_y = self.format_fn(batch_x, batch_y)
@@ -74,4 +77,4 @@ class SequenceDataset(tf.keras.utils.Sequence):
     def on_epoch_end(self) -> None:
         """Shuffle data after every epoch."""
         if not self.overfit:
-            self.x, self.y = relative_shuffle(self.x, self.y)
+            np.random.shuffle(self.indices)
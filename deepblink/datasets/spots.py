@@ -1,13 +1,23 @@
 """SpotsDataset class."""
 
+from typing import Optional
+import os
+import shutil
+import tempfile
+
 import numpy as np
 
-from ..data import get_prediction_matrix
+from ..data import get_prediction_matrices
 from ..data import next_power
 from ..data import normalize_image
+from ..io import file_hash
 from ..io import load_npz
 from ._datasets import Dataset
 
+# Increase whenever the prepared tensors change to invalidate existing caches
+CACHE_VERSION = 1
+CACHE_FILES = ("x_train", "y_train", "x_valid", "y_valid")
+
 
 class SpotsDataset(Dataset):
     """Class used to load all spots data.
@@ -15,21 +25,64 @@ class SpotsDataset(Dataset):
     Args:
         cell_size: Number of pixels (from original image) constituting
             one cell in the prediction matrix.
+        cache_dir: If passed, directory in which the prepared (converted and normalized)
+            tensors are cached. Cached tensors are memory-mapped on subsequent loads.
     """
 
-    def __init__(self, name: str, cell_size: int):
+    def __init__(self, name: str, cell_size: int, cache_dir: Optional[str] = None):
         super().__init__(name)
         self.cell_size = cell_size
+        self.cache_dir = os.path.expanduser(cache_dir) if cache_dir else None
         self.load_data()
 
+    @property
+    def cache_path(self) -> str:
+        """Return the cache directory unique to the dataset content and cell size."""
+        key = f"{file_hash(self.data_filename)}_c{self.cell_size}_v{CACHE_VERSION}"
+        return os.path.join(self.cache_dir, key)  # type: ignore[arg-type]
+
     def load_data(self) -> None:
-        """Load dataset into memory."""
+        """Load dataset into memory or memory-map it from the cache if available."""
+        cache_path = self.cache_path if self.cache_dir is not None else None
+        if cache_path is not None and os.path.isdir(cache_path):
+            self.load_cache(cache_path)
+            return
+
         self.x_train, self.y_train, self.x_valid, self.y_valid, _, _ = load_npz(
             self.data_filename
         )
         self.prepare_data()
         self.normalize_dataset()
 
+        if cache_path is not None:
+            self.save_cache(cache_path)
+
+    def load_cache(self, cache_path: str) -> None:
+        """Memory-map prepared float32 tensors from a cache directory."""
+        for attr in CACHE_FILES:
+            fname = os.path.join(cache_path, f"{attr}.npy")
+            setattr(self, attr, np.load(fname, mmap_mode="r"))
+
+    def save_cache(self, cache_path: str) -> None:
+        """Save prepared float32 tensors to a cache directory.
+
+        Files are written into a temporary directory which is then renamed
+        to avoid partial caches when interrupted or run concurrently.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)  # type: ignore[arg-type]
+        tmp_path = tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp_")
+        try:
+            for attr in CACHE_FILES:
+                fname = os.path.join(tmp_path, f"{attr}.npy")
+                np.save(fname, np.asarray(getattr(self, attr), dtype=np.float32))
+            os.rename(tmp_path, cache_path)
+        except OSError:
+            # Another process might have created the cache in the meantime
+            if not os.path.isdir(cache_path):
+                raise
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
     @property
     def image_size(self):
         """Check if all images have the same square shape."""
@@ -58,12 +111,7 @@ class SpotsDataset(Dataset):
         """
 
         def __convert(dataset, image_size, cell_size):
-            return np.array(
-                [
-                    get_prediction_matrix(coords, image_size, cell_size)
-                    for coords in dataset
-                ]
-            )
+            return get_prediction_matrices(dataset, image_size, cell_size)
 
         # def __convert(dataset, image_size, cell_size):
         #     labels = []
@@ -1,30 +1,44 @@
 """Dataset preparation functions."""
 
-from typing import Any, List, Tuple
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+import functools
 import glob
+import hashlib
+import json
 import os
 import re
+import struct
+import sys
+import zipfile
 
 import numpy as np
-import skimage.color
-import skimage.io
-import tensorflow as tf
+import tifffile
 
-from .losses import combined_bce_rmse
-from .losses import combined_dice_rmse
-from .losses import combined_f1_rmse
-from .losses import f1_score
-from .losses import rmse
+if TYPE_CHECKING:  # pragma: no cover
+    import tensorflow as tf
 
 # List of currently supported image file extensions.
 EXTENSIONS = ("tif", "jpeg", "jpg", "png")
 
+# Index file and splits of chunked datasets.
+CHUNKED_INDEX = "index.json"
+CHUNKED_SPLITS = ("train", "valid", "test")
+
 
 def basename(path: str) -> str:
     """Returns the basename removing path and extension."""
     return os.path.splitext(os.path.basename(path))[0]
 
 
+def file_hash(fname: str) -> str:
+    """Return the sha256 hex digest of a file's content."""
+    sha256 = hashlib.sha256()
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(2 ** 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
 def securename(fname: str) -> str:
     """Turns potentially unsafe names into a single, safe, alphanumeric string."""
     return re.sub(r"[^\w\d-]", "_", fname)
@@ -56,6 +70,171 @@ def load_npz(fname: str, test_only: bool = False) -> List[Any]:
         return [data[f] for f in expected]
 
 
+class ChunkedDatasetWriter:
+    """Writer for the chunked dataset format used for datasets larger than memory.
+
+    A chunked dataset is a directory containing an "index.json" file and one or more
+    npz shards per split. Each shard contains the raw "images" with shape (n, x, y),
+    all "coords" concatenated with shape (m, 2), and "offsets" with shape (n + 1,)
+    such that the coordinates of image i are coords[offsets[i]:offsets[i + 1]].
+    Uncompressed shards are memory-mapped when read with "load_shard".
+
+    Args:
+        path: Directory to which the dataset is written. Created if not existing.
+        shard_size: Maximum number of images per shard.
+        compression: Zip deflate level from 0 (uncompressed, fastest) to 9.
+    """
+
+    def __init__(self, path: str, shard_size: int = 256, compression: int = 0):
+        if shard_size < 1:
+            raise ValueError(f"shard_size must be positive. {shard_size} is not.")
+        if not 0 <= compression <= 9:
+            raise ValueError(f"compression must be in [0, 9]. {compression} is not.")
+
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.shard_size = shard_size
+        self.compression = compression
+        self.index: Dict[str, Any] = {
+            "compression": compression,
+            "splits": {
+                split: {"shape": None, "shards": []} for split in CHUNKED_SPLITS
+            },
+        }
+        self._buffers: Dict[str, Tuple[list, list]] = {
+            split: ([], []) for split in CHUNKED_SPLITS
+        }
+
+    def __enter__(self):
+        """Return the writer to be used as context manager."""
+        return self
+
+    def __exit__(self, *_):
+        """Write all remaining images and the index on exit."""
+        self.close()
+
+    def add(self, split: str, image: np.ndarray, coords: np.ndarray) -> None:
+        """Add one image and its coordinates to a split, writing full shards to disk.
+
+        Args:
+            split: One of "train", "valid", or "test".
+            image: Raw image with shape (x, y).
+            coords: Coordinates in r, c format with shape (n, 2).
+        """
+        if split not in CHUNKED_SPLITS:
+            raise ValueError(f"split must be one of {CHUNKED_SPLITS}. {split} is not.")
+
+        info = self.index["splits"][split]
+        if info["shape"] is None:
+            info["shape"] = list(image.shape)
+        if list(image.shape) != info["shape"]:
+            raise ValueError(
+                f"All images must have the same shape. {image.shape} is not {info['shape']}."
+            )
+
+        images, coords_list = self._buffers[split]
+        images.append(image)
+        coords_list.append(np.asarray(coords, dtype=np.float64).reshape(-1, 2))
+        if len(images) >= self.shard_size:
+            self.flush(split)
+
+    def flush(self, split: str) -> None:
+        """Write all buffered images of a split into a new shard."""
+        images, coords_list = self._buffers[split]
+        if not images:
+            return
+
+        shards = self.index["splits"][split]["shards"]
+        fname = f"{split}_{len(shards):05d}.npz"
+        offsets = np.cumsum([0] + [len(coords) for coords in coords_list])
+        save_shard(
+            os.path.join(self.path, fname),
+            {
+                "images": np.stack(images),
+                "coords": np.concatenate(coords_list),
+                "offsets": offsets.astype(np.int64),
+            },
+            compression=self.compression,
+        )
+        shards.append({"file": fname, "length": len(images)})
+        self._buffers[split] = ([], [])
+
+    def close(self) -> None:
+        """Write all remaining shards and the index file."""
+        for split in CHUNKED_SPLITS:
+            self.flush(split)
+
+        tmp_fname = os.path.join(self.path, f".{CHUNKED_INDEX}.tmp")
+        with open(tmp_fname, "w") as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(tmp_fname, os.path.join(self.path, CHUNKED_INDEX))
+
+
+def save_shard(fname: str, arrays: Dict[str, np.ndarray], compression: int = 0) -> None:
+    """Save arrays into a npz file with the given deflate level (0 is uncompressed).
+
+    Equivalent to "np.savez" / "np.savez_compressed" but with a configurable
+    compression level. The file is written to a temporary file first and
+    renamed once complete.
+    """
+    kwargs: Dict[str, Any] = {"compression": zipfile.ZIP_STORED}
+    if compression:
+        kwargs["compression"] = zipfile.ZIP_DEFLATED
+        if sys.version_info >= (3, 7):
+            kwargs["compresslevel"] = compression
+
+    tmp_fname = f"{fname}.tmp"
+    with zipfile.ZipFile(tmp_fname, mode="w", allowZip64=True, **kwargs) as zipf:
+        for key, value in arrays.items():
+            with zipf.open(f"{key}.npy", "w", force_zip64=True) as f:
+                np.lib.format.write_array(f, np.asanyarray(value), allow_pickle=True)
+    os.replace(tmp_fname, fname)
+
+
+def load_shard(fname: str) -> Dict[str, np.ndarray]:
+    """Load all arrays of a npz shard, memory-mapping uncompressed arrays."""
+    arrays = {}
+    with zipfile.ZipFile(fname) as zipf, open(fname, "rb") as f:
+        for info in zipf.infolist():
+            key = info.filename[: -len(".npy")]
+            if info.compress_type != zipfile.ZIP_STORED:
+                with zipf.open(info) as member:
+                    arrays[key] = np.lib.format.read_array(member, allow_pickle=False)
+                continue
+
+            # Skip the local file header to the start of the npy data
+            f.seek(info.header_offset)
+            header = f.read(30)
+            name_length, extra_length = struct.unpack("<HH", header[26:30])
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if not np.prod(shape):
+                arrays[key] = np.empty(shape, dtype=dtype)
+                continue
+            arrays[key] = np.memmap(
+                fname,
+                dtype=dtype,
+                mode="r",
+                offset=f.tell(),
+                shape=shape,
+                order="F" if fortran_order else "C",
+            )
+    return arrays
+
+
+def load_chunked_index(path: str) -> Dict[str, Any]:
+    """Load the index of a chunked dataset created with "ChunkedDatasetWriter"."""
+    fname = os.path.join(path, CHUNKED_INDEX)
+    if not os.path.isfile(fname):
+        raise ValueError(f"{path} is not a chunked dataset. {fname} is missing.")
+    with open(fname, "r") as f:
+        return json.load(f)
+
+
 def load_image(
     fname: str, extensions: Tuple[str, ...] = EXTENSIONS, is_rgb: bool = False
 ) -> np.ndarray:
@@ -66,6 +245,9 @@ def load_image(
         extensions: Allowed image extensions.
         is_rgb: If true, converts RGB images to grayscale.
     """
+    import skimage.color  # pylint: disable=import-outside-toplevel
+    import skimage.io  # pylint: disable=import-outside-toplevel
+
     if not os.path.isfile(fname):
         raise ImportError("Input file does not exist. Please provide a valid path.")
     if not fname.lower().endswith(extensions):
@@ -79,8 +261,192 @@ def load_image(
     return image
 
 
-def load_model(fname: str) -> tf.keras.models.Model:
+def load_shape(fname: str, extensions: Tuple[str, ...] = EXTENSIONS) -> Tuple[int, ...]:
+    """Return the squeezed shape "load_image" would return reading only the file header.
+
+    TIFF shapes are read from the first series and all other formats with pillow.
+    TIFF files with samples per pixel and palette images, which are reordered or
+    converted on load, as well as unreadable headers are loaded fully.
+
+    Args:
+        fname: Absolute or relative filepath of image.
+        extensions: Allowed image extensions.
+    """
+    import PIL.Image  # pylint: disable=import-outside-toplevel
+
+    if not os.path.isfile(fname):
+        raise ImportError("Input file does not exist. Please provide a valid path.")
+    if not fname.lower().endswith(extensions):
+        raise ImportError(f"Input file extension invalid. Please use {extensions}.")
+
+    try:
+        if fname.lower().endswith(("tif", "tiff")):
+            with tifffile.TiffFile(fname) as tif:
+                if "S" in tif.series[0].axes:
+                    raise ValueError("Samples per pixel are reordered on load.")
+                shape = tif.series[0].shape
+        else:
+            with PIL.Image.open(fname) as image:
+                if image.mode in ("P", "PA"):
+                    raise ValueError("Palette images are converted on load.")
+                width, height = image.size
+                shape = (height, width, len(image.getbands()))
+        return tuple(s for s in shape if s != 1)
+    except (tifffile.TiffFileError, IndexError, ValueError, OSError):
+        return load_image(fname, extensions=extensions).shape
+
+
+@functools.lru_cache(maxsize=2)
+def _load_image_cached(
+    fname: str, extensions: Tuple[str, ...], is_rgb: bool, mtime: int
+) -> np.ndarray:
+    """Read-only "load_image" of the most recent files as long as they are unchanged."""
+    del mtime  # Only part of the cache key
+    image = load_image(fname, extensions=extensions, is_rgb=is_rgb)
+    image.flags.writeable = False
+    return image
+
+
+class LazyImage:
+    """Image file handle only reading the requested parts of an image from disk.
+
+    Uncompressed TIFF files are memory-mapped and compressed TIFF files are decoded
+    page by page. All other formats, RGB images, and TIFF files with samples per pixel
+    (which would be reordered) can't be paged. They are loaded fully using "load_image"
+    and the two most recent ones are cached read-only per process, such that handles
+    reading successive parts of the same file only load it once.
+    Indexing returns float32 arrays, casting only the requested data. The handle
+    is picklable and only stores the filename for TIFF files.
+
+    Args:
+        fname: Absolute or relative filepath of image.
+        extensions: Allowed image extensions.
+        is_rgb: If true, converts RGB images to grayscale.
+
+    Attributes:
+        shape: Squeezed image shape as returned by "load_image".
+        ndim: Number of image dimensions.
+    """
+
+    def __init__(
+        self, fname: str, extensions: Tuple[str, ...] = EXTENSIONS, is_rgb: bool = False
+    ):
+        if not os.path.isfile(fname):
+            raise ImportError("Input file does not exist. Please provide a valid path.")
+        if not fname.lower().endswith(extensions):
+            raise ImportError(f"Input file extension invalid. Please use {extensions}.")
+
+        self.fname = fname
+        self._array: Optional[np.ndarray] = None
+        self._handle: Any = None
+        self._is_mapped = False
+        self._n_page_dims = 0
+
+        if fname.lower().endswith(("tif", "tiff")) and not is_rgb:
+            try:
+                with tifffile.TiffFile(fname) as tif:
+                    series = tif.series[0]
+                    if "S" in series.axes:
+                        raise ValueError("Samples per pixel are not supported.")
+                    self.shape = tuple(s for s in series.shape if s != 1)
+                    self._is_mapped = series.dataoffset is not None
+                    page_shape = tuple(s for s in series.keyframe.shape if s != 1)
+                    self._n_page_dims = len(page_shape)
+                return
+            except (tifffile.TiffFileError, IndexError, ValueError):
+                pass
+        self._array = _load_image_cached(
+            fname, extensions, is_rgb, os.stat(fname).st_mtime_ns
+        )
+        self.shape = self._array.shape
+
+    @property
+    def ndim(self) -> int:
+        """Number of image dimensions."""
+        return len(self.shape)
+
+    def __getstate__(self):
+        """Return the state to pickle without open file handles."""
+        state = self.__dict__.copy()
+        state["_handle"] = None
+        return state
+
+    def _open(self):
+        """Open the underlying memory-map or TIFF file on first access."""
+        if self._handle is None:
+            if self._is_mapped:
+                self._handle = tifffile.memmap(self.fname, mode="r").reshape(self.shape)
+            else:
+                self._handle = tifffile.TiffFile(self.fname)
+        return self._handle
+
+    def close(self):
+        """Close open file handles. Indexing afterwards reopens the file."""
+        if isinstance(self._handle, tifffile.TiffFile):
+            self._handle.close()
+        self._handle = None
+
+    def __getitem__(self, key) -> np.ndarray:
+        """Read the indexed part of the image as float32 array."""
+        if self._array is not None:
+            return self._array[key]
+
+        handle = self._open()
+        if self._is_mapped:
+            return np.asarray(handle[key], dtype=np.float32)
+
+        # Decode only the pages required by the integers and slices of the page axes
+        key = key if isinstance(key, tuple) else (key,)
+        if any(k is Ellipsis for k in key):
+            idx = next(i for i, k in enumerate(key) if k is Ellipsis)
+            fill = (slice(None),) * (self.ndim - len(key) + 1)
+            key = key[:idx] + fill + key[idx + 1 :]
+        key = key + (slice(None),) * (self.ndim - len(key))
+        n_lead = self.ndim - self._n_page_dims
+        lead, rest = key[:n_lead], key[n_lead:]
+        if not all(isinstance(k, (int, np.integer, slice)) for k in lead):
+            return self.asarray()[key]
+
+        # Integers drop their axis, slices keep it
+        lead_idx = [np.arange(size)[k] for k, size in zip(lead, self.shape[:n_lead])]
+        page_shape = self.shape[n_lead:]
+        shape = [np.size(i) for i in lead_idx if np.ndim(i)] + list(page_shape)
+        pages = (
+            np.ravel_multi_index(
+                np.meshgrid(*lead_idx, indexing="ij"), self.shape[:n_lead]
+            )
+            if n_lead
+            else np.zeros(1, dtype=int)
+        )
+        if pages.size:
+            data = handle.asarray(key=pages.ravel().tolist(), series=0).reshape(shape)
+        else:
+            data = np.empty(shape)
+        return data[(slice(None),) * (len(shape) - len(page_shape)) + rest].astype(
+            np.float32
+        )
+
+    def asarray(self) -> np.ndarray:
+        """Read the full image as float32 array."""
+        if self._array is not None:
+            return self._array
+        handle = self._open()
+        if self._is_mapped:
+            return np.asarray(handle, dtype=np.float32)
+        return handle.asarray(series=0).reshape(self.shape).astype(np.float32)
+
+
+def load_model(fname: str) -> "tf.keras.models.Model":
     """Import a deepBlink model from file."""
+    # Tensorflow is only imported on demand as it slows down the CLI startup
+    import tensorflow as tf  # pylint: disable=import-outside-toplevel
+
+    from .losses import combined_bce_rmse  # pylint: disable=import-outside-toplevel
+    from .losses import combined_dice_rmse  # pylint: disable=import-outside-toplevel
+    from .losses import combined_f1_rmse  # pylint: disable=import-outside-toplevel
+    from .losses import f1_score  # pylint: disable=import-outside-toplevel
+    from .losses import rmse  # pylint: disable=import-outside-toplevel
+
     if not os.path.isfile(fname):
         raise ValueError(f"File must exist - '{fname}' does not.")
     if os.path.splitext(fname)[-1] != ".h5":
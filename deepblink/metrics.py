@@ -1,11 +1,18 @@
 """Functions to calculate training loss on single image."""
 
-from typing import List, Optional, Tuple, Union
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+import concurrent.futures
+import itertools
+import os
 import warnings
 
 import numpy as np
 import pandas as pd
 import scipy.optimize
+import scipy.spatial
+import scipy.spatial.distance
+
+from .util import ColumnBuffer
 
 EPS = 1e-12
 
@@ -177,22 +184,207 @@ def f1_integral(
         )
         return 0.0 if not return_raw else (np.zeros(50), np.zeros(50), cutoffs)
 
-    matrix = scipy.spatial.distance.cdist(pred, true, metric="euclidean")
+    assignments = _assignments_at_cutoffs(pred, true, cutoffs)
+    f1_scores = [
+        _f1_from_counts(len(rows), len(pred) - n_pred, len(true) - len(rows))
+        for rows, _, n_pred in assignments
+    ]
 
     if not return_raw:
-        f1_scores = [_f1_at_cutoff(matrix, pred, true, cutoff) for cutoff in cutoffs]
         return np.trapz(f1_scores, cutoffs) / mdist  # Norm. to 0-1
 
-    f1_scores = []
-    offsets = []
+    offsets = [_get_offsets(pred, true, rows, cols) for rows, cols, _ in assignments]
+    return (f1_scores, offsets, list(cutoffs))
+
+
+def _assignments_at_cutoffs(
+    pred: np.ndarray, true: np.ndarray, cutoffs: np.ndarray
+) -> List[Tuple[np.ndarray, np.ndarray, int]]:
+    """Find the true<-pred assignments for multiple ascending cutoffs in a single pass.
+
+    Gives the same result as "linear_sum_assignment(matrix.T, cutoff)" and
+    "linear_sum_assignment(matrix, cutoff)" on the full cost matrix for every
+    cutoff (see "_f1_at_cutoff") without creating it for cutoffs above zero. Pairs of
+    coordinates closer than the largest cutoff are found with a KD-tree.
+    Pairs closer than the current cutoff form a sparse graph and the assignment
+    is solved on every connected component independently. As all costs above
+    the cutoff are set to the global maximum distance, a component's solution
+    is independent of the rest of the graph and is reused across cutoffs
+    until new pairs are added to it.
+
+    Args:
+        pred: Array of shape (n, 2) for predicted coordinates.
+        true: Array of shape (n, 2) for ground truth coordinates.
+        cutoffs: Ascending cutoff values.
+
+    A cutoff of zero is not used to clip the matrix in "linear_sum_assignment".
+    Only the exact matches which are part of the unclipped optimal assignment are
+    kept, the full matrix is therefore only created if exact matches exist.
+
+    Returns:
+        A list with one (true_pred_r, true_pred_c, n_pred_true) tuple per cutoff,
+        sorted by true_pred_r. n_pred_true is the number of assignments of the
+        pred<-true assignment which determines the false positives. See
+        "_f1_at_cutoff" for details.
+    """
+    pred = np.asarray(pred, dtype=np.float64)
+    true = np.asarray(true, dtype=np.float64)
+    n_pred = len(pred)
+    max_dist = _max_distance(pred, true)
+    edge_pred, edge_true, edge_dist = _candidate_pairs(pred, true, max(cutoffs))
+
+    # Union-find over pred (0..n_pred-1) and true (n_pred..) nodes
+    parent = list(range(n_pred + len(true)))
+
+    def find(node: int) -> int:
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    component_edges: Dict[int, List[int]] = {}
+    solutions: Dict[int, Tuple[np.ndarray, np.ndarray, int]] = {}
+    n_added = 0
+    assignments = []
     for cutoff in cutoffs:
-        f1_value, rows, cols = _f1_at_cutoff(
-            matrix, pred, true, cutoff, return_raw=True
-        )
-        f1_scores.append(f1_value)
-        offsets.append(_get_offsets(pred, true, rows, cols))
+        # Costs are not clipped if all distances are below the cutoff or it is zero
+        if max_dist <= cutoff or (cutoff == 0 and edge_dist.size and edge_dist[0] == 0):
+            assignments.append(_dense_assignment(pred, true, cutoff))
+            continue
+        if cutoff == 0:
+            assignments.append((np.array([], dtype=int), np.array([], dtype=int), 0))
+            continue
+
+        # Costs equal to or above the cutoff are clipped to the maximum distance
+        n_edges = np.searchsorted(edge_dist, cutoff, side="left")
+        changed = set()
+        for edge in range(n_added, n_edges):
+            root_pred = find(edge_pred[edge])
+            root_true = find(n_pred + edge_true[edge])
+            if root_pred != root_true:
+                # Merge the smaller into the larger component
+                if len(component_edges.get(root_pred, [])) < len(
+                    component_edges.get(root_true, [])
+                ):
+                    root_pred, root_true = root_true, root_pred
+                parent[root_true] = root_pred
+                component_edges.setdefault(root_pred, []).extend(
+                    component_edges.pop(root_true, [])
+                )
+                solutions.pop(root_true, None)
+            component_edges.setdefault(root_pred, []).append(edge)
+            changed.add(root_pred)
+        n_added = n_edges
+
+        for root in {find(root) for root in changed}:
+            solutions[root] = _component_assignment(
+                edge_pred, edge_true, edge_dist, component_edges[root], max_dist
+            )
+
+        assignments.append(_merge_solutions(list(solutions.values())))
+
+    return assignments
+
+
+def _candidate_pairs(
+    pred: np.ndarray, true: np.ndarray, max_cutoff: float
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Return pred indices, true indices, and distances of all pairs within max_cutoff.
+
+    The cutoff is slightly enlarged to not miss pairs due to rounding. Distances are
+    computed exactly as in cdist and pairs are sorted by ascending distance.
+    """
+    pairs = scipy.spatial.cKDTree(pred).sparse_distance_matrix(
+        scipy.spatial.cKDTree(true), max_cutoff * (1 + 1e-9), output_type="ndarray"
+    )
+    edge_pred = pairs["i"].astype(int)
+    edge_true = pairs["j"].astype(int)
+    edge_dist = np.sqrt(np.sum(np.square(pred[edge_pred] - true[edge_true]), axis=1))
+    order = np.argsort(edge_dist, kind="stable")
+    return edge_pred[order], edge_true[order], edge_dist[order]
+
+
+def _component_assignment(
+    edge_pred: np.ndarray,
+    edge_true: np.ndarray,
+    edge_dist: np.ndarray,
+    edges: List[int],
+    max_dist: float,
+) -> Tuple[np.ndarray, np.ndarray, int]:
+    """Return the true<-pred assignment and n_pred_true of one connected component."""
+    rows, cols = _solve_component(
+        edge_true[edges], edge_pred[edges], edge_dist[edges], max_dist
+    )
+    pred_rows, _ = _solve_component(
+        edge_pred[edges], edge_true[edges], edge_dist[edges], max_dist
+    )
+    return rows, cols, len(pred_rows)
 
-    return (f1_scores, offsets, list(cutoffs))
+
+def _dense_assignment(
+    pred: np.ndarray, true: np.ndarray, cutoff: float
+) -> Tuple[np.ndarray, np.ndarray, int]:
+    """Return the assignment of a cutoff on the full cost matrix (see "_f1_at_cutoff")."""
+    matrix = scipy.spatial.distance.cdist(pred, true, metric="euclidean")
+    rows, cols = linear_sum_assignment(matrix.T, cutoff)
+    n_pred_true = len(linear_sum_assignment(matrix, cutoff)[0])
+    return np.array(rows, dtype=int), np.array(cols, dtype=int), n_pred_true
+
+
+def _merge_solutions(
+    solutions: List[Tuple[np.ndarray, np.ndarray, int]]
+) -> Tuple[np.ndarray, np.ndarray, int]:
+    """Combine the assignments of all components into one sorted by true indices."""
+    if not solutions:
+        return np.array([], dtype=int), np.array([], dtype=int), 0
+    rows = np.concatenate([rows for rows, _, _ in solutions])
+    cols = np.concatenate([cols for _, cols, _ in solutions])
+    order = np.argsort(rows)
+    return rows[order], cols[order], sum(n for _, _, n in solutions)
+
+
+def _solve_component(
+    rows: np.ndarray, cols: np.ndarray, costs: np.ndarray, max_cost: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Solve the assignment of a single connected component of the candidate graph.
+
+    Args:
+        rows: Row (true) indices of all candidate pairs.
+        cols: Column (pred) indices of all candidate pairs.
+        costs: Cost (distance) of all candidate pairs.
+        max_cost: Cost of all non-candidate pairs.
+
+    Returns:
+        (rows, columns) of all assigned candidate pairs.
+    """
+    unique_rows, local_rows = np.unique(rows, return_inverse=True)
+    unique_cols, local_cols = np.unique(cols, return_inverse=True)
+
+    matrix = np.full((len(unique_rows), len(unique_cols)), max_cost)
+    matrix[local_rows, local_cols] = costs
+    is_candidate = np.zeros(matrix.shape, dtype=bool)
+    is_candidate[local_rows, local_cols] = True
+
+    row, col = scipy.optimize.linear_sum_assignment(matrix)
+    keep = is_candidate[row, col]
+    return unique_rows[row[keep]], unique_cols[col[keep]]
+
+
+def _max_distance(pred: np.ndarray, true: np.ndarray) -> float:
+    """Return the largest euclidean distance between any pred and true coordinate.
+
+    The furthest points always lie on the convex hulls which avoids comparing all pairs.
+    """
+
+    def hull_vertices(points: np.ndarray) -> np.ndarray:
+        try:
+            return points[scipy.spatial.ConvexHull(points).vertices]
+        except (RuntimeError, ValueError):  # Too few or collinear points
+            return points
+
+    return scipy.spatial.distance.cdist(
+        hull_vertices(pred), hull_vertices(true), metric="euclidean"
+    ).max()
 
 
 def _get_offsets(
@@ -206,9 +398,10 @@ def _get_offsets(
         rows: Rows of the assigned coordinates (along "true"-axis).
         cols: Columns of the assigned coordinates (along "pred"-axis).
     """
-    return [
-        (true[r][0] - pred[c][0], true[r][1] - pred[c][1]) for r, c in zip(rows, cols)
-    ]
+    rows = np.asarray(rows, dtype=int)
+    cols = np.asarray(cols, dtype=int)
+    offsets = np.asarray(true)[rows, :2] - np.asarray(pred)[cols, :2]
+    return list(map(tuple, offsets.tolist()))
 
 
 # TODO - find suitable return type Union[float, tuple] does not work
@@ -251,10 +444,7 @@ def _f1_at_cutoff(
     tp = len(true_pred_r)
     fn = len(true) - len(true_pred_r)
     fp = len(pred) - len(pred_true_r)
-
-    recall = tp / (tp + fn + EPS)
-    precision = tp / (tp + fp + EPS)
-    f1_value = (2 * precision * recall) / (precision + recall + EPS)
+    f1_value = _f1_from_counts(tp, fp, fn)
 
     if return_raw:
         return f1_value, true_pred_r, true_pred_c
@@ -262,6 +452,13 @@ def _f1_at_cutoff(
     return f1_value
 
 
+def _f1_from_counts(tp: int, fp: int, fn: int) -> float:
+    """Compute the F1 score from the number of true/false positives and false negatives."""
+    recall = tp / (tp + fn + EPS)
+    precision = tp / (tp + fp + EPS)
+    return (2 * precision * recall) / (precision + recall + EPS)
+
+
 def compute_metrics(
     pred: np.ndarray, true: np.ndarray, mdist: float = 3.0
 ) -> pd.DataFrame:
@@ -310,3 +507,222 @@ def compute_metrics(
     df["mean_euclidean"] = total_euclidean / (total_assignments + 1e-10)
 
     return df
+
+
+def evaluate_dataset(
+    preds: Iterable[np.ndarray],
+    trues: Iterable[np.ndarray],
+    mdist: float = 3.0,
+    n_jobs: Optional[int] = 1,
+    chunksize: int = 64,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Calculate metric scores across cutoffs for all images of a dataset.
+
+    Images are evaluated in chunks which are distributed across a pool of processes.
+
+    Args:
+        preds: Predicted sets of coordinates, one per image.
+        trues: Ground truth sets of coordinates, one per image.
+        mdist: Maximum euclidean distance in px to which F1 scores will be calculated.
+        n_jobs: Number of processes. If None or -1, all available cores are used.
+            If 1, evaluation runs in the calling process.
+        chunksize: Number of images evaluated per process at once.
+
+    Returns:
+        A tuple containing:
+        * df: One row per image and cutoff with all columns from "compute_metrics"
+            and the image index in the column "image".
+        * summary: Aggregate scores as returned by "summarize_metrics".
+    """
+    if n_jobs is None or n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+    if n_jobs < 1 or chunksize < 1:
+        raise ValueError(
+            f"n_jobs and chunksize must be positive. Found {n_jobs}, {chunksize}."
+        )
+
+    pairs = zip(preds, trues)
+    chunks = iter(lambda: list(itertools.islice(pairs, chunksize)), [])
+    args = ((idx * chunksize, chunk, mdist) for idx, chunk in enumerate(chunks))
+
+    if n_jobs == 1:
+        dfs = [_evaluate_chunk(*arg) for arg in args]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(n_jobs) as executor:
+            futures = [executor.submit(_evaluate_chunk, *arg) for arg in args]
+            dfs = [future.result() for future in futures]
+
+    if not dfs:
+        raise ValueError("preds and trues must contain at least one image.")
+    df = pd.concat(dfs, ignore_index=True)
+    return df, summarize_metrics(df, mdist)
+
+
+def _evaluate_chunk(
+    start: int, pairs: List[Tuple[np.ndarray, np.ndarray]], mdist: float
+) -> pd.DataFrame:
+    """Calculate metric scores of a chunk of images starting at image index start."""
+    buffer = ColumnBuffer()
+    for idx, (pred, true) in enumerate(pairs, start=start):
+        df = compute_metrics(pred=pred, true=true, mdist=mdist)
+        df["image"] = idx  # for downstream groupby's
+        buffer.append(df)
+    return buffer.to_frame()
+
+
+def summarize_metrics(df: pd.DataFrame, mdist: float = 3.0) -> pd.DataFrame:
+    """Summarize per image metrics across a dataset.
+
+    Args:
+        df: Metrics of multiple images as returned by "evaluate_dataset".
+        mdist: Cutoff at which the F1 score is summarized.
+
+    Returns:
+        DataFrame with the columns "mean" and "std" and one row for each of
+        "f1_score" (at the cutoff mdist), "f1_integral", and "mean_euclidean".
+    """
+    scores = {
+        "f1_score": df[df["cutoff"] == mdist]["f1_score"],
+        "f1_integral": df["f1_integral"],
+        "mean_euclidean": df["mean_euclidean"],
+    }
+    return pd.DataFrame(
+        {
+            "mean": {name: score.mean() for name, score in scores.items()},
+            "std": {name: score.std() for name, score in scores.items()},
+        }
+    )
+
+
+class MetricsAccumulator:
+    """Accumulate metrics of a dataset one image at a time with constant memory.
+
+    Keeps running true positive, false positive, and false negative counts,
+    as well as summed euclidean distances for every cutoff. Offsets of all
+    assignments at the largest cutoff are collected in a 2D histogram.
+    The per image F1 score at mdist, F1 integral, and mean euclidean distance
+    are summarized with running means / standard deviations.
+
+    Args:
+        mdist: Maximum euclidean distance in px to which F1 scores will be calculated.
+        n_cutoffs: Number of intermediate cutoff steps.
+        n_bins: Number of histogram bins along each offset axis.
+    """
+
+    def __init__(self, mdist: float = 3.0, n_cutoffs: int = 50, n_bins: int = 30):
+        self.mdist = mdist
+        self.cutoffs = np.linspace(start=0, stop=mdist, num=n_cutoffs)
+        self.n_images = 0
+        self.tp = np.zeros(n_cutoffs, dtype=int)
+        self.fp = np.zeros(n_cutoffs, dtype=int)
+        self.fn = np.zeros(n_cutoffs, dtype=int)
+        self.distance_sum = np.zeros(n_cutoffs)
+        self.offset_bins = np.linspace(start=-mdist, stop=mdist, num=n_bins + 1)
+        self.offset_histogram = np.zeros((n_bins, n_bins), dtype=int)
+        self._stats = {
+            "f1_score": _RunningStats(),
+            "f1_integral": _RunningStats(),
+            "mean_euclidean": _RunningStats(),
+        }
+
+    def update(self, pred: np.ndarray, true: np.ndarray) -> None:
+        """Add the metrics of a single image.
+
+        Args:
+            pred: Array of shape (n, 2) for predicted coordinates.
+            true: Array of shape (n, 2) for ground truth coordinates.
+        """
+        pred = np.asarray(pred, dtype=np.float64)
+        true = np.asarray(true, dtype=np.float64)
+        n_pred = len(pred) if pred.size else 0
+        n_true = len(true) if true.size else 0
+
+        tp = np.zeros(len(self.cutoffs), dtype=int)
+        distance_sum = np.zeros(len(self.cutoffs))
+        fp = np.full(len(self.cutoffs), n_pred)
+        if n_pred and n_true:
+            assignments = _assignments_at_cutoffs(pred, true, self.cutoffs)
+            for idx, (rows, cols, n_pred_true) in enumerate(assignments):
+                offsets = true[rows, :2] - pred[cols, :2]
+                tp[idx] = len(rows)
+                fp[idx] = n_pred - n_pred_true
+                distance_sum[idx] = offset_euclidean(offsets).sum()
+            self.offset_histogram += np.histogram2d(
+                offsets[:, 0], offsets[:, 1], bins=self.offset_bins
+            )[0].astype(int)
+
+        self.n_images += 1
+        self.tp += tp
+        self.fp += fp
+        self.fn += n_true - tp
+        self.distance_sum += distance_sum
+
+        # Same values as in "compute_metrics" weighted by their number of rows
+        f1_scores = [
+            _f1_from_counts(t, f, n_true - t) if n_pred and n_true else 0.0
+            for t, f in zip(tp, fp)
+        ]
+        n_rows = len(self.cutoffs)
+        self._stats["f1_score"].update(f1_scores[-1])
+        self._stats["f1_integral"].update(
+            np.trapz(f1_scores, self.cutoffs) / self.mdist, weight=n_rows
+        )
+        self._stats["mean_euclidean"].update(
+            distance_sum.sum() / (tp.sum() + 1e-10), weight=n_rows
+        )
+
+    def result(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Return the summary and the F1 vs. cutoff curve of all images added.
+
+        Returns:
+            A tuple containing:
+            * summary: Mean and std across images in the format of "summarize_metrics".
+            * curve: One row per cutoff with the pooled "tp", "fp", "fn" counts,
+                the resulting "f1_score", and the "abs_euclidean" average distance.
+        """
+        if not self.n_images:
+            raise ValueError("At least one image must be added to compute a result.")
+
+        summary = pd.DataFrame(
+            {
+                "mean": {name: stats.mean for name, stats in self._stats.items()},
+                "std": {name: stats.std for name, stats in self._stats.items()},
+            }
+        )
+        curve = pd.DataFrame(
+            {
+                "cutoff": self.cutoffs,
+                "tp": self.tp,
+                "fp": self.fp,
+                "fn": self.fn,
+                "f1_score": [
+                    _f1_from_counts(tp, fp, fn)
+                    for tp, fp, fn in zip(self.tp, self.fp, self.fn)
+                ],
+                "abs_euclidean": self.distance_sum / np.maximum(self.tp, 1),
+            }
+        )
+        return summary, curve
+
+
+class _RunningStats:
+    """Weighted running mean and sample standard deviation (West's algorithm)."""
+
+    def __init__(self):
+        self.weight = 0.0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def update(self, value: float, weight: float = 1.0) -> None:
+        """Add a single value with a given (frequency) weight."""
+        self.weight += weight
+        delta = value - self.mean
+        self.mean += weight / self.weight * delta
+        self._m2 += weight * delta * (value - self.mean)
+
+    @property
+    def std(self) -> float:
+        """Sample standard deviation, NaN if less than two samples were added."""
+        if self.weight <= 1:
+            return np.nan
+        return np.sqrt(self._m2 / (self.weight - 1))
@@ -1,13 +1,15 @@
 """Model class, to be extended by specific types of models."""
 
-from typing import Callable, Dict, List
+from typing import Callable, Dict, List, Optional
 import datetime
 import pathlib
 
 import numpy as np
+import tensorflow as tf
 
 from ..datasets import Dataset
 from ..datasets import SequenceDataset
+from ..datasets import get_tf_dataset
 from ..losses import f1_score
 from ..losses import rmse
 
@@ -26,7 +28,8 @@ class Model:
         network_fn: Network function returning a built model.
         loss_fn: Loss function.
         optimizer_fn: Optimizer function.
-        train_args: Training arguments containing - batch_size, epochs, learning_rate.
+        train_args: Training arguments containing - batch_size, epochs, learning_rate,
+            and optionally pipeline ("sequence" or "tfdata").
         batch_format_fn: Formatting function added in the specific model, e.g. spots.
         batch_augment_fn: Same as batch_format_fn for augmentation.
     """
@@ -52,6 +55,9 @@ class Model:
         self.train_args = train_args
         self.batch_format_fn = batch_format_fn
         self.batch_augment_fn = batch_augment_fn
+        # Augmentation of single image / mask tensors used in the tf.data pipeline,
+        # set in the specific model equivalent to batch_augment_fn
+        self.tensor_augment_fn: Optional[Callable] = None
 
         try:
             self.network = network_fn(**network_args)
@@ -88,21 +94,27 @@ class Model:
             metrics=self.metrics,
         )
 
-        train_sequence = SequenceDataset(
-            dataset.x_train,
-            dataset.y_train,
-            self.train_args["batch_size"],
-            format_fn=self.batch_format_fn,
-            augment_fn=self.batch_augment_fn,
-            overfit=self.train_args["overfit"],
-        )
-        valid_sequence = SequenceDataset(
-            dataset.x_valid,
-            dataset.y_valid,
-            self.train_args["batch_size"],
-            format_fn=self.batch_format_fn,
-            augment_fn=self.batch_augment_fn if augment_val else None,
-        )
+        if self.train_args.get("pipeline", "sequence") == "tfdata":
+            train_sequence = self.get_tf_dataset(dataset.x_train, dataset.y_train)
+            valid_sequence = self.get_tf_dataset(
+                dataset.x_valid, dataset.y_valid, augment=augment_val, shuffle=False
+            )
+        else:
+            train_sequence = SequenceDataset(
+                dataset.x_train,
+                dataset.y_train,
+                self.train_args["batch_size"],
+                format_fn=self.batch_format_fn,
+                augment_fn=self.batch_augment_fn,
+                overfit=self.train_args["overfit"],
+            )
+            valid_sequence = SequenceDataset(
+                dataset.x_valid,
+                dataset.y_valid,
+                self.train_args["batch_size"],
+                format_fn=self.batch_format_fn,
+                augment_fn=self.batch_augment_fn if augment_val else None,
+            )
 
         self.network.fit(
             train_sequence,
@@ -114,6 +126,20 @@ class Model:
             # workers=1,
         )
 
+    def get_tf_dataset(
+        self, x: np.ndarray, y: np.ndarray, augment: bool = True, shuffle: bool = True
+    ) -> tf.data.Dataset:
+        """Return a tf.data pipeline of x and y used instead of a SequenceDataset."""
+        return get_tf_dataset(
+            x,
+            y,
+            self.train_args["batch_size"],
+            augment_fn=self.tensor_augment_fn if augment else None,
+            shuffle=shuffle,
+            overfit=self.train_args["overfit"] if shuffle else False,
+            format_fn=self.batch_format_fn,
+        )
+
     def evaluate(self, x: np.ndarray, y: np.ndarray) -> List[float]:
         """Evaluate on images / masks and return l2 norm and f1 score."""
         if x.ndim < 4:
@@ -5,6 +5,7 @@ import functools
 import numpy as np
 
 from ..augment import augment_batch_baseline
+from ..datasets.pipeline import augment_tensors
 from ..losses import combined_f1_rmse
 from ..losses import f1_score
 from ..losses import rmse
@@ -26,6 +27,15 @@ class SpotsModel(Model):
             translate_=self.dataset_args["translate"],
             cell_size=self.dataset_args["cell_size"],
         )
+        self.tensor_augment_fn = functools.partial(
+            augment_tensors,
+            flip_=self.dataset_args["flip"],
+            illuminate_=self.dataset_args["illuminate"],
+            gaussian_noise_=self.dataset_args["gaussian_noise"],
+            rotate_=self.dataset_args["rotate"],
+            translate_=self.dataset_args["translate"],
+            cell_size=self.dataset_args["cell_size"],
+        )
 
     @property
     def metrics(self) -> list:
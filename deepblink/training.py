@@ -14,7 +14,7 @@ import wandb
 
 from .data import get_coordinate_list
 from .datasets import Dataset
-from .metrics import compute_metrics
+from .metrics import evaluate_dataset
 from .models import Model
 from .util import get_from_module
 
@@ -88,27 +88,24 @@ class WandbComputeMetrics(tf.keras.callbacks.Callback):
         self, name: str, images: np.ndarray, labels: np.ndarray
     ) -> pd.DataFrame:
         """Prediction and logging function for one set of images and labels."""
-        df = pd.DataFrame()
         mdist = self.mdist
 
-        for idx, (image, true) in enumerate(zip(images, labels)):
+        preds = []
+        trues = []
+        for image, true in zip(images, labels):
             pred = self.model.predict(image[None, ..., None]).squeeze()
-            curr_df = compute_metrics(
-                pred=get_coordinate_list(pred, image_size=image.shape[0]),
-                true=get_coordinate_list(true, image_size=image.shape[0]),
-                mdist=mdist,
-            )
-            curr_df["image"] = idx  # for downstream groupby's
-            df = df.append(curr_df)
+            preds.append(get_coordinate_list(pred, image_size=image.shape[0]))
+            trues.append(get_coordinate_list(true, image_size=image.shape[0]))
+        df, summary = evaluate_dataset(preds, trues, mdist=mdist)
 
         # Log single summary values to wandb
         values = {
-            f"{name} f1@{mdist} mean": df[df["cutoff"] == mdist]["f1_score"].mean(),
-            f"{name} f1@{mdist} std": df[df["cutoff"] == mdist]["f1_score"].std(),
-            f"{name} integral mean": df["f1_integral"].mean(),
-            f"{name} integral std": df["f1_integral"].std(),
-            f"{name} euclidean mean": df["mean_euclidean"].mean(),
-            f"{name} euclidean std": df["mean_euclidean"].std(),
+            f"{name} f1@{mdist} mean": summary.loc["f1_score", "mean"],
+            f"{name} f1@{mdist} std": summary.loc["f1_score", "std"],
+            f"{name} integral mean": summary.loc["f1_integral", "mean"],
+            f"{name} integral std": summary.loc["f1_integral", "std"],
+            f"{name} euclidean mean": summary.loc["mean_euclidean", "mean"],
+            f"{name} euclidean std": summary.loc["mean_euclidean", "std"],
         }
 
         for k, v in values.items():
@@ -236,7 +233,11 @@ def run_experiment(cfg: Dict, save_weights: bool = False):
 
     network_args["cell_size"] = dataset_args["cell_size"]
 
-    dataset = dataset_class(dataset_args["version"], dataset_args["cell_size"])
+    dataset = dataset_class(
+        dataset_args["version"],
+        dataset_args["cell_size"],
+        dataset_args.get("cache_dir"),
+    )
 
     use_wandb = cfg["use_wandb"]
     model = model_class(
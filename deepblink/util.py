@@ -1,11 +1,23 @@
 """Utility helper functions."""
 
-from typing import Callable, Iterable, Tuple, Union
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Mapping,
+    Tuple,
+    Union,
+)
+import concurrent.futures
 import importlib
 import random
 
 import numpy as np
-import pandas as pd
+
+if TYPE_CHECKING:  # pragma: no cover
+    import pandas as pd
 
 
 def get_from_module(path: str, attribute: str) -> Callable:
@@ -70,7 +82,7 @@ def train_valid_split(
     return x_train, x_valid, y_train, y_valid
 
 
-def delete_non_unique_columns(df: pd.DataFrame) -> pd.DataFrame:
+def delete_non_unique_columns(df: "pd.DataFrame") -> "pd.DataFrame":
     """Deletes DataFrame columns that only contain one (non-unique) value."""
     for col in df.columns:
         if len(df[col].unique()) == 1:
@@ -127,3 +139,120 @@ def predict_shape(shape: tuple) -> str:
     sorted_dims = [k for k, v in sorted(dims.items(), key=lambda item: item[1])]
     order = ",".join(sorted_dims)
     return order
+
+
+class ColumnBuffer:
+    """Columnar buffer collecting rows in chunks and materializing them once.
+
+    Repeatedly appending to a DataFrame copies all previous rows every time.
+    Here, every column is a preallocated numpy array whose capacity doubles
+    when full so that memory and time scale linearly with the number of rows.
+
+    Args:
+        capacity: Number of rows initially allocated.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.capacity = max(capacity, 1)
+        self.columns: Dict[str, np.ndarray] = {}
+        self.size = 0
+
+    def __len__(self) -> int:
+        """Return the number of rows collected."""
+        return self.size
+
+    def append(self, chunk: Union["pd.DataFrame", Mapping[str, Any]]) -> None:
+        """Add a chunk of rows.
+
+        Args:
+            chunk: DataFrame or mapping of column names to equally sized arrays.
+                Scalar values are broadcasted to all rows of the chunk. All chunks
+                must contain the same columns.
+        """
+        # Only imported on demand to speed up the CLI
+        import pandas as pd  # pylint: disable=import-outside-toplevel
+
+        if isinstance(chunk, pd.DataFrame):
+            chunk = {col: chunk[col].to_numpy() for col in chunk.columns}
+
+        lengths = {len(v) for v in chunk.values() if not np.isscalar(v)}
+        if len(lengths) > 1:
+            raise ValueError(f"All columns must have the same length. Found {lengths}.")
+        n_rows = lengths.pop() if lengths else 1
+
+        if self.columns and set(chunk) != set(self.columns):
+            raise ValueError(
+                f"Columns must match {list(self.columns)}. Found {list(chunk)}."
+            )
+
+        if self.size + n_rows > self.capacity:
+            while self.size + n_rows > self.capacity:
+                self.capacity *= 2
+            for name, column in self.columns.items():
+                self.columns[name] = self._resize(column, self.capacity)
+
+        for name, values in chunk.items():
+            values = self._as_array(values, n_rows)
+            if name not in self.columns:
+                self.columns[name] = np.empty(self.capacity, dtype=values.dtype)
+            column = self.columns[name]
+            dtype = np.result_type(column, values)
+            if dtype != column.dtype:
+                column = self.columns[name] = self._resize(column, self.capacity, dtype)
+            column[self.size : self.size + n_rows] = values
+
+        self.size += n_rows
+
+    def to_frame(self) -> "pd.DataFrame":
+        """Return all collected rows as DataFrame."""
+        import pandas as pd  # pylint: disable=import-outside-toplevel
+
+        return pd.DataFrame(
+            {name: column[: self.size] for name, column in self.columns.items()}
+        )
+
+    def _resize(
+        self, column: np.ndarray, capacity: int, dtype: np.dtype = None
+    ) -> np.ndarray:
+        """Copy the filled part of a column into a new array with given capacity."""
+        new_column = np.empty(capacity, dtype=dtype or column.dtype)
+        new_column[: self.size] = column[: self.size]
+        return new_column
+
+    @staticmethod
+    def _as_array(values: Any, n_rows: int) -> np.ndarray:
+        """Convert column values into a one-dimensional array of length n_rows."""
+        import pandas as pd  # pylint: disable=import-outside-toplevel
+
+        if np.isscalar(values):
+            return np.full(n_rows, values)
+        if isinstance(values, pd.Series):
+            values = values.to_numpy()
+        if isinstance(values, np.ndarray) and values.ndim == 1:
+            return values
+
+        # Nested items such as lists of tuples are kept as objects
+        array = np.empty(n_rows, dtype=object)
+        for idx, value in enumerate(values):
+            array[idx] = value
+        if all(np.isscalar(value) for value in array):
+            return np.array(array.tolist())
+        return array
+
+
+class SerialExecutor(concurrent.futures.Executor):
+    """Executor running submitted functions directly in the calling process."""
+
+    def submit(self, *args, **kwargs) -> concurrent.futures.Future:
+        """Run fn (the first argument) and return a future already containing its result.
+
+        The function is taken from the positional arguments such that it is
+        positional-only as in "Executor.submit" on all supported python versions.
+        """
+        fn, *fn_args = args
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*fn_args, **kwargs))
+        except Exception as error:  # pylint: disable=broad-except
+            future.set_exception(error)
+        return future
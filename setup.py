@@ -41,6 +41,7 @@ setup(
         "scikit-image",
         "scipy==1.4.1",
         "tensorflow>=2.0",
+        "tifffile",
         "wandb>=0.7.0",
     ],
     entry_points={"console_scripts": ["deepblink = deepblink.cli:main"]},
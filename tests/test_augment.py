@@ -1,17 +1,21 @@
 """Unittests for the deepblink.augment module."""
 # pylint: disable=missing-function-docstring
 
+from unittest import mock
+
 from hypothesis import given
 from hypothesis.extra.numpy import arrays
 import numpy as np
 import pytest
 
+from deepblink import augment
 from deepblink.augment import augment_batch_baseline
 from deepblink.augment import flip
 from deepblink.augment import gaussian_noise
 from deepblink.augment import illuminate
 from deepblink.augment import rotate
 from deepblink.augment import translate
+from deepblink.data import get_prediction_matrix
 
 
 @given(arrays(np.float32, (3, 5, 5)))
@@ -57,3 +61,68 @@ def test_translate(matrix):
     img, mask = translate(matrix, matrix)
     assert np.sum(np.sum(img)) == np.sum(np.sum(matrix))
     assert mask.shape == matrix.shape
+
+
+def _batch(n: int = 8, size: int = 32, cell_size: int = 4):
+    np.random.seed(42)
+    images = np.random.uniform(0, 1, (n, size, size)).astype(np.float32)
+    masks = np.array(
+        [
+            get_prediction_matrix(
+                np.random.uniform(0, size - 1, (10, 2)), size, cell_size
+            )
+            for _ in range(n)
+        ],
+        dtype=np.float32,
+    )
+    return images, masks
+
+
+@pytest.mark.parametrize(
+    "name, n_params", [("flip", 2), ("rotate", 4), ("translate", 2 * 8)],
+)
+def test_batch_augmentation(name, n_params):
+    # Every sample must match the single image augmentation with some parameter
+    images, masks = _batch()
+    aug_images, aug_masks = getattr(augment, f"{name}_batch")(images, masks)
+    assert aug_images.dtype == aug_masks.dtype == np.float32
+
+    for image, mask, aug_image, aug_mask in zip(images, masks, aug_images, aug_masks):
+        candidates = []
+        for param in range(n_params):
+            if name == "translate":
+                side_effect = [param // 8, param % 8]
+                with mock.patch("numpy.random.choice", side_effect=side_effect):
+                    candidates.append(translate(image, mask, cell_size=4))
+            else:
+                with mock.patch("numpy.random.randint", return_value=param):
+                    candidates.append(getattr(augment, name)(image, mask))
+        assert any(
+            np.array_equal(aug_image, exp_image) and np.array_equal(aug_mask, exp_mask)
+            for exp_image, exp_mask in candidates
+        )
+
+
+def test_batch_augmentation_out():
+    images, masks = _batch()
+    out = (np.empty_like(images), np.empty_like(masks))
+
+    aug_images, aug_masks = augment.illuminate_batch(images, masks, out=out)
+    assert aug_images is out[0] and aug_masks is out[1]
+    assert (aug_masks == masks).all()
+    factors = (aug_images / images).reshape(len(images), -1)
+    assert np.allclose(factors, factors[:, :1])
+    assert ((factors >= 0.25) & (factors <= 1.75)).all()
+
+    aug_images, _ = augment.gaussian_noise_batch(images, masks, out=out)
+    assert np.median(np.abs(aug_images - images)) < 0.05
+
+    with pytest.raises(ValueError):
+        augment.flip_batch(images, masks, out=(images[:1], masks))
+
+    aug_images, aug_masks = augment_batch_baseline(
+        images, masks, flip_=True, rotate_=True, translate_=True
+    )
+    assert aug_images.shape == images.shape
+    assert np.isclose(aug_images.sum(), images.sum())
+    assert (aug_masks[..., 0].sum(axis=(1, 2)) == masks[..., 0].sum(axis=(1, 2))).all()
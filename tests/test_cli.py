@@ -2,8 +2,46 @@
 # pylint: disable=missing-function-docstring
 from unittest import mock
 import argparse
+import concurrent.futures
+import http.client
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
 
+import numpy as np
+import pandas as pd
+import pytest
+import tifffile
+
+from deepblink.cli._config import HandleConfig
+from deepblink.cli._create import HandleCreate
 from deepblink.cli._main import arg_parser
+from deepblink.cli._main import main
+from deepblink.cli._output import CONSOLIDATED_DIR
+from deepblink.cli._output import MANIFEST_FILE
+from deepblink.cli._output import ConsolidatedWriter
+from deepblink.cli._output import load_consolidated
+from deepblink.cli._predict import HandlePredict
+from deepblink.cli._predict import PredictOptions
+from deepblink.cli._predict import _read_planes
+from deepblink.cli._serve import HandleServe
+from deepblink.cli._serve import ServeOptions
+from deepblink.datasets import ChunkedSpotsDataset
+from deepblink.inference import CompiledPredictor
+from deepblink.inference import predict_batch
+from deepblink.io import basename
+from deepblink.io import load_model
+from deepblink.io import load_npz
+from deepblink.networks import convolution
+import deepblink
+
+# Dependencies only required for prediction / training which slow down the startup
+HEAVY_MODULES = ("matplotlib", "pandas", "scipy", "skimage", "tensorflow", "wandb")
 
 
 # TODO cover more in-depth functionality like commands etc.
@@ -14,3 +52,485 @@ def test_parse_args():
 
     with mock.patch("sys.argv", [""]):
         assert isinstance(parser.parse_args(), argparse.Namespace)
+
+
+@pytest.mark.parametrize("command", ["check", "config"])
+def test_lazy_imports(command):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if command == "check":
+            fname = os.path.join(temp_dir, "image.tif")
+            tifffile.imwrite(fname, np.zeros((5, 32, 32), dtype=np.uint16))
+            argv = ["deepblink", "check", fname]
+        else:
+            argv = ["deepblink", "config", "--name", "test"]
+
+        code = (
+            "import sys\n"
+            "from unittest import mock\n"
+            "from deepblink.cli import main\n"
+            f"with mock.patch('sys.argv', {argv!r}):\n"
+            "    main()\n"
+            "print(' '.join(sys.modules), file=sys.stderr)\n"
+        )
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.path.dirname(os.path.dirname(deepblink.__file__))
+        process = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=temp_dir,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=True,
+        )
+
+    modules = {m.split(".")[0] for m in process.stderr.decode().split()}
+    assert not modules.intersection(HEAVY_MODULES)
+
+
+def test_config_cache_default():
+    # Datasets are not cached to disk by default
+    config = HandleConfig("config", logging.getLogger("test")).config
+    assert config["dataset_args"]["cache_dir"]["value"] is None
+
+
+@pytest.mark.parametrize("fmt, workers", [("npz", 1), ("chunked", 1), ("npz", 2)])
+def test_create(fmt, workers):
+    np.random.seed(42)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.makedirs(os.path.join(temp_dir, "labels"))
+        for idx, shape in enumerate([(70, 70), (100, 70), (20, 20), (70, 70)]):
+            image = np.random.randint(0, 255, shape).astype(np.uint16)
+            tifffile.imwrite(os.path.join(temp_dir, f"{idx}.tif"), image)
+            n_spots = 1 if idx == 3 else 50
+            coords = np.random.uniform(0, min(shape), (n_spots, 2))
+            df = pd.DataFrame(coords, columns=["Y", "X"])
+            df.to_csv(os.path.join(temp_dir, "labels", f"{idx}.csv"))
+
+        argv = ["deepblink", "create", "-i", temp_dir, "-s", "32", "-f", fmt]
+        argv.extend(["-w", str(workers)])
+        with mock.patch("sys.argv", argv):
+            main()
+
+        # Only images 0 (4 crops) and 1 (6 crops) are large enough and labeled
+        if fmt == "npz":
+            x_train, y_train, x_valid, y_valid, x_test, y_test = load_npz(
+                os.path.join(temp_dir, "dataset.npz")
+            )
+        else:
+            dataset = ChunkedSpotsDataset(os.path.join(temp_dir, "dataset"), 4)
+            x_train, x_valid, x_test = dataset.x_train, dataset.x_valid, dataset.x_test
+
+            # Chunked datasets are saved uncompressed by default to be memory-mapped
+            assert isinstance(x_train.split.shard(0)["images"], np.memmap)
+            y_train, y_valid, y_test = [
+                [labels.split.coords(i) for i in range(len(labels))]
+                for labels in [dataset.y_train, dataset.y_valid, dataset.y_test]
+            ]
+        assert (len(x_train), len(x_valid), len(x_test)) == (6, 2, 2)
+        assert x_train.shape[1:] == (32, 32)
+        for coords in [*y_train, *y_valid, *y_test]:
+            assert coords.shape[1] == 2
+            assert ((coords >= 0) & (coords <= 32)).all()
+
+
+def test_create_empty():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.makedirs(os.path.join(temp_dir, "labels"))
+        argv = ["deepblink", "create", "-i", temp_dir]
+        with mock.patch("sys.argv", argv):
+            with pytest.raises(ValueError):
+                main()
+
+
+@pytest.mark.parametrize("stride", [None, 8, 20, 40])
+def test_crop_image(stride):
+    np.random.seed(42)
+    image = np.random.random((100, 70))
+    coords = np.concatenate(
+        [np.random.uniform(0, 70, (200, 2)), np.random.randint(0, 70, (50, 2))]
+    )
+    df = pd.DataFrame(coords, columns=["r", "c"], index=np.arange(250) * 2)
+
+    images, dfs = HandleCreate.crop_image(image, df, size=32, stride=stride)
+
+    # Reference of edge-inclusive filtering per window
+    step = 32 if stride is None else stride
+    idx = 0
+    for r_min in range(0, 100 - 32 + 1, step):
+        for c_min in range(0, 70 - 32 + 1, step):
+            assert np.array_equal(
+                images[idx], image[r_min : r_min + 32, c_min : c_min + 32]
+            )
+            df_slice = df[
+                (df["r"] >= r_min)
+                & (df["r"] <= r_min + 32)
+                & (df["c"] >= c_min)
+                & (df["c"] <= c_min + 32)
+            ]
+            expected = df_slice - [r_min, c_min]
+            pd.testing.assert_frame_equal(dfs[idx], expected)
+            idx += 1
+    assert idx == len(images) == len(dfs)
+
+
+@pytest.fixture
+def fname_model():
+    # Seeded weights such that spots are always detected
+    random = np.random.RandomState(42)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fname = os.path.join(temp_dir, "model.h5")
+        model = convolution(filters=2)
+        model.set_weights(
+            [random.uniform(-0.5, 0.5, w.shape) for w in model.get_weights()]
+        )
+        model.save(fname)
+        yield fname
+
+
+def test_serve(fname_model):
+    np.random.seed(42)
+    images = [np.random.random((64, 64)).astype(np.float32) for _ in range(4)]
+    expected = predict_batch(images, load_model(fname_model))
+
+    handler = HandleServe(
+        arg_model=[fname_model],
+        arg_host="127.0.0.1",
+        arg_port=0,
+        arg_socket=None,
+        arg_options=ServeOptions(batchsize=4, batchwait=50, warmup=(64,)),
+        logger=logging.getLogger("test"),
+    )
+    server = handler.start()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+
+    def request(method, path, body=None):
+        connection = http.client.HTTPConnection(host, port, timeout=30)
+        connection.request(method, path, body=body)
+        response = connection.getresponse()
+        return response.status, response.read().decode()
+
+    def predict(image):
+        buffer = io.BytesIO()
+        np.save(buffer, image)
+        return request("POST", "/predict?model=model", buffer.getvalue())
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            responses = list(executor.map(predict, images))
+        for (status, body), coords in zip(responses, expected):
+            assert status == 200
+            df = pd.read_csv(io.StringIO(body), dtype=float)
+            assert list(df.columns) == ["y", "x"]
+            assert np.allclose(df.values.reshape(-1, 2), coords)
+
+        # Errors are returned as json
+        status, body = request("POST", "/predict?model=other", b"")
+        assert status == 404
+        assert json.loads(body) == {
+            "error": "Unknown model other. Available are ['model']."
+        }
+        status, body = request("GET", "/unknown")
+        assert status == 404
+        assert json.loads(body) == {"error": "Unknown path /unknown."}
+        status, body = request("POST", "/predict", b"invalid")
+        assert status == 400
+        assert json.loads(body)["error"].startswith("Image could not be processed.")
+
+        # Unexpected errors are logged
+        error = RuntimeError("unexpected")
+        with mock.patch.object(handler, "predict", side_effect=error):
+            with mock.patch.object(handler.logger, "error") as log:
+                status, body = request("POST", "/predict?model=model", b"")
+        assert status == 500
+        assert json.loads(body) == {"error": "Prediction failed. unexpected"}
+        assert log.call_count == 1
+        with mock.patch.object(handler, "predict", side_effect=KeyError("bug")):
+            status, _ = request("POST", "/predict?model=model", b"")
+        assert status == 500
+        assert request("GET", "/health") == (200, "ok")
+        status, body = request("GET", "/stats")
+        stats = json.loads(body)
+        assert status == 200
+        assert stats["requests"] == len(images)
+        assert stats["models"] == ["model"]
+        assert 0 < stats["p50_ms"] <= stats["p99_ms"]
+
+        # Mixed shapes are predicted in separate, padded batches
+        batcher = handler.batchers["model"]
+        assert batcher.buckets == [1, 2, 4]
+        assert isinstance(batcher.model, CompiledPredictor)
+        mixed = [images[0], images[1][:32, :32], images[2], images[3]]
+        for coords, image in zip(batcher.predict(mixed), mixed):
+            assert np.allclose(coords, predict_batch([image], batcher.model)[0])
+    finally:
+        server.shutdown()
+        handler.stop()
+
+
+def _get_predict_handler(fname_model, path_input, path_output, **kwargs):
+    return HandlePredict(
+        arg_model=fname_model,
+        arg_input=path_input,
+        arg_output=path_output,
+        logger=logging.getLogger("test"),
+        arg_options=PredictOptions(**{"batchsize": 4, **kwargs}),
+    )
+
+
+def test_predict_arguments(fname_model):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        logger = logging.getLogger("test")
+
+        # Positional arguments of previous versions still work
+        handler = HandlePredict(fname_model, temp_dir, temp_dir, 2, "(x,y)", logger)
+        assert handler.options == PredictOptions(radius=2, shape="(x,y)")
+
+        handler = HandlePredict(
+            fname_model,
+            temp_dir,
+            temp_dir,
+            arg_radius=1,
+            logger=logger,
+            arg_options=PredictOptions(radius=3, batchsize=4),
+        )
+        assert handler.options == PredictOptions(radius=1, batchsize=4)
+
+        with pytest.raises(TypeError):
+            HandlePredict(fname_model, temp_dir, temp_dir)
+
+
+def test_predict_watch(fname_model):
+    np.random.seed(42)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path_input = os.path.join(temp_dir, "input")
+        path_output = os.path.join(temp_dir, "output")
+        os.mkdir(path_input)
+        os.mkdir(path_output)
+        args = (fname_model, path_input, path_output)
+
+        fname_first = os.path.join(path_input, "first.tif")
+        tifffile.imwrite(fname_first, np.random.random((64, 64)))
+        handler = _get_predict_handler(*args, watch=0.01)
+
+        # Files are only ready once their size did not change between two polls
+        stats = {}
+        assert handler.poll_files(stats) == []
+        assert handler.poll_files(stats) == [fname_first]
+
+        handler.watch_folder(max_polls=2)
+        fname_out = os.path.join(path_output, "first.csv")
+        mtime = os.stat(fname_out).st_mtime_ns
+        assert handler.poll_files(stats) == []
+
+        # Restarts skip finished files
+        tifffile.imwrite(
+            os.path.join(path_input, "second.tif"), np.random.random((64, 64))
+        )
+        _get_predict_handler(*args, watch=0.01).watch_folder(max_polls=2)
+        assert os.stat(fname_out).st_mtime_ns == mtime
+        assert os.path.isfile(os.path.join(path_output, "second.csv"))
+
+
+def test_predict_resume(fname_model):
+    np.random.seed(42)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path_output = os.path.join(temp_dir, "output")
+        os.mkdir(path_output)
+        fnames = [os.path.join(temp_dir, f"{i}.tif") for i in range(3)]
+        for fname in fnames:
+            tifffile.imwrite(fname, np.random.random((64, 64)))
+        args = (fname_model, temp_dir, path_output)
+
+        def get_mtimes():
+            return [
+                os.stat(os.path.join(path_output, f"{i}.csv")).st_mtime_ns
+                for i in range(3)
+            ]
+
+        def read_manifest():
+            with open(os.path.join(path_output, MANIFEST_FILE), "r") as f:
+                return f.read()
+
+        # Runs without resume don't record their outputs
+        _get_predict_handler(*args)()
+        assert not [f for f in os.listdir(path_output) if f.endswith(".tmp")]
+        assert not os.path.exists(os.path.join(path_output, MANIFEST_FILE))
+
+        _get_predict_handler(*args, resume=True)()
+        mtimes = get_mtimes()
+        manifest = read_manifest()
+        assert len(manifest.splitlines()) == 3
+
+        # Incomplete and duplicate lines are ignored and compacted on resume
+        with open(os.path.join(path_output, MANIFEST_FILE), "a") as f:
+            f.write(manifest.splitlines()[0] + "\n" + '{"input": ')
+        _get_predict_handler(*args, resume=True)()
+        assert get_mtimes() == mtimes
+        assert read_manifest() == manifest
+
+        # Changed inputs and missing outputs are predicted again
+        tifffile.imwrite(fnames[0], np.random.random((64, 64)))
+        os.remove(os.path.join(path_output, "1.csv"))
+        inode = os.stat(os.path.join(path_output, MANIFEST_FILE)).st_ino
+        _get_predict_handler(*args, resume=True)()
+        assert os.stat(os.path.join(path_output, MANIFEST_FILE)).st_ino == inode
+        new_mtimes = get_mtimes()
+        assert new_mtimes[0] != mtimes[0]
+        assert new_mtimes[2] == mtimes[2]
+
+        # Different models invalidate all outputs
+        convolution(filters=4).save(fname_model)
+        _get_predict_handler(*args, resume=True)()
+        assert all(new != old for new, old in zip(get_mtimes(), new_mtimes))
+
+
+def test_predict_consolidate(fname_model):
+    np.random.seed(42)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path_output = os.path.join(temp_dir, "output")
+        os.mkdir(path_output)
+        for i in range(3):
+            image = np.random.random((2, 64, 64))
+            tifffile.imwrite(os.path.join(temp_dir, f"{i}.tif"), image)
+        args = (fname_model, temp_dir, path_output)
+
+        _get_predict_handler(*args)()
+        _get_predict_handler(*args, consolidate=True, resume=True)()
+        path_store = os.path.join(path_output, CONSOLIDATED_DIR)
+        assert sorted(os.listdir(path_store)) == ["files-00000.csv", "part-00000.csv"]
+
+        df = load_consolidated(path_store)
+        assert sorted(df["file_id"].unique()) == [0, 1, 2]
+        for fname, output in df.groupby("input"):
+            expected = pd.read_csv(os.path.join(path_output, f"{basename(fname)}.csv"))
+            assert np.allclose(output[expected.columns].values, expected.values)
+
+        # Resumed runs add new partitions, changed inputs replace their previous rows
+        _get_predict_handler(*args, consolidate=True, resume=True)()
+        assert len(os.listdir(path_store)) == 2
+        tifffile.imwrite(os.path.join(temp_dir, "0.tif"), np.random.random((64, 64)))
+        tifffile.imwrite(os.path.join(temp_dir, "3.tif"), np.random.random((64, 64)))
+        _get_predict_handler(*args, consolidate=True, resume=True)()
+        assert len(os.listdir(path_store)) == 4
+        files = pd.read_csv(os.path.join(path_store, "files-00001.csv"))
+        assert list(files["replaces"].fillna(-1)) == [0, -1]
+
+        df = load_consolidated(path_store)
+        assert sorted(df["file_id"].unique()) == [1, 2, 3, 4]
+        assert df.groupby("input")["file_id"].nunique().max() == 1
+        assert df["input"].nunique() == 4
+
+        # Watching keeps collecting outputs over polls and saves them when stopped
+        handler = _get_predict_handler(*args, consolidate=True, watch=0.01)
+        tifffile.imwrite(os.path.join(temp_dir, "4.tif"), np.random.random((64, 64)))
+        with mock.patch.object(handler.writer, "flush") as flush:
+            handler.watch_folder(max_polls=3)
+        assert flush.call_count == 1
+        assert os.path.join(temp_dir, "4.tif") in handler.writer
+
+
+def test_consolidated_writer():
+    row = pd.DataFrame({"y": [1.0], "x": [2.0]})
+    with tempfile.TemporaryDirectory() as temp_dir:
+        writer = ConsolidatedWriter(temp_dir, "csv", max_rows=2, max_age=3600)
+        writer.add("a.tif", row)
+        assert "a.tif" in writer
+        writer.flush_due()
+        assert writer.n_parts == 0
+        writer.add("b.tif", row)
+        assert writer.n_parts == 1
+        assert "a.tif" not in writer
+
+        # Mappings saved without partition due to a crash are ignored and overwritten
+        with open(os.path.join(temp_dir, "files-00001.csv"), "w") as f:
+            f.write("file_id,input,part,replaces\n2,/orphan.tif,part-00001.csv,\n")
+        writer = ConsolidatedWriter(temp_dir, "csv", max_rows=10, max_age=0)
+        assert (writer.n_parts, writer.n_files) == (1, 2)
+        writer.add("a.tif", row)
+        writer.flush_due()
+        assert writer.n_parts == 2
+
+        df = load_consolidated(temp_dir)
+        assert list(df["file_id"]) == [1, 2]
+        assert [basename(fname) for fname in df["input"]] == ["b", "a"]
+
+
+def test_predict_workers(fname_model):
+    np.random.seed(42)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        image = np.random.random((2, 5, 40, 64))
+        tifffile.imwrite(os.path.join(temp_dir, "image.tif"), image)
+
+        outputs = []
+        for workers in [1, 2]:
+            path_output = os.path.join(temp_dir, str(workers))
+            os.mkdir(path_output)
+            handler = _get_predict_handler(
+                fname_model,
+                os.path.join(temp_dir, "image.tif"),
+                path_output,
+                radius=1,
+                background=1,
+                shape="(c,z,x,y)",
+                batchsize=4,
+                workers=workers,
+            )
+            with mock.patch.object(
+                handler, "predict_planes", wraps=handler.predict_planes
+            ) as predict, mock.patch(
+                "deepblink.cli._predict._read_planes", wraps=_read_planes
+            ) as read:
+                handler()
+            outputs.append(pd.read_csv(os.path.join(path_output, "image.csv")))
+
+            # Planes are read once for predictions and intensities
+            if workers == 1:
+                assert read.call_count == 3
+
+            # Planes are transposed and normalized before reaching the model
+            planes = [p for call in predict.call_args_list for p in call.args[0]]
+            assert [len(call.args[0]) for call in predict.call_args_list] == [4, 4, 2]
+            assert planes[0].shape == (64, 40)
+            assert np.allclose(planes[-1].mean(), 0, atol=1e-5)
+            assert np.allclose(planes[-1].std(), 1, atol=1e-5)
+
+        assert len(outputs[0]) > 0
+        assert list(outputs[0].columns) == ["y", "x", "c", "z", "i", "b", "snr"]
+        pd.testing.assert_frame_equal(outputs[0], outputs[1])
+
+
+def test_predict_dimensions(fname_model):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path_output = os.path.join(temp_dir, "output")
+        os.mkdir(path_output)
+        for i in range(5):
+            image = np.random.random((64, 64))
+            tifffile.imwrite(os.path.join(temp_dir, f"{i}.tif"), image)
+        image = np.random.random((2, 64, 64))
+        tifffile.imwrite(os.path.join(temp_dir, "5.tif"), image)
+
+        # Dimensions are checked before any output is saved
+        with pytest.raises(ValueError):
+            _get_predict_handler(fname_model, temp_dir, path_output)()
+        assert not [f for f in os.listdir(path_output) if f.endswith(".csv")]
+
+
+def test_predict_format(fname_model):
+    np.random.seed(42)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tifffile.imwrite(
+            os.path.join(temp_dir, "image.tif"), np.random.random((64, 64))
+        )
+        args = (fname_model, temp_dir, temp_dir)
+
+        with mock.patch("importlib.util.find_spec", return_value=None):
+            with pytest.raises(ImportError):
+                _get_predict_handler(*args, format="parquet")
+
+        pytest.importorskip("pyarrow")
+        _get_predict_handler(*args, format="parquet", radius=1)()
+        df = pd.read_parquet(os.path.join(temp_dir, "image.parquet"))
+        assert list(df.columns) == ["y", "x", "i"]
+        assert (df.dtypes == np.float32).all()
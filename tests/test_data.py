@@ -8,7 +8,10 @@ from hypothesis.strategies import floats
 import numpy as np
 import pytest
 
+from deepblink.data import absolute_coordinate
 from deepblink.data import get_coordinate_list
+from deepblink.data import get_coordinate_list_batch
+from deepblink.data import get_prediction_matrices
 from deepblink.data import get_prediction_matrix
 from deepblink.data import next_multiple
 from deepblink.data import next_power
@@ -54,6 +57,42 @@ def test_get_coordinate_list():
     assert (theoretical_result == output).all()
 
 
+def _get_coordinate_list_loop(matrix, image_size):
+    """Reference implementation looping over every positive cell."""
+    cell_size = image_size // max(matrix.shape)
+    coords = [
+        absolute_coordinate(
+            coord_spot=(matrix[r, c, 1], matrix[r, c, 2]),
+            coord_cell=(r * cell_size, c * cell_size),
+            cell_size=cell_size,
+        )
+        for r, c in zip(*np.round(matrix[..., 0]).nonzero())
+    ]
+    return np.array(coords).reshape(-1, 2)
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_get_coordinate_list_identical(dtype):
+    matrices = np.random.rand(4, 32, 32, 3).astype(dtype)
+    matrices[0, ..., 0] = 0
+
+    for matrix in matrices:
+        output = get_coordinate_list(matrix, image_size=128)
+        expected = _get_coordinate_list_loop(matrix, image_size=128)
+        assert output.shape == expected.shape
+        assert output.dtype == expected.dtype
+        assert np.array_equal(output, expected)
+
+    output = get_coordinate_list_batch(matrices, image_size=128)
+    assert output.shape[1] == 3
+    for idx, matrix in enumerate(matrices):
+        expected = get_coordinate_list(matrix, image_size=128)
+        assert np.array_equal(output[output[:, 2] == idx, :2], expected)
+
+    with pytest.raises(ValueError):
+        get_coordinate_list_batch(matrices[0], image_size=128)
+
+
 def test_get_prediction_matrix():
     image_size = 12
     cell_size = 4
@@ -75,3 +114,38 @@ def test_get_prediction_matrix():
     )
     output = get_prediction_matrix(rc, image_size=image_size, cell_size=cell_size)
     assert (theoretical_result == output).all()
+
+
+def _get_prediction_matrix_loop(coords, image_size, cell_size):
+    """Reference implementation assigning one coordinate at a time."""
+    nrow = ncol = int(np.ceil(image_size / cell_size))
+    matrix = np.zeros((nrow, ncol, 3))
+    for r, c in coords:
+        cell_r = min(nrow - 1, int(np.floor(r)) // cell_size)
+        cell_c = min(ncol - 1, int(np.floor(c)) // cell_size)
+        matrix[cell_r, cell_c] = (
+            1,
+            (r - cell_r * cell_size) / cell_size,
+            (c - cell_c * cell_size) / cell_size,
+        )
+    return matrix
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64, np.int64])
+def test_get_prediction_matrix_identical(dtype):
+    image_size, cell_size = 30, 4
+    coords_list = [
+        (np.random.rand(n, 2) * image_size).astype(dtype) for n in [0, 1, 50, 400]
+    ]
+    coords_list[-1][-1] = image_size  # Spot on the border
+
+    outputs = get_prediction_matrices(coords_list, image_size, cell_size)
+    assert outputs.shape == (4, 8, 8, 3)
+    assert outputs.dtype == np.float32
+
+    for coords, output in zip(coords_list, outputs):
+        expected = _get_prediction_matrix_loop(coords, image_size, cell_size)
+        assert np.array_equal(
+            get_prediction_matrix(coords, image_size, cell_size), expected
+        )
+        assert np.array_equal(output, expected.astype(np.float32))
@@ -0,0 +1,212 @@
+"""Unittests for the deepblink.datasets module."""
+# pylint: disable=missing-function-docstring
+
+from unittest import mock
+import os
+import tempfile
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from deepblink import augment
+from deepblink.data import get_prediction_matrix
+from deepblink.datasets import ChunkedSpotsDataset
+from deepblink.datasets import SequenceDataset
+from deepblink.datasets import SpotsDataset
+from deepblink.datasets import get_tf_dataset
+from deepblink.datasets import pipeline
+from deepblink.io import ChunkedDatasetWriter
+
+
+def _image_mask(size: int = 32, cell_size: int = 4):
+    np.random.seed(42)
+    coords = np.random.uniform(0, size - 1, (10, 2))
+    image = np.random.uniform(0, 1, (size, size)).astype(np.float32)
+    mask = get_prediction_matrix(coords, size, cell_size).astype(np.float32)
+    return image, mask
+
+
+@pytest.mark.parametrize(
+    "name, n_params", [("flip", 2), ("rotate", 4), ("translate", 2 * 8)],
+)
+def test_tensor_augmentation(name, n_params):
+    # Must match the numpy augmentation with any random parameter
+    image, mask = _image_mask()
+    candidates = []
+    for param in range(n_params):
+        if name == "translate":
+            side_effect = [param // 8, param % 8]
+            with mock.patch("numpy.random.choice", side_effect=side_effect):
+                candidates.append(augment.translate(image, mask, cell_size=4))
+        else:
+            with mock.patch("numpy.random.randint", return_value=param):
+                candidates.append(getattr(augment, name)(image, mask))
+
+    for _ in range(10):
+        output = getattr(pipeline, name)(tf.constant(image), tf.constant(mask))
+        aug_image, aug_mask = [tensor.numpy() for tensor in output]
+        assert any(
+            np.array_equal(aug_image, exp_image) and np.allclose(aug_mask, exp_mask)
+            for exp_image, exp_mask in candidates
+        )
+
+
+def test_get_tf_dataset():
+    image, mask = _image_mask()
+    x = np.stack([image] * 10)
+    y = np.stack([mask] * 10)
+    augment_fn = lambda i, m: pipeline.augment_tensors(  # noqa: E731
+        i, m, flip_=True, illuminate_=True, gaussian_noise_=True, rotate_=True
+    )
+
+    dataset = get_tf_dataset(x, y, batch_size=4, augment_fn=augment_fn)
+    batches = list(dataset.as_numpy_iterator())
+    expected = SequenceDataset(x, y, batch_size=4)
+    assert len(batches) == len(expected) == 2
+    for (batch_x, batch_y), (exp_x, exp_y) in zip(batches, expected):
+        assert batch_x.shape == exp_x.shape == (4, 32, 32, 1)
+        assert batch_y.shape == exp_y.shape == (4, 8, 8, 3)
+        assert (batch_y[..., 0].sum(axis=(1, 2)) == mask[..., 0].sum()).all()
+
+    with pytest.warns(RuntimeWarning):
+        dataset = get_tf_dataset(x, y, batch_size=16, shuffle=False)
+    batch_x, batch_y = next(dataset.as_numpy_iterator())
+    assert (batch_x[..., 0] == x).all()
+    assert (batch_y == y).all()
+
+    # Same number of batches per epoch when overfitting
+    dataset = get_tf_dataset(x[:9], y[:9], batch_size=2, overfit=True)
+    batches = list(dataset.as_numpy_iterator())
+    expected = SequenceDataset(x[:9], y[:9], batch_size=2, overfit=True)
+    assert len(batches) == len(expected) == 4
+    assert all((batch_x == batches[0][0]).all() for batch_x, _ in batches)
+
+    # Format functions are applied to every batch like in SequenceDataset
+    sizes = []
+
+    def format_fn(batch_x, batch_y):
+        sizes.append(len(batch_x))
+        return batch_x[:, ::2, ::2] * 2, batch_y
+
+    dataset = get_tf_dataset(x, y, batch_size=4, shuffle=False, format_fn=format_fn)
+    batches = list(dataset.as_numpy_iterator())
+    expected = SequenceDataset(x, y, batch_size=4, format_fn=format_fn)
+    assert len(batches) == len(expected) == 2
+    assert sizes[1:] == [4, 4, 2]
+    for (batch_x, batch_y), (exp_x, exp_y) in zip(batches, expected):
+        assert batch_x.shape == exp_x.shape == (4, 16, 16, 1)
+        assert np.allclose(batch_x, exp_x)
+        assert (batch_y == exp_y).all()
+
+
+def _save_npz(fname: str, n: int = 6, size: int = 32):
+    np.random.seed(42)
+    images = np.random.uniform(0, 255, (n, size, size))
+    coords = np.empty(n, dtype=object)
+    coords[:] = [np.random.uniform(0, size - 1, (i, 2)) for i in range(n)]
+    np.savez_compressed(
+        fname,
+        x_train=images[:4],
+        y_train=coords[:4],
+        x_valid=images[4:],
+        y_valid=coords[4:],
+        x_test=images[4:],
+        y_test=coords[4:],
+    )
+
+
+def test_spots_dataset_cache():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fname = os.path.join(temp_dir, "dataset.npz")
+        cache_dir = os.path.join(temp_dir, "cache")
+        _save_npz(fname)
+
+        expected = SpotsDataset(fname, cell_size=4)
+        dataset = SpotsDataset(fname, cell_size=4, cache_dir=cache_dir)
+        assert len(os.listdir(cache_dir)) == 1
+        cached = SpotsDataset(fname, cell_size=4, cache_dir=cache_dir)
+        assert isinstance(cached.x_train, np.memmap)
+
+        for attr in ["x_train", "y_train", "x_valid", "y_valid"]:
+            exp = getattr(expected, attr)
+            for data in [dataset, cached]:
+                assert getattr(data, attr).dtype == np.float32
+                assert np.array_equal(getattr(data, attr), exp)
+
+        # Different cell sizes are cached separately
+        dataset = SpotsDataset(fname, cell_size=8, cache_dir=cache_dir)
+        assert len(os.listdir(cache_dir)) == 2
+        assert dataset.y_train.shape == (4, 4, 4, 3)
+
+
+def test_spots_dataset_no_cache():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fname = os.path.join(temp_dir, "dataset.npz")
+        _save_npz(fname)
+
+        home = os.path.join(temp_dir, "home")
+        os.mkdir(home)
+        with mock.patch.dict(os.environ, {"HOME": home}):
+            SpotsDataset(fname, 4, None)
+        assert sorted(os.listdir(temp_dir)) == ["dataset.npz", "home"]
+        assert not os.listdir(home)
+
+
+def test_chunked_spots_dataset():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fname = os.path.join(temp_dir, "dataset.npz")
+        path = os.path.join(temp_dir, "dataset")
+        _save_npz(fname, n=12)
+
+        with np.load(fname, allow_pickle=True) as data, ChunkedDatasetWriter(
+            path, shard_size=3
+        ) as writer:
+            for split in ["train", "valid", "test"]:
+                for image, coords in zip(data[f"x_{split}"], data[f"y_{split}"]):
+                    writer.add(split, image, coords)
+
+        expected = SpotsDataset(fname, cell_size=4)
+        dataset = ChunkedSpotsDataset(path, cell_size=4)
+        with pytest.warns(UserWarning):
+            ChunkedSpotsDataset(path, 4, os.path.join(temp_dir, "cache"))
+        assert not os.path.exists(os.path.join(temp_dir, "cache"))
+        assert dataset.image_size == expected.image_size == 32
+        for attr in ["x_train", "y_train", "x_valid", "y_valid"]:
+            exp = getattr(expected, attr)
+            lazy = getattr(dataset, attr)
+            assert len(lazy) == len(exp)
+            assert lazy.shape == exp.shape
+            assert np.array_equal(lazy[1], exp[1])
+            assert np.array_equal(lazy[:2], exp[:2])
+            assert np.array_equal(lazy[[3, 0, 2]], exp[[3, 0, 2]])
+            assert np.array_equal(np.asarray(lazy), exp)
+
+        sequence = SequenceDataset(dataset.x_train, dataset.y_train, batch_size=2)
+        sequence.on_epoch_end()
+        batch_x, batch_y = sequence[0]
+        indices = sequence.indices[:2]
+        assert sorted(sequence.indices) == list(range(len(expected.x_train)))
+        assert np.array_equal(batch_x[..., 0], expected.x_train[indices])
+        assert np.array_equal(batch_y, expected.y_train[indices])
+
+        # Lazy splits are read batch by batch and never converted as a whole
+        with mock.patch.object(
+            type(dataset.x_train), "__array__", side_effect=AssertionError
+        ):
+            tf_dataset = get_tf_dataset(
+                dataset.x_train, dataset.y_train, batch_size=2, shuffle=False
+            )
+            batches = list(tf_dataset.as_numpy_iterator())
+            assert len(batches) == len(sequence) == 2
+            batch_x = np.concatenate([b[0][..., 0] for b in batches])
+            batch_y = np.concatenate([b[1] for b in batches])
+            assert np.array_equal(batch_x, expected.x_train)
+            assert np.array_equal(batch_y, expected.y_train)
+
+            tf_dataset = get_tf_dataset(dataset.x_train, dataset.y_train, batch_size=2)
+            batch_x = np.concatenate([b[0] for b in tf_dataset.as_numpy_iterator()])
+            assert batch_x.shape == (4, 32, 32, 1)
+            assert np.allclose(
+                np.sort(batch_x.ravel()), np.sort(expected.x_train.ravel())
+            )
@@ -1,16 +1,27 @@
 """Unittests for the deepblink.inference module."""
 # pylint: disable=missing-function-docstring,redefined-outer-name
 
+from unittest import mock
+
 import numpy as np
 import pytest
+import skimage.morphology
 import tensorflow as tf
 
+from deepblink.data import get_coordinate_list
+from deepblink.data import next_power
+from deepblink.data import normalize_image
+from deepblink.inference import CompiledPredictor
 from deepblink.inference import get_intensities
+from deepblink.inference import get_stride
 from deepblink.inference import predict
+from deepblink.inference import predict_batch
+from deepblink.inference import predict_tiled
 from deepblink.losses import combined_bce_rmse
 from deepblink.losses import combined_f1_rmse
 from deepblink.losses import f1_score
 from deepblink.losses import rmse
+from deepblink.networks import convolution
 
 
 def test_predict():
@@ -34,6 +45,210 @@ def test_predict():
         assert isinstance(pred, np.ndarray)
 
 
+class DenseModel:
+    """Mock model predicting one spot in the center of every cell."""
+
+    def __init__(self, cell_size: int = 4):
+        self.cell_size = cell_size
+
+    def predict(self, x, batch_size=None):  # pylint: disable=unused-argument
+        size_r, size_c = x.shape[1] // self.cell_size, x.shape[2] // self.cell_size
+        pred = np.zeros((x.shape[0], size_r, size_c, 3), dtype=np.float32)
+        pred[..., 0] = 1
+        pred[..., 1:] = 0.5
+        return pred
+
+    def predict_on_batch(self, x):
+        return self.predict(x, batch_size=len(x))
+
+    def compute_output_shape(self, input_shape):
+        return (input_shape[0], *[s // self.cell_size for s in input_shape[1:3]], 3)
+
+
+class ThresholdModel(DenseModel):
+    """Mock model predicting spots in cells with above average top-left pixels."""
+
+    def predict(self, x, batch_size=None):
+        pred = super().predict(x, batch_size)
+        pred[..., 0] = x[:, :: self.cell_size, :: self.cell_size, 0] > 0
+        return pred
+
+
+def predict_reference(image, model):
+    """Predict a single image without batching, padded to the next power of two."""
+    image = normalize_image(image)
+    image_pad = np.pad(
+        image, [(0, next_power(s, 2) - s) for s in image.shape], "reflect"
+    )
+    pred = model.predict(image_pad[None, ..., None])[0]
+    coords = get_coordinate_list(pred, max(image_pad.shape))
+    return coords[(coords[:, 0] <= image.shape[0]) & (coords[:, 1] <= image.shape[1])]
+
+
+def test_predict_batch():
+    images = [np.random.rand(*shape) for shape in [(64, 64), (40, 90), (64, 64)] * 2]
+    preds = predict_batch(images, ThresholdModel(), batch_size=3)
+    assert len(preds) == len(images)
+    for image, pred in zip(images, preds):
+        expected = predict_reference(image, ThresholdModel())
+        assert pred.shape == expected.shape
+        assert np.allclose(pred[np.lexsort(pred.T)], expected[np.lexsort(expected.T)])
+
+
+@pytest.mark.parametrize(
+    "cell_size, n_extra_down, expected", [(4, 0, 4), (4, 1, 8), (8, 0, 8)]
+)
+def test_get_stride(cell_size, n_extra_down, expected):
+    model = convolution(filters=1, cell_size=cell_size, n_extra_down=n_extra_down)
+    assert get_stride(model) == expected
+    assert get_stride(DenseModel()) is None
+
+
+def test_predict_padding():
+    # Without global layers predictions only depend on the local neighbourhood and
+    # only differ at the bottom / right borders where the padding is within reach
+    np.random.seed(42)
+    inputs = tf.keras.layers.Input((None, None, 1))
+    initializer = tf.keras.initializers.GlorotUniform(seed=42)
+    x = tf.keras.layers.Conv2D(
+        4, 3, padding="same", activation="relu", kernel_initializer=initializer
+    )(inputs)
+    x = tf.keras.layers.MaxPooling2D()(x)
+    x = tf.keras.layers.Conv2D(3, 3, padding="same", kernel_initializer=initializer)(x)
+    x = tf.keras.layers.MaxPooling2D()(x)
+    x = tf.keras.layers.Activation("sigmoid")(x)
+    model = tf.keras.Model(inputs, x)
+    assert get_stride(model) == 4
+
+    for shape in [(64, 64), (36, 90), (100, 44)]:
+        image = np.random.rand(*shape)
+        expected = predict(image, model, padding="power")
+        pred = predict(image, model, padding="stride")
+        expected, pred = [
+            coords[(coords < np.array(shape) - 8).all(axis=1)]
+            for coords in [expected, pred]
+        ]
+        assert len(pred) > 0
+        assert np.allclose(pred, expected, atol=1e-5)
+
+    with pytest.raises(ValueError):
+        predict(image, model, padding="invalid")
+
+
+def test_compiled_predictor():
+    model = convolution(filters=1)
+    predictor = CompiledPredictor(model, max_functions=2)
+    assert get_stride(predictor) == 4
+
+    images = [np.random.rand(*shape) for shape in [(64, 64), (40, 90), (64, 64)]]
+    for image, expected in zip(images, predict_batch(images, model)):
+        assert np.allclose(predict(image, predictor), expected)
+
+    # Functions are compiled once per shape and the least recently used is dropped
+    x = np.random.rand(3, 32, 32, 1)
+    assert np.allclose(predictor.predict(x, batch_size=2), model.predict_on_batch(x))
+    function = predictor.get_function((2, 32, 32, 1))
+    assert predictor.get_function((2, 32, 32, 1)) is function
+    assert len(predictor) == 2
+    predictor.get_function((4, 32, 32, 1))
+    predictor.get_function((1, 32, 32, 1))
+    assert predictor.get_function((2, 32, 32, 1)) is not function
+
+
+def test_compiled_predictor_xla_keywords():
+    # Tensorflow < 2.5 only knows experimental_compile
+    tf_function = tf.function
+
+    def legacy_function(*args, **kwargs):
+        if "input_signature" not in kwargs:  # Internal keras functions
+            return tf_function(*args, **kwargs)
+        if "jit_compile" in kwargs:
+            raise TypeError("unexpected keyword argument 'jit_compile'")
+        if "experimental_compile" in kwargs:
+            kwargs["jit_compile"] = kwargs.pop("experimental_compile")
+        return tf_function(*args, **kwargs)
+
+    x = np.random.rand(1, 32, 32, 1)
+    for jit_compile, expected in [(False, set()), (True, {"experimental_compile"})]:
+        predictor = CompiledPredictor(convolution(filters=1), jit_compile=jit_compile)
+        with mock.patch("tensorflow.function", side_effect=legacy_function) as func:
+            predictor.predict_on_batch(x)
+        calls = [c.kwargs for c in func.call_args_list if "input_signature" in c.kwargs]
+        keywords = set(calls[-1]) - {"input_signature", "autograph"}
+        assert keywords == expected
+
+
+@pytest.mark.parametrize("shape", [(100, 100), (300, 700), (513, 257)])
+def test_predict_tiled(shape):
+    image = np.random.rand(*shape)
+    pred = predict_tiled(image, DenseModel(), tile_size=128, overlap=16, batch_size=3)
+    assert pred.shape == (np.prod([s // 4 for s in shape]), 2)
+    assert len(np.unique(pred, axis=0)) == len(pred)
+
+    # Invalid arguments are rejected before predicting
+    model = DenseModel()
+    with mock.patch.object(model, "predict") as predict:
+        with pytest.raises(ValueError):
+            predict_tiled(image, model, tile_size=100)
+        with pytest.raises(ValueError):
+            predict_tiled(image, model, tile_size=128, overlap=6)
+        predict.assert_not_called()
+
+    # Models without known output shape are checked after the first batch
+    with mock.patch.object(
+        DenseModel, "compute_output_shape", side_effect=AttributeError
+    ):
+        with pytest.raises(ValueError):
+            predict_tiled(image, DenseModel(), tile_size=128, overlap=6)
+
+
+def test_predict_tiled_stride():
+    # Tiles only need to be a multiple of the stride of models with known stride
+    np.random.seed(42)
+    image = np.random.rand(200, 150)
+    model = convolution(filters=1)
+    pred = predict_tiled(image, model, tile_size=96, overlap=16)
+    assert pred.shape[1] == 2
+    assert ((pred >= 0) & (pred <= image.shape)).all()
+
+    for kwargs in [
+        dict(tile_size=98),
+        dict(tile_size=96, padding="power"),
+        dict(tile_size=96, padding="invalid"),
+    ]:
+        with pytest.raises(ValueError):
+            predict_tiled(image, model, overlap=16, **kwargs)
+
+
+class EdgeModel(DenseModel):
+    """Mock model detecting the brightest pixel shifted towards the tile center."""
+
+    def predict(self, x, batch_size=None):
+        pred = np.zeros((len(x), *self.compute_output_shape(x.shape)[1:]))
+        for idx, tile in enumerate(x[..., 0]):
+            r, c = np.unravel_index(tile.argmax(), tile.shape)
+            if tile[r, c] < 10:
+                continue
+            r, c = r + 0.5, c + 0.5 + (-0.2 if c >= tile.shape[1] / 2 else 0.6)
+            cell_r, cell_c = int(r // self.cell_size), int(c // self.cell_size)
+            offsets = [r % self.cell_size, c % self.cell_size]
+            pred[idx, cell_r, cell_c] = [1, *np.array(offsets) / self.cell_size]
+        return pred
+
+
+def test_predict_tiled_duplicates():
+    # Spot in the middle of the overlap of the first two tiles (columns 112 - 128)
+    image = np.zeros((128, 240))
+    image[50, 119] = 1
+    pred = predict_tiled(image, EdgeModel(), tile_size=128, overlap=16)
+    assert len(pred) == 1
+    assert pred[0] == pytest.approx([50.5, 119.3])
+
+    pred = predict_tiled(image, EdgeModel(), tile_size=128, overlap=16, min_distance=0)
+    assert len(pred) == 2
+    assert sorted(pred[:, 1]) == pytest.approx([119.3, 120.1])
+
+
 @pytest.fixture
 def image():
     return np.ones((100, 100))
@@ -51,3 +266,45 @@ def test_get_intensities(radius, expected, image, coordinates):
     output = get_intensities(image, coordinates, radius)
     output_sum = np.sum(output)
     assert expected == output_sum
+
+
+def test_get_intensities_reference():
+    np.random.seed(42)
+    image = np.random.rand(50, 60)
+    coordinates = np.random.uniform(0, 1, (200, 2)) * (49, 59)
+    for radius in [0, 1, 3]:
+        # Per-spot window sums as in previous versions
+        kernel = skimage.morphology.disk(radius)
+        expected = []
+        for r, c in np.round(coordinates).astype(int):
+            area = (
+                image[
+                    max(r - radius, 0) : r + radius + 1,
+                    max(c - radius, 0) : c + radius + 1,
+                ]
+                * kernel[
+                    max(radius - r, 0) : radius + image.shape[0] - r,
+                    max(radius - c, 0) : radius + image.shape[1] - c,
+                ]
+            )
+            expected.append(np.sum(area))
+
+        # Pixels are summed in a different order, results only match to tolerance
+        output = get_intensities(image, coordinates, radius)
+        assert np.allclose(output[:, 0], expected, rtol=1e-12, atol=0)
+
+
+def test_get_intensities_background(coordinates):
+    image = np.random.rand(100, 100)
+    output = get_intensities(image, coordinates, radius=1, background_width=2)
+    assert output.shape == (len(coordinates), 3)
+    assert (output[:, 0] == get_intensities(image, coordinates, radius=1)[:, 0]).all()
+
+    # Spot fully inside the image at (20, 20)
+    window = image[17:24, 17:24]
+    kernel = np.pad(skimage.morphology.disk(1), 2).astype(bool)
+    ring = skimage.morphology.disk(3).astype(bool) & ~kernel
+    assert output[1, 0] == pytest.approx(window[kernel].sum())
+    assert output[1, 1] == pytest.approx(window[ring].mean())
+    snr = (window[kernel].mean() - window[ring].mean()) / window[ring].std()
+    assert output[1, 2] == pytest.approx(snr)
@@ -2,17 +2,24 @@
 # pylint: disable=missing-function-docstring
 
 from pathlib import Path
+from unittest import mock
 import os
 import tempfile
 
 import numpy as np
 import pytest
 import skimage.io
+import tifffile
 
+from deepblink.io import ChunkedDatasetWriter
+from deepblink.io import LazyImage
 from deepblink.io import basename
 from deepblink.io import grab_files
+from deepblink.io import load_chunked_index
 from deepblink.io import load_image
 from deepblink.io import load_npz
+from deepblink.io import load_shape
+from deepblink.io import load_shard
 from deepblink.io import securename
 
 
@@ -57,6 +64,76 @@ def test_load_image():
             load_image(fname, is_rgb=False)
 
 
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_lazy_image(compression):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fname = os.path.join(temp_dir, "image.tif")
+        arr = np.random.randint(0, 2 ** 16, (2, 1, 5, 16, 20)).astype(np.uint16)
+        tifffile.imwrite(fname, arr, compression=compression)
+
+        image = LazyImage(fname)
+        full = load_image(fname)
+        assert image.shape == full.shape == (2, 5, 16, 20)
+        assert image.ndim == 4
+        assert image._array is None  # pylint: disable=protected-access
+
+        plane = image[1, 2]
+        assert plane.dtype == np.float32
+        assert (plane == full[1, 2]).all()
+        assert (image[0, :, 3] == full[0, :, 3]).all()
+
+        # Slices of the leading axes are also read page by page
+        with mock.patch.object(image, "asarray") as asarray:
+            assert (image[:, 1:3] == full[:, 1:3]).all()
+            assert (image[..., 3] == full[..., 3]).all()
+            asarray.assert_not_called()
+        assert (image.asarray() == full).all()
+        image.close()
+
+        # Samples per pixel and other formats are loaded fully
+        tifffile.imwrite(fname, arr[0, :, :3], compression=compression)
+        image = LazyImage(fname)
+        assert image.shape == load_image(fname).shape == (16, 20, 3)
+        assert (image[:, :, 1] == load_image(fname)[:, :, 1]).all()
+
+        fname = os.path.join(temp_dir, "image.png")
+        skimage.io.imsave(fname, arr[0, 0, 0].astype(np.uint8))
+        image = LazyImage(fname)
+        assert (image[:, 1] == load_image(fname)[:, 1]).all()
+
+        # Files which are loaded fully are cached while unchanged
+        with mock.patch("deepblink.io.load_image", wraps=load_image) as load:
+            assert (LazyImage(fname)[:, 1] == image[:, 1]).all()
+            load.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "ext, shape",
+    [
+        ("tif", (3, 1, 16, 20)),
+        ("tif", (16, 20, 3)),
+        ("tif", (2, 3, 16, 20)),
+        ("png", (16, 20)),
+        ("png", (16, 20, 3)),
+        ("jpg", (16, 20)),
+    ],
+)
+def test_load_shape(ext, shape):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fname = os.path.join(temp_dir, f"image.{ext}")
+        arr = np.random.randint(0, 255, shape).astype(np.uint8)
+        if ext == "tif":
+            tifffile.imwrite(fname, arr)
+        else:
+            skimage.io.imsave(fname, arr, check_contrast=False)
+
+        if not (ext == "tif" and 3 in shape):
+            with mock.patch("deepblink.io.load_image") as load:
+                assert load_shape(fname) == tuple(s for s in shape if s != 1)
+                load.assert_not_called()
+        assert load_shape(fname) == load_image(fname).shape
+
+
 def test_load_npz():
     with tempfile.TemporaryDirectory() as temp_dir:
         arr = np.zeros((3, 5, 5))
@@ -82,6 +159,33 @@ def test_load_npz():
         assert len(data) == 2
 
 
+@pytest.mark.parametrize("compression", [0, 6])
+def test_chunked_dataset_writer(compression):
+    np.random.seed(42)
+    images = np.random.uniform(0, 255, (5, 8, 8))
+    coords = [np.random.uniform(0, 7, (n, 2)) for n in [3, 0, 1, 4, 2]]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with ChunkedDatasetWriter(temp_dir, shard_size=2, compression=compression) as w:
+            for image, coord in zip(images, coords):
+                w.add("train", image, coord)
+            with pytest.raises(ValueError):
+                w.add("train", np.zeros((4, 4)), coords[0])
+            with pytest.raises(ValueError):
+                w.add("other", images[0], coords[0])
+
+        index = load_chunked_index(temp_dir)
+        shards = index["splits"]["train"]["shards"]
+        assert [shard["length"] for shard in shards] == [2, 2, 1]
+        assert not index["splits"]["valid"]["shards"]
+
+        shard = load_shard(os.path.join(temp_dir, shards[1]["file"]))
+        assert isinstance(shard["images"], np.memmap) == (compression == 0)
+        assert np.array_equal(shard["images"], images[2:4])
+        assert np.array_equal(shard["offsets"], [0, 1, 5])
+        assert np.array_equal(shard["coords"], np.concatenate(coords[2:4]))
+
+
 def test_grab_files():
     """Test function that grabs files in a directory given the extensions."""
     with tempfile.TemporaryDirectory() as temp_dir:
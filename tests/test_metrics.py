@@ -8,8 +8,12 @@ import numpy as np
 import pytest
 import scipy.spatial
 
+from deepblink.metrics import MetricsAccumulator
 from deepblink.metrics import _f1_at_cutoff
+from deepblink.metrics import _get_offsets
+from deepblink.metrics import compute_metrics
 from deepblink.metrics import euclidean_dist
+from deepblink.metrics import evaluate_dataset
 from deepblink.metrics import f1_integral
 from deepblink.metrics import f1_score
 from deepblink.metrics import linear_sum_assignment
@@ -132,7 +136,99 @@ def test_f1_integral_v1():
     assert (output[2] == np.linspace(start=0, stop=5, num=20)).all()
 
 
+@pytest.mark.parametrize("n_pred, n_true", [(1, 1), (40, 30), (30, 40), (200, 200)])
+def test_f1_integral_dense(n_pred, n_true):
+    # Sparse assignment must equal the dense assignment on the full matrix
+    np.random.seed(42)
+    true = np.random.uniform(0, 50, (n_true, 2))
+    pred = true[np.random.randint(0, n_true, n_pred)]
+    pred = pred + np.random.normal(0, 1.5, pred.shape)
+    cutoffs = np.linspace(start=0, stop=3, num=50)
+    matrix = scipy.spatial.distance.cdist(pred, true, metric="euclidean")
+
+    f1_scores, offsets, _ = f1_integral(pred, true, mdist=3, return_raw=True)
+    for cutoff, f1_value, offset in zip(cutoffs, f1_scores, offsets):
+        expected, rows, cols = _f1_at_cutoff(
+            matrix, pred, true, cutoff, return_raw=True
+        )
+        assert f1_value == pytest.approx(expected)
+        assert offset == pytest.approx(_get_offsets(pred, true, rows, cols))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_f1_integral_dense_integer(seed):
+    # Integer and duplicate coordinates cause exact matches and tied assignments
+    np.random.seed(seed)
+    true = np.random.randint(0, 8, (30, 2)).astype(float)
+    pred = np.concatenate([true[:10], np.random.randint(0, 8, (25, 2))])
+    pred[-5:] = pred[0]
+    cutoffs = np.linspace(start=0, stop=3, num=50)
+    matrix = scipy.spatial.distance.cdist(pred, true, metric="euclidean")
+
+    f1_scores, offsets, _ = f1_integral(pred, true, mdist=3, return_raw=True)
+    for cutoff, f1_value, offset in zip(cutoffs, f1_scores, offsets):
+        expected, rows, cols = _f1_at_cutoff(
+            matrix, pred, true, cutoff, return_raw=True
+        )
+        assert f1_value == expected
+        # Tied assignments can differ in the pairs but not in their distances
+        expected_offset = _get_offsets(pred, true, rows, cols)
+        assert len(offset) == len(expected_offset)
+        assert offset_euclidean(offset).sum() == pytest.approx(
+            offset_euclidean(expected_offset).sum()
+        )
+
+
 def test_offset_euclidean():
     offset = [[0, 0], [1, 1], [-1, 1], [1, 0]]
     expected = [0, np.sqrt(2), np.sqrt(2), 1]
     assert offset_euclidean(offset) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("n_jobs, chunksize", [(1, 64), (1, 2), (2, 3)])
+def test_evaluate_dataset(n_jobs, chunksize):
+    np.random.seed(42)
+    trues = [np.random.uniform(0, 50, (n, 2)) for n in range(1, 8)]
+    preds = [true + np.random.normal(0, 1, true.shape) for true in trues]
+
+    df, summary = evaluate_dataset(preds, trues, n_jobs=n_jobs, chunksize=chunksize)
+    assert len(df) == 50 * len(trues)
+    assert list(df["image"].unique()) == list(range(len(trues)))
+    for idx, (pred, true) in enumerate(zip(preds, trues)):
+        expected = compute_metrics(pred, true)
+        output = df[df["image"] == idx].reset_index(drop=True)
+        assert output["f1_score"].to_numpy() == pytest.approx(expected["f1_score"])
+        assert output["f1_integral"][0] == pytest.approx(expected["f1_integral"][0])
+
+    f1_scores = df[df["cutoff"] == 3]["f1_score"]
+    assert summary.loc["f1_score", "mean"] == pytest.approx(f1_scores.mean())
+    assert summary.loc["f1_integral", "std"] == pytest.approx(df["f1_integral"].std())
+
+    with pytest.raises(ValueError):
+        evaluate_dataset(preds, trues, chunksize=0)
+
+
+def test_metrics_accumulator():
+    np.random.seed(42)
+    trues = [np.random.uniform(0, 50, (n, 2)) for n in range(10)]
+    preds = [true + np.random.normal(0, 1, true.shape) for true in trues]
+    preds[3] = np.zeros((0, 2))
+
+    accumulator = MetricsAccumulator(mdist=3)
+    with pytest.raises(ValueError):
+        accumulator.result()
+    for pred, true in zip(preds, trues):
+        accumulator.update(pred, true)
+    summary, curve = accumulator.result()
+
+    # Same summary as from all per image metrics
+    _, expected = evaluate_dataset(preds, trues, mdist=3)
+    assert summary.to_numpy() == pytest.approx(expected.to_numpy())
+
+    # Pooled counts
+    n_pred = sum(len(pred) for pred in preds)
+    n_true = sum(len(true) for true in trues)
+    assert ((curve["tp"] + curve["fp"]) == n_pred).all()
+    assert ((curve["tp"] + curve["fn"]) == n_true).all()
+    assert curve["tp"].is_monotonic_increasing
+    assert accumulator.offset_histogram.sum() <= curve["tp"].iloc[-1]
@@ -9,6 +9,8 @@ import numpy as np
 import pandas as pd
 import pytest
 
+from deepblink.util import ColumnBuffer
+from deepblink.util import SerialExecutor
 from deepblink.util import delete_non_unique_columns
 from deepblink.util import get_from_module
 from deepblink.util import predict_shape
@@ -95,3 +97,42 @@ def test_predict_shape_1(shape, expected):
 def test_predict_shape_2(shape):
     with pytest.raises(ValueError):
         predict_shape(shape)
+
+
+def test_column_buffer():
+    buffer = ColumnBuffer(capacity=2)
+    dfs = []
+    for idx in range(10):
+        df = pd.DataFrame(
+            {
+                "value": np.random.rand(idx),
+                "offset": [[(i, i)] * i for i in range(idx)],
+                "name": [f"name_{i}" for i in range(idx)],
+            }
+        )
+        df["image"] = idx
+        buffer.append(df)
+        dfs.append(df)
+    buffer.append({"value": 1, "offset": [[]], "name": "last", "image": 10.5})
+
+    output = buffer.to_frame()
+    expected = pd.concat(dfs + [output.tail(1)], ignore_index=True)
+    assert len(buffer) == len(output) == 46
+    assert output["image"].dtype == np.float64
+    assert output["value"].tolist() == expected["value"].tolist()
+    assert output["offset"].tolist() == expected["offset"].tolist()
+    assert output["name"].tolist() == expected["name"].tolist()
+
+    with pytest.raises(ValueError):
+        buffer.append({"value": [1, 2], "name": ["a"]})
+    with pytest.raises(ValueError):
+        buffer.append({"other": [1]})
+
+
+def test_serial_executor():
+    with SerialExecutor() as executor:
+        assert executor.submit(sum, [1, 2]).result() == 3
+        assert executor.submit(dict, fn=1).result() == {"fn": 1}
+        assert list(executor.map(abs, [-1, 2])) == [1, 2]
+        with pytest.raises(ZeroDivisionError):
+            executor.submit(divmod, 1, 0).result()